@@ -78,6 +78,9 @@ CORS_ALLOW_METHODS = [
     'PUT',
 ]
 
+# Let browser clients read the pagination headers of list endpoints
+CORS_EXPOSE_HEADERS = ['Link', 'X-Next-Cursor']
+
 CORS_ALLOW_HEADERS = [
     'accept',
     'accept-encoding',
@@ -117,6 +120,12 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / "db.sqlite3",
+        # Generation workers write from several processes; take the write lock when a
+        # transaction starts and wait for it rather than failing with "database is locked"
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
     }
 }
 
@@ -135,6 +144,11 @@ DATABASES = {
 CRONJOBS = [
     ('*/2 * * * *', 'core.cron.generate_daily_articles', '>> /tmp/cron.log')
 ]
+# Keyset pagination of list and narrative endpoints: rows per page by default, and the most a
+# client may ask for with ?page_size=
+API_PAGE_SIZE = int(os.getenv('API_PAGE_SIZE', 100))
+API_MAX_PAGE_SIZE = int(os.getenv('API_MAX_PAGE_SIZE', 1000))
+
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
@@ -180,6 +194,82 @@ STATIC_URL = 'static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = 'media'
 
+# Parsed DataSource cache (column files reused across CSV reads)
+DATASOURCE_CACHE_DIR = os.path.join(MEDIA_ROOT, 'parsed_cache')
+DATASOURCE_CACHE_MAX_BYTES = int(os.getenv('DATASOURCE_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+DATASOURCE_PREVIEW_MAX_LIMIT = 1000
+DATASOURCE_SCAN_CHUNK_BYTES = 8 * 1024 * 1024
+
+# CSVs larger than this are analyzed in chunks, keeping peak memory near this budget
+ANALYSIS_MEMORY_BUDGET_BYTES = int(os.getenv('ANALYSIS_MEMORY_BUDGET_BYTES', 256 * 1024 * 1024))
+# Persist analysis aggregates per DataSource and only process appended rows on later runs
+ANALYSIS_INCREMENTAL = os.getenv('ANALYSIS_INCREMENTAL', 'True') == 'True'
+# Finished analysis results shared by agents with the same data, mapping_config and agent type
+ANALYSIS_RESULT_CACHE_TTL = 600
+ANALYSIS_RESULT_CACHE_MAX_ENTRIES = 128
+
+# Article generation: parallel LLM completions per run and the timeout for each one (seconds)
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', 4))
+LLM_CALL_TIMEOUT = int(os.getenv('LLM_CALL_TIMEOUT', 60))
+# Seconds between SSE keep-alive comments while a streamed generation waits on the LLM
+LLM_STREAM_KEEPALIVE_INTERVAL = 15
+
+# Default for POST /agent-instances/<id>/articles/ without "background": queue generation for
+# run_generation_worker and answer 202 with the job, instead of generating within the request
+ARTICLE_GENERATION_BACKGROUND = os.getenv('ARTICLE_GENERATION_BACKGROUND', 'False') == 'True'
+
+# Generation workers lease the jobs they run. A lease lasts GENERATION_LEASE_SECONDS and is extended
+# every GENERATION_HEARTBEAT_SECONDS while the job runs; a job whose worker died is reclaimed once its
+# lease expires, and failed after GENERATION_MAX_ATTEMPTS claims.
+GENERATION_LEASE_SECONDS = int(os.getenv('GENERATION_LEASE_SECONDS', 300))
+GENERATION_HEARTBEAT_SECONDS = int(os.getenv('GENERATION_HEARTBEAT_SECONDS', 60))
+GENERATION_MAX_ATTEMPTS = int(os.getenv('GENERATION_MAX_ATTEMPTS', 3))
+# Worker processes run_generation_worker starts without --processes
+GENERATION_WORKER_PROCESSES = int(os.getenv('GENERATION_WORKER_PROCESSES', 1))
+# Worker processes the cron job runs to work through the queue after queueing due agents;
+# 0 if run_generation_worker processes are running to take the jobs instead
+GENERATION_CRON_WORKERS = int(os.getenv('GENERATION_CRON_WORKERS', 1))
+# Jobs whose articles a cron worker writes together in one transaction (run_generation_worker: --write-batch)
+GENERATION_CRON_WRITE_BATCH = int(os.getenv('GENERATION_CRON_WRITE_BATCH', 10))
+# Rows per INSERT statement when articles are written in bulk
+ARTICLE_BULK_BATCH_SIZE = int(os.getenv('ARTICLE_BULK_BATCH_SIZE', 500))
+# Generation jobs an organization may run at once unless its max_concurrent_generations says otherwise,
+# so one organization with many agents can't occupy every worker
+GENERATION_ORG_MAX_CONCURRENCY = int(os.getenv('GENERATION_ORG_MAX_CONCURRENCY', 2))
+# Window over which /generation-jobs/metrics/ reports queue wait times
+GENERATION_METRICS_WINDOW_SECONDS = int(os.getenv('GENERATION_METRICS_WINDOW_SECONDS', 3600))
+
+# Token budget for a whole article prompt, per model; models not listed get LLM_PROMPT_TOKEN_BUDGET.
+# Analysis insights are ranked and the least important dropped to stay within it.
+LLM_PROMPT_TOKEN_BUDGET = int(os.getenv('LLM_PROMPT_TOKEN_BUDGET', 1500))
+# e.g. {'openai/gpt-4o': 4000}
+LLM_PROMPT_TOKEN_BUDGETS = {}
+
+# On-disk cache of LLM completions keyed by model, temperature, prompt and report number
+LLM_CACHE_ENABLED = os.getenv('LLM_CACHE_ENABLED', 'True') == 'True'
+LLM_CACHE_PATH = os.getenv('LLM_CACHE_PATH', BASE_DIR / 'llm_cache.sqlite3')
+LLM_CACHE_TTL = int(os.getenv('LLM_CACHE_TTL', 24 * 60 * 60))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv('LLM_CACHE_MAX_ENTRIES', 10000))
+
+# Pooled keep-alive HTTP connections to the LLM API, shared by all generation runs in a process
+LLM_HTTP_MAX_CONNECTIONS = int(os.getenv('LLM_HTTP_MAX_CONNECTIONS', 10))
+LLM_HTTP_KEEPALIVE_EXPIRY = int(os.getenv('LLM_HTTP_KEEPALIVE_EXPIRY', 60))
+
+# Process-wide limits on LLM API calls: request rate (token bucket), adaptive concurrency
+# (grows while calls finish within LLM_LATENCY_TARGET seconds, halves on 429s or slow calls),
+# retries with jittered exponential backoff, and a circuit breaker that switches generation to
+# default content after consecutive failures until a probe call succeeds
+LLM_RATE_LIMIT_PER_SECOND = float(os.getenv('LLM_RATE_LIMIT_PER_SECOND', 5))
+LLM_RATE_LIMIT_BURST = int(os.getenv('LLM_RATE_LIMIT_BURST', 10))
+LLM_ADAPTIVE_MIN_CONCURRENCY = 1
+LLM_ADAPTIVE_MAX_CONCURRENCY = int(os.getenv('LLM_ADAPTIVE_MAX_CONCURRENCY', 16))
+LLM_LATENCY_TARGET = int(os.getenv('LLM_LATENCY_TARGET', 30))
+LLM_RETRY_ATTEMPTS = int(os.getenv('LLM_RETRY_ATTEMPTS', 4))
+LLM_RETRY_BASE_WAIT = 0.5
+LLM_RETRY_MAX_WAIT = 20
+LLM_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('LLM_CIRCUIT_FAILURE_THRESHOLD', 5))
+LLM_CIRCUIT_RESET_SECONDS = int(os.getenv('LLM_CIRCUIT_RESET_SECONDS', 60))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
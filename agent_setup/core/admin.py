@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Organization, User, DataSource, AgentInstance, Article
+from .models import Organization, User, DataSource, AgentInstance, AgentInstanceStats, Article, GenerationJob
 
 @admin.register(Organization)
 class OrganizationAdmin(admin.ModelAdmin):
@@ -17,6 +17,14 @@ class DataSourceAdmin(admin.ModelAdmin):
 class AgentInstanceAdmin(admin.ModelAdmin):
     list_display = ['agent_id', 'agent_instance_name', 'organization', 'datasource']
 
+@admin.register(AgentInstanceStats)
+class AgentInstanceStatsAdmin(admin.ModelAdmin):
+    list_display = ['agent_instance', 'total_articles', 'last_run_at', 'last_run_seconds', 'failed_runs']
+
 @admin.register(Article)
 class ArticleAdmin(admin.ModelAdmin):
-    list_display = ['title', 'agent_instance', 'created_at']
\ No newline at end of file
+    list_display = ['title', 'agent_instance', 'content_length', 'created_at']
+
+@admin.register(GenerationJob)
+class GenerationJobAdmin(admin.ModelAdmin):
+    list_display = ['agent_instance', 'status', 'stage', 'articles_created', 'attempts', 'lease_owner', 'created_at', 'finished_at']
@@ -0,0 +1,128 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F, Max, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import AgentInstance, AgentInstanceStats, Article
+
+# Running totals per agent instance (AgentInstanceStats), updated in the same
+# transaction as the articles they count, so metrics are read from one row
+# instead of aggregating the agent's articles. Articles deleted or written
+# some other way aren't counted; `manage.py sync_agent_stats` recomputes the
+# totals from the articles.
+
+
+def update_agent_stats(articles, run_seconds=None):
+    """
+    Add just-written articles to their agent instances' stats. Call it within the
+    transaction that wrote them. run_seconds maps agent instance ids to how long
+    the run that generated their articles took.
+    """
+    run_seconds = run_seconds or {}
+    totals = defaultdict(lambda: {'articles': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'last_created_at': None})
+    for article in articles:
+        total = totals[article.agent_instance_id]
+        total['articles'] += 1
+        total['prompt_tokens'] += article.prompt_tokens or 0
+        total['completion_tokens'] += article.completion_tokens or 0
+        if total['last_created_at'] is None or article.created_at > total['last_created_at']:
+            total['last_created_at'] = article.created_at
+    if not totals:
+        return
+
+    now = timezone.now()
+    AgentInstanceStats.objects.bulk_create(
+        [AgentInstanceStats(agent_instance_id=agent_instance_id) for agent_instance_id in totals],
+        ignore_conflicts=True
+    )
+    # A fixed order keeps concurrent writers from deadlocking on each other's rows
+    for agent_instance_id in sorted(totals):
+        total = totals[agent_instance_id]
+        values = {
+            'total_articles': F('total_articles') + total['articles'],
+            'prompt_tokens': F('prompt_tokens') + total['prompt_tokens'],
+            'completion_tokens': F('completion_tokens') + total['completion_tokens'],
+            'last_run_at': total['last_created_at'],
+            'updated_at': now,
+        }
+        if agent_instance_id in run_seconds:
+            values['last_run_seconds'] = run_seconds[agent_instance_id]
+        AgentInstanceStats.objects.filter(agent_instance_id=agent_instance_id).update(**values)
+
+
+def record_run_seconds(agent_instance_id, seconds):
+    """
+    Record how long a run took whose articles were written one at a time.
+    """
+    AgentInstanceStats.objects.filter(agent_instance_id=agent_instance_id).update(
+        last_run_seconds=seconds, updated_at=timezone.now()
+    )
+
+
+def record_failed_run(agent_instance_id):
+    now = timezone.now()
+    with transaction.atomic():
+        AgentInstanceStats.objects.get_or_create(agent_instance_id=agent_instance_id)
+        AgentInstanceStats.objects.filter(agent_instance_id=agent_instance_id).update(
+            failed_runs=F('failed_runs') + 1, last_failed_at=now, updated_at=now
+        )
+
+
+def sync_agent_stats(agent_instance_ids=None):
+    """
+    Recompute article and token totals from the articles themselves, for the
+    given agent instances or all of them. Returns the number of stats rows written.
+    """
+    agents = AgentInstance.objects.all()
+    if agent_instance_ids is not None:
+        agents = agents.filter(id__in=agent_instance_ids)
+    totals = {
+        row['agent_instance']: row for row in
+        Article.objects.filter(agent_instance__in=agents).values('agent_instance').annotate(
+            articles=Count('id'),
+            prompt=Coalesce(Sum('prompt_tokens'), 0),
+            completion=Coalesce(Sum('completion_tokens'), 0),
+            last_created_at=Max('created_at')
+        )
+    }
+    now = timezone.now()
+    stats = []
+    for agent_instance_id in agents.values_list('id', flat=True):
+        total = totals.get(agent_instance_id, {})
+        stats.append(AgentInstanceStats(
+            agent_instance_id=agent_instance_id,
+            total_articles=total.get('articles', 0),
+            prompt_tokens=total.get('prompt', 0),
+            completion_tokens=total.get('completion', 0),
+            last_run_at=total.get('last_created_at'),
+            updated_at=now
+        ))
+    # Run durations and failures can't be recovered from the articles and are kept
+    AgentInstanceStats.objects.bulk_create(
+        stats, update_conflicts=True, unique_fields=['agent_instance'],
+        update_fields=['total_articles', 'prompt_tokens', 'completion_tokens', 'last_run_at', 'updated_at']
+    )
+    return len(stats)
+
+
+def get_agent_metrics(agent_instance):
+    """
+    The metrics reported for an agent instance, from its stats row. Load agent
+    instances with select_related('stats') to read many without a query each.
+    """
+    try:
+        stats = agent_instance.stats
+    except AgentInstanceStats.DoesNotExist:
+        stats = AgentInstanceStats(agent_instance=agent_instance)
+    return {
+        "agent_instance_id": agent_instance.id,
+        "total_articles": stats.total_articles,
+        "last_run": stats.last_run_at,
+        "last_run_seconds": stats.last_run_seconds,
+        "failed_runs": stats.failed_runs,
+        "last_failed_at": stats.last_failed_at,
+        "prompt_tokens": stats.prompt_tokens,
+        "completion_tokens": stats.completion_tokens,
+    }
@@ -0,0 +1,696 @@
+import copy
+import hashlib
+import io
+import json
+import math
+import os
+import threading
+import time
+import warnings
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+from .csv_stream import iter_records
+from .datasource_cache import get_read_csv_kwargs, read_datasource
+from .models import DataSourceAnalysisState
+
+FINANCE_AGENT_NAMES = ['finance', 'finance agent', 'financial']
+SALES_AGENT_NAMES = ['sales', 'sales agent', 'sales team']
+MARKETING_AGENT_NAMES = ['marketing', 'marketing agent', 'marketing team', 'digital marketing']
+
+RECENT_ROWS = 5
+TOP_CATEGORIES = 5
+ROW_KEY = '_row'
+MONTH_KEY = '_month'
+TAIL_HASH_BYTES = 64 * 1024
+
+
+def get_agent_type(agent_name):
+    """
+    Map an agent instance name to the analysis it gets: finance, sales, marketing or general.
+    """
+    name = agent_name.lower()
+    if name in FINANCE_AGENT_NAMES:
+        return 'finance'
+    if name in SALES_AGENT_NAMES:
+        return 'sales'
+    if name in MARKETING_AGENT_NAMES:
+        return 'marketing'
+    return 'general'
+
+
+def get_analysis_memory_budget():
+    return getattr(settings, 'ANALYSIS_MEMORY_BUDGET_BYTES', 256 * 1024 * 1024)
+
+
+def should_analyze_in_chunks(datasource):
+    """
+    Files larger than the analysis memory budget are analyzed chunk by chunk.
+    """
+    return os.path.getsize(datasource.file.path) > get_analysis_memory_budget()
+
+
+def estimate_chunk_rows(path, read_kwargs, memory_budget, sample_rows=1000):
+    """
+    Rows per chunk so that a parsed chunk, plus working copies, stays within the memory budget.
+    """
+    sample = pd.read_csv(path, nrows=sample_rows, **read_kwargs)
+    if sample.empty:
+        return sample_rows
+    bytes_per_row = sample.memory_usage(deep=True, index=False).sum() / len(sample)
+    # Sorting and group-by on a chunk make a few temporary copies of it
+    return max(sample_rows, int(memory_budget / (bytes_per_row * 4)))
+
+
+def perform_chunked_analysis(datasource, mapping_config, agent_name, memory_budget=None):
+    """
+    Out-of-core equivalent of perform_comprehensive_analysis for CSVs larger than RAM.
+
+    Streams the file with read_csv(chunksize=...) and folds every chunk into
+    mergeable partial aggregates, so peak memory is bounded by the memory
+    budget instead of the file size. Returns (analysis, row_count).
+    """
+    memory_budget = memory_budget or get_analysis_memory_budget()
+    read_kwargs = get_read_csv_kwargs(datasource.connection_params)
+    path = datasource.file.path
+    chunk_rows = estimate_chunk_rows(path, read_kwargs, memory_budget)
+    print(f"Performing chunked analysis for {agent_name} with {chunk_rows} rows per chunk")
+
+    accumulator = AnalysisAccumulator(mapping_config, agent_name)
+    for chunk in pd.read_csv(path, chunksize=chunk_rows, **read_kwargs):
+        accumulator.update(chunk)
+
+    analysis = accumulator.finalize()
+    print(f"Chunked analysis completed with {len(analysis)} insights over {accumulator.rows} rows")
+    return analysis, accumulator.rows
+
+
+def perform_incremental_analysis(datasource, mapping_config, agent_name, memory_budget=None):
+    """
+    Analysis that only reads rows appended to the CSV since the previous run.
+
+    The AnalysisAccumulator state is persisted per DataSource, mapping_config
+    and agent type together with the byte offset it covers. When the file has
+    only grown since then (same header, same bytes just before the stored
+    offset), the saved aggregates are resumed and fed the new rows; otherwise
+    the file is analyzed from the start. Returns (analysis, row_count).
+    """
+    memory_budget = memory_budget or get_analysis_memory_budget()
+    read_kwargs = get_read_csv_kwargs(datasource.connection_params)
+    path = datasource.file.path
+    state_key = get_analysis_state_key(datasource, mapping_config, agent_name)
+
+    with open(path, 'rb') as handle:
+        _, header = next(iter_records(handle), (0, b''))
+    header_hash = hashlib.sha256(header).hexdigest()
+    boundary = _last_record_boundary(path)
+
+    saved = DataSourceAnalysisState.objects.filter(datasource=datasource, state_key=state_key).first()
+    if (saved and saved.header_hash == header_hash and len(header) <= saved.byte_offset <= boundary
+            and _tail_hash(path, saved.byte_offset) == saved.tail_hash):
+        accumulator = AnalysisAccumulator.from_state(saved.state, mapping_config, agent_name)
+        start = saved.byte_offset
+    else:
+        accumulator = AnalysisAccumulator(mapping_config, agent_name)
+        start = len(header)
+
+    new_rows = 0
+    if (start == len(header) and 0 < boundary - start and boundary == os.path.getsize(path)
+            and not should_analyze_in_chunks(datasource)):
+        # A full analysis of a file that fits in memory reads through the parsed cache
+        df = read_datasource(datasource)
+        accumulator.update(df)
+        new_rows = len(df)
+    elif start < boundary:
+        chunk_rows = estimate_chunk_rows(path, read_kwargs, memory_budget)
+        reader = io.BufferedReader(_ByteRangeReader(path, header, start, boundary))
+        with reader:
+            for chunk in pd.read_csv(reader, chunksize=chunk_rows, **read_kwargs):
+                accumulator.update(chunk)
+                new_rows += len(chunk)
+    elif accumulator.columns is None:
+        # Header only: record the columns so finalize() still knows them
+        accumulator.update(pd.read_csv(path, nrows=0, **read_kwargs))
+    print(f"Incremental analysis for {agent_name}: {new_rows} new rows from byte {start}, {accumulator.rows} rows total")
+
+    DataSourceAnalysisState.objects.update_or_create(
+        datasource=datasource,
+        state_key=state_key,
+        defaults={
+            'byte_offset': boundary,
+            'row_count': accumulator.rows,
+            'header_hash': header_hash,
+            'tail_hash': _tail_hash(path, boundary),
+            'state': accumulator.to_state(),
+        }
+    )
+    return accumulator.finalize(), accumulator.rows
+
+
+def get_analysis_state_key(datasource, mapping_config, agent_name):
+    identity = json.dumps({
+        'mapping_config': mapping_config,
+        'agent_type': get_agent_type(agent_name),
+        'read_csv': get_read_csv_kwargs(datasource.connection_params),
+    }, sort_keys=True)
+    return hashlib.sha256(identity.encode()).hexdigest()
+
+
+def _last_record_boundary(path):
+    """
+    Byte offset just past the last newline, so a partially written final line is
+    left for the next run. Assumes the final line is not inside a quoted field.
+    """
+    size = os.path.getsize(path)
+    with open(path, 'rb') as handle:
+        position = size
+        while position > 0:
+            block_start = max(0, position - TAIL_HASH_BYTES)
+            handle.seek(block_start)
+            block = handle.read(position - block_start)
+            newline = block.rfind(b'\n')
+            if newline != -1:
+                return block_start + newline + 1
+            position = block_start
+    return size
+
+
+def _tail_hash(path, offset):
+    # Hash of the bytes just before offset: cheap evidence the processed part is unchanged
+    with open(path, 'rb') as handle:
+        handle.seek(max(0, offset - TAIL_HASH_BYTES))
+        return hashlib.sha256(handle.read(offset - max(0, offset - TAIL_HASH_BYTES))).hexdigest()
+
+
+class _ByteRangeReader(io.RawIOBase):
+    """
+    File-like view of the CSV header followed by bytes [start, end) of the file.
+    """
+
+    def __init__(self, path, header, start, end):
+        self._prefix = header
+        self._handle = open(path, 'rb')
+        self._handle.seek(start)
+        self._remaining = end - start
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self._prefix:
+            size = min(len(buffer), len(self._prefix))
+            buffer[:size] = self._prefix[:size]
+            self._prefix = self._prefix[size:]
+            return size
+        if self._remaining <= 0:
+            return 0
+        data = self._handle.read(min(len(buffer), self._remaining))
+        buffer[:len(data)] = data
+        self._remaining -= len(data)
+        return len(data)
+
+    def close(self):
+        self._handle.close()
+        super().close()
+
+
+def get_analysis_cache_key(datasource, mapping_config, agent_name):
+    # File identity from stat() rather than a content hash, so appending rows
+    # doesn't cost a full re-hash of the file on every run
+    stat = os.stat(datasource.file.path)
+    identity = json.dumps({
+        'data': [os.path.abspath(datasource.file.path), stat.st_size, stat.st_mtime_ns],
+        'read_csv': get_read_csv_kwargs(datasource.connection_params),
+        'mapping_config': mapping_config,
+        'agent_type': get_agent_type(agent_name),
+    }, sort_keys=True)
+    return hashlib.sha256(identity.encode()).hexdigest()
+
+
+class AnalysisResultCache:
+    """
+    In-process LRU cache of finished analysis results with a time-to-live.
+
+    Entries are keyed by data fingerprint, mapping_config and agent type, so a
+    cron run over many agents sharing one data source analyzes it only once.
+    Cached values are deep-copied on the way out so callers can't alter them.
+    """
+
+    def __init__(self, max_entries, ttl_seconds):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[0] > self.ttl_seconds:
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return copy.deepcopy(entry[1])
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), copy.deepcopy(value))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+analysis_result_cache = AnalysisResultCache(
+    max_entries=getattr(settings, 'ANALYSIS_RESULT_CACHE_MAX_ENTRIES', 128),
+    ttl_seconds=getattr(settings, 'ANALYSIS_RESULT_CACHE_TTL', 600),
+)
+
+
+class AnalysisAccumulator:
+    """
+    Mergeable partial aggregates for perform_comprehensive_analysis.
+
+    Every statistic is kept in a form that can be updated one chunk at a time:
+    counts, sums and M2 (for the variance), min/max, per-group sums and counts,
+    and the handful of rows at either end of the date ordering that trend and
+    growth calculations need.
+    """
+
+    def __init__(self, mapping_config, agent_name):
+        self.agent_type = get_agent_type(agent_name)
+        self.metric_columns = mapping_config.get('metric_columns', [])
+        self.category_columns = mapping_config.get('category_columns', [])
+        self.date_column = mapping_config.get('date_column')
+        self.rows = 0
+        self.columns = None
+        self.metrics = {}
+        self.sorted_head = None
+        self.sorted_tail = None
+        self.file_first = None
+        self.file_last = None
+        self.profit_margin_sum = 0.0
+        self.acquisition_cost_sum = 0.0
+        self.groups = {}
+        self.months = {}
+        self.seasonal_failed = False
+
+    def update(self, chunk):
+        """
+        Fold a chunk (or a whole DataFrame) into the aggregates.
+
+        The chunk is sorted once by date, all metric statistics come from one
+        NumPy pass over the metric matrix, and every category, region and month
+        aggregate comes from a single multi-key groupby that is then rolled up
+        per key.
+        """
+        if self.columns is None:
+            self.columns = list(chunk.columns)
+            if not self.date_column:
+                self.date_column = self.columns[0]
+        if chunk.empty:
+            return
+        if self.date_column not in chunk.columns:
+            raise KeyError(self.date_column)
+
+        chunk = chunk.set_axis(pd.RangeIndex(self.rows, self.rows + len(chunk)))
+        tracked = self._tracked_columns()
+        matrix = chunk[tracked].to_numpy(dtype=float)
+
+        self._update_metrics(tracked, matrix)
+        self._update_ordering(chunk, tracked)
+        self._update_ratios(tracked, matrix)
+        self._update_groups(chunk)
+        self.rows += len(chunk)
+
+    def finalize(self):
+        """
+        Produce the same analysis dict perform_comprehensive_analysis returns.
+        """
+        analysis = {}
+        if self.columns is None:
+            return analysis
+        columns = self.columns
+
+        for metric in self.metric_columns:
+            if metric in columns:
+                analysis[metric] = self._finalize_metric(metric)
+
+        if self.agent_type == 'sales':
+            for category in self.category_columns:
+                if category in columns:
+                    analysis[f'{category}_insights'] = self._finalize_category(category)
+
+        if self.agent_type == 'finance' and 'revenue' in columns and 'orders' in columns:
+            first_margin = self._profit_margin(self.file_first)
+            last_margin = self._profit_margin(self.file_last)
+            analysis['profitability'] = {
+                'avg_profit_margin': self.profit_margin_sum / self.rows if self.rows else float('nan'),
+                'profit_trend': 'increasing' if last_margin > first_margin else 'decreasing'
+            }
+            if self.rows >= 2:
+                # The mean of consecutive differences telescopes to (last - first) / (n - 1)
+                first_revenue = self.sorted_head['revenue'].iloc[0]
+                last_revenue = self.sorted_tail['revenue'].iloc[-1]
+                revenue_trend = (last_revenue - first_revenue) / (self.rows - 1)
+                analysis['cash_flow'] = {
+                    'avg_daily_revenue_change': revenue_trend,
+                    'cash_flow_stability': 'stable' if abs(revenue_trend) < self._mean('revenue') * 0.1 else 'volatile'
+                }
+
+        if self.agent_type == 'marketing':
+            if 'customers' in columns and 'revenue' in columns:
+                total_customers = self.metrics['customers']['sum']
+                analysis['marketing_metrics'] = {
+                    'avg_customer_acquisition_cost': self.acquisition_cost_sum / self.rows if self.rows else float('nan'),
+                    'customer_lifetime_value': self.metrics['revenue']['sum'] / total_customers if total_customers > 0 else 0,
+                    'conversion_rate': (self.metrics['orders']['sum'] / total_customers * 100) if 'orders' in columns and total_customers > 0 else 0
+                }
+            if 'product_category' in columns and 'revenue' in columns:
+                customers_agg = 'sum' if 'customers' in columns else 'count'
+                groups = self._sorted_groups('product_category')
+                analysis['campaign_performance'] = {
+                    ('revenue', 'sum'): {key: _round(group['revenue_sum']) for key, group in groups},
+                    ('revenue', 'mean'): {key: _round(_safe_div(group['revenue_sum'], group['revenue_count'])) for key, group in groups},
+                    ('revenue', 'count'): {key: group['revenue_count'] for key, group in groups},
+                    ('customers', customers_agg): {
+                        key: _round(group['customers_sum']) if customers_agg == 'sum' else group['rows'] for key, group in groups
+                    },
+                }
+            if 'region' in columns and 'revenue' in columns:
+                groups = self._sorted_groups('region')
+                analysis['market_penetration'] = {
+                    'customers': {key: _round(group['customers_sum']) if 'customers' in columns else group['rows'] for key, group in groups},
+                    'revenue': {key: _round(group['revenue_sum']) for key, group in groups},
+                }
+
+        if 'region' in columns and 'revenue' in columns:
+            groups = self._sorted_groups('region')
+            analysis['regional_insights'] = {
+                ('revenue', 'sum'): {key: _round(group['revenue_sum']) for key, group in groups},
+                ('revenue', 'mean'): {key: _round(_safe_div(group['revenue_sum'], group['revenue_count'])) for key, group in groups},
+                ('revenue', 'count'): {key: group['revenue_count'] for key, group in groups},
+            }
+
+        if self.date_column in columns and not self.seasonal_failed and self._seasonal_column():
+            analysis['seasonal_patterns'] = {
+                month: _safe_div(partial['sum'], partial['count'])
+                for month, partial in sorted(self.months.items()) if partial['count']
+            }
+
+        return analysis
+
+    def to_state(self):
+        """
+        JSON-serializable snapshot of the aggregates, restorable with from_state().
+        """
+        return {
+            'rows': self.rows,
+            'columns': self.columns,
+            'date_column': self.date_column,
+            'metrics': {column: {name: _encode_number(value) for name, value in partial.items()}
+                        for column, partial in self.metrics.items()},
+            'sorted_head': _frame_to_state(self.sorted_head),
+            'sorted_tail': _frame_to_state(self.sorted_tail),
+            'file_first': _frame_to_state(self.file_first),
+            'file_last': _frame_to_state(self.file_last),
+            'profit_margin_sum': _encode_number(self.profit_margin_sum),
+            'acquisition_cost_sum': _encode_number(self.acquisition_cost_sum),
+            # Lists of [key, value] pairs keep non-string group keys intact through JSON
+            'groups': {column: [[key, {name: _encode_number(value) for name, value in group.items()}]
+                                for key, group in groups.items()]
+                       for column, groups in self.groups.items()},
+            'months': [[month, partial] for month, partial in self.months.items()],
+            'seasonal_failed': self.seasonal_failed,
+        }
+
+    @classmethod
+    def from_state(cls, state, mapping_config, agent_name):
+        accumulator = cls(mapping_config, agent_name)
+        accumulator.rows = state['rows']
+        accumulator.columns = state['columns']
+        accumulator.date_column = state['date_column']
+        accumulator.metrics = {column: {name: _decode_number(value) for name, value in partial.items()}
+                               for column, partial in state['metrics'].items()}
+        accumulator.sorted_head = _frame_from_state(state['sorted_head'], accumulator.date_column)
+        accumulator.sorted_tail = _frame_from_state(state['sorted_tail'], accumulator.date_column)
+        accumulator.file_first = _frame_from_state(state['file_first'], accumulator.date_column)
+        accumulator.file_last = _frame_from_state(state['file_last'], accumulator.date_column)
+        accumulator.profit_margin_sum = _decode_number(state['profit_margin_sum'])
+        accumulator.acquisition_cost_sum = _decode_number(state['acquisition_cost_sum'])
+        accumulator.groups = {column: {_hashable(key): {name: _decode_number(value) for name, value in group.items()}
+                                       for key, group in groups}
+                              for column, groups in state['groups'].items()}
+        accumulator.months = {month: partial for month, partial in state['months']}
+        accumulator.seasonal_failed = state['seasonal_failed']
+        return accumulator
+
+    def _tracked_columns(self):
+        wanted = list(self.metric_columns) + ['revenue', 'orders', 'customers']
+        return [column for column in dict.fromkeys(wanted) if column in self.columns]
+
+    def _group_columns(self):
+        wanted = []
+        if self.agent_type == 'sales':
+            wanted += self.category_columns
+        if self.agent_type == 'marketing':
+            wanted.append('product_category')
+        wanted.append('region')
+        return [column for column in dict.fromkeys(wanted) if column in self.columns]
+
+    def _seasonal_column(self):
+        if 'revenue' in self.columns:
+            return 'revenue'
+        if self.metric_columns and self.metric_columns[0] in self.columns:
+            return self.metric_columns[0]
+        return None
+
+    def _update_metrics(self, tracked, matrix):
+        present = ~np.isnan(matrix)
+        counts = present.sum(axis=0)
+        sums = np.where(present, matrix, 0).sum(axis=0)
+        means = np.divide(sums, counts, out=np.zeros_like(sums), where=counts > 0)
+        m2 = np.where(present, (matrix - means) ** 2, 0).sum(axis=0)
+        with np.errstate(invalid='ignore'), warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            mins = np.nanmin(matrix, axis=0)
+            maxs = np.nanmax(matrix, axis=0)
+
+        for index, column in enumerate(tracked):
+            partial = _empty_metric()
+            if counts[index]:
+                partial = {
+                    'count': int(counts[index]),
+                    'sum': float(sums[index]),
+                    'm2': float(m2[index]),
+                    'min': float(mins[index]),
+                    'max': float(maxs[index]),
+                }
+            self.metrics[column] = _merge_metric(self.metrics.get(column, _empty_metric()), partial)
+
+    def _update_ordering(self, chunk, tracked):
+        keep = list(dict.fromkeys([self.date_column] + tracked))
+        frame = chunk[keep].assign(**{ROW_KEY: chunk.index})
+        order = frame[self.date_column].reset_index(drop=True).sort_values(kind='mergesort', na_position='last').index
+
+        head = frame.head(0) if self.sorted_head is None else self.sorted_head
+        tail = frame.head(0) if self.sorted_tail is None else self.sorted_tail
+        self.sorted_head = self._sort(pd.concat([head, frame.iloc[order[:1]]])).head(1)
+        self.sorted_tail = self._sort(pd.concat([tail, frame.iloc[order[-RECENT_ROWS:]]])).tail(RECENT_ROWS)
+
+        if self.file_first is None:
+            self.file_first = frame.head(1)
+        self.file_last = frame.tail(1)
+
+    def _sort(self, frame):
+        return frame.sort_values(by=[self.date_column, ROW_KEY], na_position='last', kind='mergesort')
+
+    def _update_ratios(self, tracked, matrix):
+        def ratio_sum(numerator, denominator):
+            with np.errstate(divide='ignore', invalid='ignore'):
+                ratios = matrix[:, tracked.index(numerator)] / matrix[:, tracked.index(denominator)]
+            return float(np.nan_to_num(ratios, nan=0.0, posinf=np.inf, neginf=-np.inf).sum())
+
+        if self.agent_type == 'finance' and 'revenue' in tracked and 'orders' in tracked:
+            self.profit_margin_sum += ratio_sum('revenue', 'orders')
+        if self.agent_type == 'marketing' and 'revenue' in tracked and 'customers' in tracked:
+            self.acquisition_cost_sum += ratio_sum('revenue', 'customers')
+
+    def _update_groups(self, chunk):
+        group_columns = self._group_columns()
+        seasonal_column = self._seasonal_column()
+        frame = pd.DataFrame({column: chunk[column] for column in group_columns}, index=chunk.index)
+        keys = list(group_columns)
+
+        if seasonal_column and not self.seasonal_failed:
+            try:
+                frame[MONTH_KEY] = pd.to_datetime(chunk[self.date_column]).dt.month
+                keys.append(MONTH_KEY)
+            except (ValueError, TypeError):
+                self.seasonal_failed = True
+        if not keys:
+            return
+
+        aggregations = {'rows': (ROW_KEY, 'size'), 'first_row': (ROW_KEY, 'min')}
+        frame[ROW_KEY] = chunk.index
+        for value_column in dict.fromkeys(['revenue', 'customers', seasonal_column]):
+            if value_column and value_column in chunk.columns:
+                frame[value_column] = chunk[value_column]
+                aggregations[f'{value_column}_sum'] = (value_column, 'sum')
+                aggregations[f'{value_column}_count'] = (value_column, 'count')
+
+        # One pass over the rows; everything below works on the (small) grouped result
+        combined = frame.groupby(keys, dropna=False, sort=False).agg(**aggregations)
+        rollup = {name: ('min' if name == 'first_row' else 'sum') for name in combined.columns}
+
+        for column in group_columns:
+            rolled = combined.groupby(level=column, dropna=True).agg(rollup)
+            groups = self.groups.setdefault(column, {})
+            for key, row in zip(rolled.index, rolled.to_dict(orient='records')):
+                group = groups.get(key)
+                if group is None:
+                    groups[key] = {name: _native(value) for name, value in row.items()}
+                    continue
+                group['first_row'] = min(group['first_row'], _native(row['first_row']))
+                for name, value in row.items():
+                    if name != 'first_row':
+                        group[name] = group.get(name, 0) + _native(value)
+
+        if MONTH_KEY in keys:
+            rolled = combined.groupby(level=MONTH_KEY, dropna=True).agg(rollup)
+            for month, row in zip(rolled.index, rolled.to_dict(orient='records')):
+                partial = self.months.setdefault(int(month), {'sum': 0, 'count': 0})
+                partial['sum'] += _native(row[f'{seasonal_column}_sum'])
+                partial['count'] += _native(row[f'{seasonal_column}_count'])
+
+    def _mean(self, column):
+        partial = self.metrics.get(column, _empty_metric())
+        return _safe_div(partial['sum'], partial['count'])
+
+    def _finalize_metric(self, metric):
+        partial = self.metrics[metric]
+        mean_val = self._mean(metric)
+        std_val = math.sqrt(partial['m2'] / (partial['count'] - 1)) if partial['count'] > 1 else float('nan')
+
+        recent_values = self.sorted_tail[metric].tolist() if self.sorted_tail is not None else []
+        if len(recent_values) >= 2:
+            recent_trend = recent_values[-1] - recent_values[0]
+            trend_direction = 'increasing' if recent_trend > 0 else 'decreasing'
+            trend_strength = abs(recent_trend) / mean_val if mean_val > 0 else 0
+        else:
+            trend_direction = 'stable'
+            trend_strength = 0
+
+        if self.rows >= 2:
+            first_value = self.sorted_head[metric].iloc[0]
+            last_value = self.sorted_tail[metric].iloc[-1]
+            growth_rate = ((last_value - first_value) / first_value * 100) if first_value > 0 else 0
+        else:
+            growth_rate = 0
+
+        return {
+            'mean': mean_val,
+            'max': partial['max'],
+            'min': partial['min'],
+            'std': std_val,
+            'trend_direction': trend_direction,
+            'trend_strength': trend_strength,
+            'growth_rate': growth_rate,
+            'recent_values': recent_values
+        }
+
+    def _finalize_category(self, category):
+        groups = self.groups.get(category, {})
+        top = sorted(groups.items(), key=lambda item: (-item[1]['rows'], item[1]['first_row']))[:TOP_CATEGORIES]
+        if 'revenue' not in self.columns:
+            return {}
+        return {
+            key: {
+                'count': group['rows'],
+                'total_revenue': group['revenue_sum'],
+                'avg_revenue': group['revenue_sum'] / group['rows'] if group['rows'] > 0 else 0
+            }
+            for key, group in top
+        }
+
+    def _sorted_groups(self, column):
+        return sorted(self.groups.get(column, {}).items(), key=lambda item: item[0])
+
+    def _profit_margin(self, row):
+        return (row['revenue'] / row['orders']).fillna(0).iloc[0]
+
+
+def _empty_metric():
+    return {'count': 0, 'sum': 0, 'm2': 0.0, 'min': None, 'max': None}
+
+
+def _merge_metric(left, right):
+    """
+    Combine two partial aggregates (Chan et al. parallel variance).
+    """
+    if not left['count']:
+        return dict(right)
+    if not right['count']:
+        return dict(left)
+    count = left['count'] + right['count']
+    delta = right['sum'] / right['count'] - left['sum'] / left['count']
+    return {
+        'count': count,
+        'sum': left['sum'] + right['sum'],
+        'm2': left['m2'] + right['m2'] + delta ** 2 * left['count'] * right['count'] / count,
+        'min': min(left['min'], right['min']),
+        'max': max(left['max'], right['max']),
+    }
+
+
+def _safe_div(numerator, denominator):
+    return numerator / denominator if denominator else float('nan')
+
+
+def _round(value):
+    return round(value, 2) if isinstance(value, float) else value
+
+
+def _native(value):
+    return value.item() if hasattr(value, 'item') else value
+
+
+def _encode_number(value):
+    # JSON (and Postgres jsonb) has no inf/nan, so non-finite floats are stored as strings
+    if isinstance(value, float) and not math.isfinite(value):
+        return str(value)
+    return value
+
+
+def _decode_number(value):
+    return float(value) if value in ('inf', '-inf', 'nan') else value
+
+
+def _hashable(value):
+    return tuple(value) if isinstance(value, list) else value
+
+
+def _frame_to_state(frame):
+    if frame is None:
+        return None
+    values = frame.astype(object).where(frame.notna(), None)
+    return {'columns': list(frame.columns), 'data': [[_encode_number(value) for value in row] for row in values.values.tolist()]}
+
+
+def _frame_from_state(state, date_column):
+    if state is None:
+        return None
+    frame = pd.DataFrame(state['data'], columns=state['columns'])
+    for column in frame.columns:
+        if column != date_column:
+            frame[column] = pd.to_numeric(frame[column].map(_decode_number), errors='coerce')
+    return frame
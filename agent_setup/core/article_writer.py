@@ -0,0 +1,59 @@
+from django.conf import settings
+from django.db import transaction
+
+from .agent_stats import update_agent_stats
+from .models import Article
+
+
+class ArticleWriter:
+    """
+    Collects unsaved Articles, for one agent instance or many, and writes them in
+    one transaction with bulk_create instead of an INSERT per article, updating
+    their agent instances' stats in the same transaction.
+    """
+
+    def __init__(self):
+        self.pending = []
+        self.run_seconds = {}
+
+    def add(self, article):
+        # bulk_create doesn't call save(), which would set these
+        article.set_summary()
+        self.pending.append(article)
+        return article
+
+    def add_run(self, agent_instance_id, seconds):
+        """
+        Record how long the run that generated an agent instance's pending articles took.
+        """
+        self.run_seconds[agent_instance_id] = seconds
+
+    def discard(self, agent_instance_ids):
+        """
+        Drop the pending articles, and run times, of these agent instances.
+        """
+        self.pending = [article for article in self.pending if article.agent_instance_id not in agent_instance_ids]
+        for agent_instance_id in agent_instance_ids:
+            self.run_seconds.pop(agent_instance_id, None)
+
+    def flush(self):
+        """
+        Write the pending articles and return them, now saved.
+        """
+        articles, self.pending = self.pending, []
+        run_seconds, self.run_seconds = self.run_seconds, {}
+        if articles:
+            with transaction.atomic():
+                Article.objects.bulk_create(articles, batch_size=settings.ARTICLE_BULK_BATCH_SIZE)
+                update_agent_stats(articles, run_seconds)
+        return articles
+
+
+def write_articles(articles):
+    """
+    Write unsaved Articles in one transaction and return them.
+    """
+    writer = ArticleWriter()
+    for article in articles:
+        writer.add(article)
+    return writer.flush()
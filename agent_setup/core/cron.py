@@ -1,10 +1,25 @@
-from .models import AgentInstance
-from .utils import generate_articles
+from django.conf import settings
+
+from .jobs import run_worker, run_worker_pool
+from .scheduler import enqueue_due_agents
 
 def generate_daily_articles():
     """
-    Cron job to generate articles for all agents with daily schedule.
+    Cron job to generate articles for scheduled agents. Queues the agents whose
+    next run is due, once per schedule period however often the job is triggered,
+    then works through the queue with GENERATION_CRON_WORKERS worker processes
+    (0 leaves it to separately run generation workers).
     """
-    agents = AgentInstance.objects.filter(configuration__schedule='daily')
-    for agent in agents:
-        generate_articles(agent)
\ No newline at end of file
+    agents_queued = enqueue_due_agents()
+    print(f"Scheduled generation queued {agents_queued} due agents")
+
+    workers = settings.GENERATION_CRON_WORKERS
+    # Each worker writes several agents' articles at a time
+    write_batch = settings.GENERATION_CRON_WRITE_BATCH
+    if workers == 1:
+        jobs_run = run_worker(once=True, write_batch=write_batch)
+    elif workers > 1:
+        jobs_run = run_worker_pool(workers, once=True, write_batch=write_batch)
+    else:
+        return
+    print(f"Scheduled generation ran {jobs_run} jobs")
@@ -0,0 +1,317 @@
+import csv
+import hashlib
+import itertools
+import json
+import math
+import mmap
+import os
+import threading
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+from .datasource_cache import get_cache_dir, get_delimiter, get_read_csv_kwargs
+
+# Row-level access to CSV DataSources without building a DataFrame. Records
+# are read straight from disk in binary mode so that the byte offset of every
+# row is known; every CHECKPOINT_INTERVAL rows that offset is remembered so a
+# later request can seek close to the row it needs instead of rescanning.
+
+CHECKPOINT_INTERVAL = 1000
+
+_checkpoint_memo = {}
+_checkpoint_lock = threading.Lock()
+
+
+def supports_byte_scanning(encoding, delimiter):
+    """
+    Whether records can be split on raw bytes, i.e. the delimiter is a single
+    character and the encoding is ASCII compatible for newlines, quotes and the
+    delimiter.
+    """
+    if not isinstance(delimiter, str) or len(delimiter) != 1:
+        return False
+    try:
+        return all(char.encode(encoding) == char.encode('ascii') for char in ('\n', '"', delimiter))
+    except (LookupError, UnicodeError):
+        return False
+
+
+def iter_records(handle):
+    """
+    Yield (byte_offset, raw_record) for each CSV record from the current position
+    of a binary file handle. Newlines inside quoted fields do not end a record.
+    """
+    offset = handle.tell()
+    record = b''
+    record_offset = offset
+    open_quotes = False
+    for line in iter(handle.readline, b''):
+        if not record:
+            record_offset = offset
+        record += line
+        offset += len(line)
+        if line.count(b'"') % 2:
+            open_quotes = not open_quotes
+        if not open_quotes:
+            yield record_offset, record
+            record = b''
+    if record:
+        yield record_offset, record
+
+
+def parse_record(raw_record, encoding, delimiter):
+    """
+    Decode and split a single raw record into its field values.
+    """
+    text = raw_record.decode(encoding).rstrip('\r\n')
+    if not text.strip():
+        return None
+    return next(csv.reader([text], delimiter=delimiter), [])
+
+
+def convert_value(value):
+    """
+    Convert a CSV field to int/float where it is a plain finite number. Anything
+    else Python would also parse (surrounding whitespace, digit separators, nan,
+    inf) is kept as the raw string, which JSON can always represent.
+    """
+    if value == '':
+        return None
+    if value != value.strip() or '_' in value:
+        return value
+    for cast in (int, float):
+        try:
+            number = cast(value)
+        except ValueError:
+            continue
+        return number if math.isfinite(number) else value
+    return value
+
+
+def read_preview_rows(datasource, offset=0, limit=5):
+    """
+    Return rows [offset, offset + limit) of a CSV DataSource as a list of dicts,
+    reading only as much of the file as needed to reach those rows.
+    """
+    kwargs = get_read_csv_kwargs(datasource.connection_params)
+    encoding, delimiter = kwargs['encoding'], get_delimiter(datasource.connection_params)
+    path = datasource.file.path
+
+    if not supports_byte_scanning(encoding, delimiter):
+        # Multi-byte encodings can't be split on raw bytes; let pandas skip rows instead
+        df = pd.read_csv(path, skiprows=range(1, offset + 1), nrows=limit, **kwargs)
+        # JSON has no NaN or infinity
+        df = df.replace([np.inf, -np.inf], np.nan)
+        return df.astype(object).where(df.notna(), None).to_dict(orient='records')
+
+    # A copy: checkpoints found here are published with save_checkpoints
+    checkpoints = load_checkpoints(path)
+    rows = []
+    with open(path, 'rb') as handle:
+        _, header_record = next(iter_records(handle), (0, b''))
+        header = parse_record(header_record, encoding, delimiter) or []
+        if not checkpoints:
+            checkpoints.append(handle.tell())
+
+        checkpoint_index = min(offset // CHECKPOINT_INTERVAL, len(checkpoints) - 1)
+        row_number = checkpoint_index * CHECKPOINT_INTERVAL
+        handle.seek(checkpoints[checkpoint_index])
+        checkpoints_before = len(checkpoints)
+
+        for record_offset, raw_record in iter_records(handle):
+            values = parse_record(raw_record, encoding, delimiter)
+            if values is None:
+                continue
+            if row_number % CHECKPOINT_INTERVAL == 0 and row_number // CHECKPOINT_INTERVAL == len(checkpoints):
+                checkpoints.append(record_offset)
+            if row_number >= offset:
+                rows.append(dict(zip(header, (convert_value(value) for value in values))))
+                if len(rows) >= limit:
+                    break
+            row_number += 1
+
+    if len(checkpoints) != checkpoints_before:
+        save_checkpoints(path, checkpoints)
+    return rows
+
+
+def _checkpoint_key(path):
+    stat = os.stat(path)
+    identity = f'{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}'
+    return hashlib.sha256(identity.encode()).hexdigest()
+
+
+def _checkpoint_path(key):
+    return os.path.join(get_cache_dir(), 'checkpoints', f'{key}.json')
+
+
+def load_checkpoints(path):
+    """
+    A copy of the byte offsets of every CHECKPOINT_INTERVAL-th data row recorded
+    so far for a file.
+    """
+    key = _checkpoint_key(path)
+    with _checkpoint_lock:
+        checkpoints = _checkpoint_memo.get(key)
+        if checkpoints is None:
+            try:
+                with open(_checkpoint_path(key)) as handle:
+                    checkpoints = json.load(handle)
+            except (OSError, ValueError):
+                checkpoints = []
+            _checkpoint_memo[key] = checkpoints
+        return list(checkpoints)
+
+
+def save_checkpoints(path, checkpoints):
+    """
+    Merge checkpoints found by one reader into the file's recorded ones. Each
+    offset is stored at its own index, so concurrent readers that found the same
+    or overlapping checkpoints can't duplicate or reorder them.
+    """
+    key = _checkpoint_key(path)
+    with _checkpoint_lock:
+        merged = list(_checkpoint_memo.get(key) or [])
+        for index, offset in enumerate(checkpoints):
+            if index < len(merged):
+                merged[index] = offset
+            else:
+                merged.append(offset)
+        _checkpoint_memo[key] = merged
+
+        checkpoint_path = _checkpoint_path(key)
+        tmp_path = f'{checkpoint_path}.tmp-{uuid.uuid4().hex}'
+        try:
+            os.makedirs(os.path.dirname(checkpoint_path), exist_ok=True)
+            with open(tmp_path, 'w') as handle:
+                json.dump(merged, handle)
+            os.replace(tmp_path, checkpoint_path)
+        except OSError as e:
+            print(f"Could not persist preview checkpoints for {path}: {str(e)}")
+
+
+def scan_csv(path, encoding='utf-8', delimiter=',', chunk_size=None, max_reported=10):
+    """
+    Count the data rows of a CSV file and check that each one has as many fields
+    as the header, without building a DataFrame.
+
+    The file is memory-mapped and scanned chunk by chunk with NumPy: only the
+    positions of quotes, newlines and delimiters are materialized, so memory use
+    is bounded by the chunk size rather than the file size. Newlines and
+    delimiters inside quoted fields are ignored.
+    """
+    if not isinstance(delimiter, str) or not delimiter:
+        raise ValueError("delimiter must be a non-empty string")
+    chunk_size = chunk_size or getattr(settings, 'DATASOURCE_SCAN_CHUNK_BYTES', 8 * 1024 * 1024)
+    started = time.perf_counter()
+    file_size = os.path.getsize(path)
+
+    if not supports_byte_scanning(encoding, delimiter):
+        result = _scan_decoded(path, encoding, delimiter, max_reported)
+    else:
+        result = {'row_count': 0, 'column_count': 0, 'invalid_row_count': 0, 'invalid_rows': []}
+        if file_size:
+            with open(path, 'rb') as handle, mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                _scan_mapped(mapped, file_size, ord(delimiter), chunk_size, max_reported, result)
+
+    elapsed = time.perf_counter() - started
+    result['bytes_scanned'] = file_size
+    result['elapsed_seconds'] = round(elapsed, 6)
+    result['bytes_per_second'] = round(file_size / elapsed) if elapsed > 0 else None
+    return result
+
+
+def _scan_mapped(mapped, file_size, delimiter_byte, chunk_size, max_reported, result):
+    quotes_before = 0           # quote characters seen before the current chunk
+    pending_delimiters = 0      # delimiters of the record that spans into the current chunk
+    pending_length = 0          # bytes of that record so far
+    last_byte = None            # final byte of the previous chunk
+    expected_fields = None
+    row_count = 0
+
+    for chunk_start in range(0, file_size, chunk_size):
+        chunk = np.frombuffer(mapped, dtype=np.uint8, count=min(chunk_size, file_size - chunk_start), offset=chunk_start)
+        quote_positions = np.flatnonzero(chunk == ord('"'))
+        newline_positions = np.flatnonzero(chunk == ord('\n'))
+        delimiter_positions = np.flatnonzero(chunk == delimiter_byte)
+
+        # A newline or delimiter is structural when an even number of quotes precede it
+        record_ends = newline_positions[(np.searchsorted(quote_positions, newline_positions) + quotes_before) % 2 == 0]
+        delimiter_positions = delimiter_positions[(np.searchsorted(quote_positions, delimiter_positions) + quotes_before) % 2 == 0]
+        quotes_before += len(quote_positions)
+
+        if len(record_ends):
+            delimiters_before_end = np.searchsorted(delimiter_positions, record_ends)
+            field_counts = np.diff(delimiters_before_end, prepend=0) + 1
+            field_counts[0] += pending_delimiters
+
+            starts = np.concatenate(([0], record_ends[:-1] + 1))
+            lengths = record_ends - starts
+            lengths[0] += pending_length
+            # Strip a trailing carriage return before deciding whether a line is blank
+            previous_bytes = np.where(record_ends > 0, chunk[np.maximum(record_ends - 1, 0)], last_byte if last_byte is not None else 0)
+            lengths -= (previous_bytes == ord('\r')) & (lengths > 0)
+
+            field_counts = field_counts[lengths > 0]
+            if expected_fields is None and len(field_counts):
+                expected_fields = int(field_counts[0])
+                field_counts = field_counts[1:]
+            row_count = _record_rows(field_counts, expected_fields, row_count, max_reported, result)
+
+            pending_delimiters = len(delimiter_positions) - int(np.searchsorted(delimiter_positions, record_ends[-1]))
+            pending_length = len(chunk) - int(record_ends[-1]) - 1
+        else:
+            pending_delimiters += len(delimiter_positions)
+            pending_length += len(chunk)
+        last_byte = int(chunk[-1])
+
+    # A final record without a trailing newline
+    if pending_length > 0 and not (pending_length == 1 and last_byte == ord('\r')):
+        field_counts = np.array([pending_delimiters + 1])
+        if expected_fields is None:
+            expected_fields = int(field_counts[0])
+        else:
+            row_count = _record_rows(field_counts, expected_fields, row_count, max_reported, result)
+
+    result['row_count'] = row_count
+    result['column_count'] = expected_fields or 0
+
+
+def _record_rows(field_counts, expected_fields, row_count, max_reported, result):
+    invalid = np.flatnonzero(field_counts != expected_fields)
+    result['invalid_row_count'] += len(invalid)
+    room = max_reported - len(result['invalid_rows'])
+    if room > 0:
+        result['invalid_rows'].extend(int(index) + row_count + 1 for index in invalid[:room])
+    return row_count + len(field_counts)
+
+
+def _scan_decoded(path, encoding, delimiter, max_reported, batch_rows=100000):
+    """
+    Field counts of a file that can't be scanned as raw bytes, read as decoded
+    text: csv.reader for a single-character delimiter, and for a longer one a
+    plain split per line like pandas' python engine does.
+    """
+    result = {'row_count': 0, 'column_count': 0, 'invalid_row_count': 0, 'invalid_rows': []}
+    with open(path, encoding=encoding, newline='') as handle:
+        if len(delimiter) == 1:
+            field_counts = (len(record) for record in csv.reader(handle, delimiter=delimiter) if record)
+        else:
+            lines = (line.rstrip('\r\n') for line in handle)
+            field_counts = (line.count(delimiter) + 1 for line in lines if line)
+
+        expected_fields = next(field_counts, None)
+        row_count = 0
+        while True:
+            batch = np.fromiter(itertools.islice(field_counts, batch_rows), dtype=np.int64)
+            if not len(batch):
+                break
+            row_count = _record_rows(batch, expected_fields, row_count, max_reported, result)
+
+    result['row_count'] = row_count
+    result['column_count'] = expected_fields or 0
+    return result
@@ -0,0 +1,227 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+# Every reader of a CSV DataSource goes through read_datasource(). The first
+# read parses the file with pandas and stores one .npy file per column under
+# DATASOURCE_CACHE_DIR; later reads memory-map them instead of re-parsing the
+# CSV. Text columns are dictionary-encoded: integer codes, memory-mapped like
+# the numeric columns, and the distinct values as a fixed-width string array.
+# Nothing is pickled, so files in the cache directory are only ever read as data.
+
+CACHE_FORMAT_VERSION = 2
+META_FILENAME = 'meta.json'
+HASH_BLOCK_SIZE = 4 * 1024 * 1024
+# Files whose content hash is remembered, least recently used dropped first
+FINGERPRINT_MEMO_MAX_ENTRIES = 1024
+
+_fingerprint_memo = OrderedDict()
+_fingerprint_lock = threading.Lock()
+_cache_lock = threading.Lock()
+
+
+def get_cache_dir():
+    return getattr(settings, 'DATASOURCE_CACHE_DIR', os.path.join(settings.MEDIA_ROOT, 'parsed_cache'))
+
+
+def get_cache_max_bytes():
+    return getattr(settings, 'DATASOURCE_CACHE_MAX_BYTES', 2 * 1024 ** 3)
+
+
+def get_delimiter(connection_params):
+    """
+    The field delimiter of a DataSource as written in the file.
+    """
+    return (connection_params or {}).get('delimiter', ',')
+
+
+def get_read_csv_kwargs(connection_params):
+    """
+    pandas.read_csv keyword arguments derived from a DataSource's connection_params.
+    """
+    connection_params = connection_params or {}
+    kwargs = {
+        'delimiter': get_delimiter(connection_params),
+        'encoding': connection_params.get('encoding', 'utf-8'),
+    }
+    if isinstance(kwargs['delimiter'], str) and len(kwargs['delimiter']) > 1:
+        # Only the python engine handles multi-character delimiters, which it treats as a regex
+        kwargs['delimiter'] = re.escape(kwargs['delimiter'])
+        kwargs['engine'] = 'python'
+    return kwargs
+
+
+def file_content_hash(path):
+    """
+    SHA-256 of the file contents, memoized per (path, size, mtime) so unchanged
+    files are only hashed once per process.
+    """
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    with _fingerprint_lock:
+        digest = _fingerprint_memo.get(memo_key)
+        if digest is not None:
+            _fingerprint_memo.move_to_end(memo_key)
+            return digest
+
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as handle:
+        for block in iter(lambda: handle.read(HASH_BLOCK_SIZE), b''):
+            hasher.update(block)
+    digest = hasher.hexdigest()
+    with _fingerprint_lock:
+        _fingerprint_memo[memo_key] = digest
+        while len(_fingerprint_memo) > FINGERPRINT_MEMO_MAX_ENTRIES:
+            _fingerprint_memo.popitem(last=False)
+    return digest
+
+
+def datasource_fingerprint(datasource):
+    """
+    Cache key for a DataSource: hash of the file contents plus the parsing options.
+    """
+    params = json.dumps(get_read_csv_kwargs(datasource.connection_params), sort_keys=True)
+    hasher = hashlib.sha256()
+    hasher.update(file_content_hash(datasource.file.path).encode())
+    hasher.update(params.encode())
+    hasher.update(str(CACHE_FORMAT_VERSION).encode())
+    return hasher.hexdigest()
+
+
+def read_datasource(datasource):
+    """
+    Return the parsed DataFrame for a CSV DataSource, reading through the parsed cache.
+    """
+    key = datasource_fingerprint(datasource)
+    entry_dir = os.path.join(get_cache_dir(), key)
+
+    df = _load_entry(entry_dir)
+    if df is not None:
+        return df
+
+    df = pd.read_csv(datasource.file.path, **get_read_csv_kwargs(datasource.connection_params))
+    try:
+        _store_entry(entry_dir, df)
+        evict_datasource_cache()
+    except (OSError, ValueError) as e:
+        print(f"Could not write parsed cache for data source {datasource.id}: {str(e)}")
+    return df
+
+
+def invalidate_datasource_cache(datasource):
+    """
+    Drop the cached parse of a DataSource's current file and connection_params.
+    """
+    if not datasource.file:
+        return
+    try:
+        key = datasource_fingerprint(datasource)
+    except OSError:
+        return
+    shutil.rmtree(os.path.join(get_cache_dir(), key), ignore_errors=True)
+
+
+def evict_datasource_cache(max_bytes=None):
+    """
+    Remove least recently used cache entries until the cache fits in max_bytes.
+    """
+    max_bytes = get_cache_max_bytes() if max_bytes is None else max_bytes
+    cache_dir = get_cache_dir()
+    if not os.path.isdir(cache_dir):
+        return
+
+    with _cache_lock:
+        entries = []
+        total_bytes = 0
+        for name in os.listdir(cache_dir):
+            entry_dir = os.path.join(cache_dir, name)
+            meta_path = os.path.join(entry_dir, META_FILENAME)
+            if not os.path.isfile(meta_path):
+                continue
+            size = sum(
+                os.path.getsize(os.path.join(entry_dir, filename))
+                for filename in os.listdir(entry_dir)
+            )
+            entries.append((os.path.getmtime(meta_path), size, entry_dir))
+            total_bytes += size
+
+        for _, size, entry_dir in sorted(entries):
+            if total_bytes <= max_bytes:
+                break
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total_bytes -= size
+
+
+def _load_entry(entry_dir):
+    meta_path = os.path.join(entry_dir, META_FILENAME)
+    try:
+        with open(meta_path) as handle:
+            meta = json.load(handle)
+        columns = {}
+        for index, (column, kind) in enumerate(zip(meta['columns'], meta['kinds'])):
+            column_path = os.path.join(entry_dir, f'col_{index}.npy')
+            if kind == 'strings':
+                codes = np.load(column_path, mmap_mode='r', allow_pickle=False)
+                values = np.load(os.path.join(entry_dir, f'col_{index}_values.npy'), allow_pickle=False)
+                columns[column] = _decode_strings(codes, values)
+            else:
+                columns[column] = np.load(column_path, mmap_mode='r', allow_pickle=False)
+        # Mark the entry as recently used for LRU eviction
+        os.utime(meta_path)
+    except (OSError, ValueError, KeyError):
+        return None
+    # copy=False keeps one block per column, so the memory-mapped arrays aren't copied into the frame
+    return pd.DataFrame(columns, columns=meta['columns'], copy=False)
+
+
+def _store_entry(entry_dir, df):
+    # Write into a temporary directory first so readers never see a partial entry
+    tmp_dir = f'{entry_dir}.tmp-{uuid.uuid4().hex}'
+    os.makedirs(tmp_dir)
+    try:
+        kinds = []
+        for index, column in enumerate(df.columns):
+            values = df[column].to_numpy()
+            column_path = os.path.join(tmp_dir, f'col_{index}.npy')
+            if values.dtype == object:
+                codes, distinct = _encode_strings(values)
+                np.save(column_path, codes, allow_pickle=False)
+                np.save(os.path.join(tmp_dir, f'col_{index}_values.npy'), distinct, allow_pickle=False)
+                kinds.append('strings')
+            else:
+                np.save(column_path, values, allow_pickle=False)
+                kinds.append(values.dtype.str)
+        with open(os.path.join(tmp_dir, META_FILENAME), 'w') as handle:
+            json.dump({'columns': [str(column) for column in df.columns], 'kinds': kinds, 'rows': len(df)}, handle)
+        os.replace(tmp_dir, entry_dir)
+    except (OSError, ValueError):
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        if not os.path.isdir(entry_dir):
+            raise
+
+
+def _encode_strings(values):
+    """
+    Dictionary-encode a text column: int32 codes (-1 for missing values) and the
+    distinct values as a fixed-width unicode array. Raises ValueError for columns
+    holding anything but strings and missing values, which aren't cached.
+    """
+    codes, distinct = pd.factorize(values, use_na_sentinel=True)
+    if not all(isinstance(value, str) for value in distinct):
+        raise ValueError("Only text columns can be stored without pickling")
+    return codes.astype(np.int32), np.array(distinct, dtype=str)
+
+
+def _decode_strings(codes, distinct):
+    # One reference per row to a shared str per distinct value; missing values are NaN as read_csv has them
+    values = np.append(distinct.astype(object), np.nan)
+    return values[codes]
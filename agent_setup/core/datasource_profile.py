@@ -0,0 +1,188 @@
+import numpy as np
+import pandas as pd
+
+from .datasource_cache import get_read_csv_kwargs
+
+# Schema profile stored on DataSource.schema_profile. It is computed in one
+# streaming pass when a file is uploaded so that linking and mapping_config
+# generation can work from metadata instead of re-reading the CSV.
+
+PROFILE_VERSION = 1
+PROFILE_CHUNK_ROWS = 100000
+DISTINCT_SKETCH_SIZE = 1024
+DATE_FORMAT_SAMPLE_SIZE = 100
+DATE_FORMATS = [
+    '%Y-%m-%d', '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y/%m/%d',
+    '%d/%m/%Y', '%m/%d/%Y', '%d-%m-%Y', '%m-%d-%Y', '%Y%m%d',
+]
+DTYPE_ORDER = ['bool', 'int64', 'float64', 'object']
+
+
+def profile_csv(file, connection_params, chunk_rows=PROFILE_CHUNK_ROWS):
+    """
+    Profile a CSV file (path or file object) in a single chunked pass.
+
+    Returns a JSON-serializable dict with the row count and, per column, the
+    inferred dtype, null count, min/max, an estimate of the number of distinct
+    values and the date format if the column holds dates.
+    """
+    columns = None
+    row_count = 0
+    for chunk in pd.read_csv(file, chunksize=chunk_rows, **get_read_csv_kwargs(connection_params)):
+        if columns is None:
+            columns = [_new_column_state(name, chunk[name]) for name in chunk.columns]
+        for state in columns:
+            _update_column_state(state, chunk[state['name']])
+        row_count += len(chunk)
+
+    if hasattr(file, 'seek'):
+        file.seek(0)
+
+    return {
+        'version': PROFILE_VERSION,
+        # The parsing options the profile was computed with
+        'read_csv': get_read_csv_kwargs(connection_params),
+        'row_count': row_count,
+        'columns': [_finalize_column_state(state) for state in columns or []],
+    }
+
+
+def infer_date_column(profile):
+    """
+    Pick the date column the same way uploads always have: the first column with
+    'date' in its name, otherwise the first column.
+    """
+    names = get_column_names(profile)
+    date_cols = [name for name in names if 'date' in name.lower()]
+    return date_cols[0] if date_cols else names[0] if names else ''
+
+
+def get_column_names(profile):
+    return [column['name'] for column in profile.get('columns', [])]
+
+
+def get_column_dtypes(profile):
+    return {column['name']: column['dtype'] for column in profile.get('columns', [])}
+
+
+def get_schema_profile(datasource):
+    """
+    Return the stored schema profile of a DataSource, profiling and saving it
+    first for data sources uploaded before profiles existed or whose
+    connection_params have changed since.
+    """
+    profile = datasource.schema_profile
+    if (profile.get('version') != PROFILE_VERSION
+            or profile.get('read_csv') != get_read_csv_kwargs(datasource.connection_params)):
+        datasource.schema_profile = profile_csv(datasource.file.path, datasource.connection_params)
+        datasource.save(update_fields=['schema_profile'])
+    return datasource.schema_profile
+
+
+def default_mapping_config(datasource):
+    """
+    mapping_config built from the schema profile: numeric columns are metrics and
+    text columns (other than the date column) are categories.
+    """
+    dtypes = get_column_dtypes(get_schema_profile(datasource))
+    return {
+        'date_column': datasource.date_column,
+        'metric_columns': [name for name, dtype in dtypes.items() if dtype in ['int64', 'float64']],
+        'category_columns': [name for name, dtype in dtypes.items() if dtype == 'object' and name != datasource.date_column],
+    }
+
+
+def _new_column_state(name, sample):
+    return {
+        'name': str(name),
+        'dtype': None,
+        'null_count': 0,
+        'min': None,
+        'max': None,
+        'sketch': np.array([], dtype=np.uint64),
+        'date_format': _detect_date_format(sample) if sample.dtype == object else None,
+    }
+
+
+def _update_column_state(state, series):
+    nulls = int(series.isna().sum())
+    state['null_count'] += nulls
+    values = series.dropna()
+    if values.empty:
+        return
+
+    dtype = _normalize_dtype(series.dtype)
+    if state['dtype'] is None or DTYPE_ORDER.index(dtype) > DTYPE_ORDER.index(state['dtype']):
+        state['dtype'] = dtype
+
+    if dtype in ['int64', 'float64']:
+        _update_min_max(state, values.min(), values.max())
+    elif state['date_format']:
+        parsed = pd.to_datetime(values, format=state['date_format'], errors='coerce').dropna()
+        if len(parsed) != len(values):
+            state['date_format'] = None
+        elif not parsed.empty:
+            _update_min_max(state, parsed.min(), parsed.max())
+
+    # K-minimum-values sketch: the k smallest distinct hashes estimate the distinct count
+    hashes = pd.util.hash_pandas_object(values, index=False).to_numpy()
+    state['sketch'] = np.unique(np.concatenate([state['sketch'], hashes]))[:DISTINCT_SKETCH_SIZE]
+
+
+def _update_min_max(state, chunk_min, chunk_max):
+    if state['min'] is None or chunk_min < state['min']:
+        state['min'] = chunk_min
+    if state['max'] is None or chunk_max > state['max']:
+        state['max'] = chunk_max
+
+
+def _finalize_column_state(state):
+    sketch = state['sketch']
+    if len(sketch) < DISTINCT_SKETCH_SIZE:
+        distinct = len(sketch)
+    else:
+        distinct = int((DISTINCT_SKETCH_SIZE - 1) / (float(sketch[-1]) / 2 ** 64))
+
+    dtype = state['dtype'] or 'float64'
+    date_format = state['date_format'] if dtype == 'object' else None
+    # Min/max are only meaningful for numeric columns and parsed dates
+    has_range = dtype in ['int64', 'float64'] or date_format
+    return {
+        'name': state['name'],
+        'dtype': dtype,
+        'null_count': state['null_count'],
+        'min': _to_json(state['min'], date_format) if has_range else None,
+        'max': _to_json(state['max'], date_format) if has_range else None,
+        'distinct_estimate': distinct,
+        'date_format': date_format,
+    }
+
+
+def _normalize_dtype(dtype):
+    if pd.api.types.is_bool_dtype(dtype):
+        return 'bool'
+    if pd.api.types.is_integer_dtype(dtype):
+        return 'int64'
+    if pd.api.types.is_float_dtype(dtype):
+        return 'float64'
+    return 'object'
+
+
+def _detect_date_format(sample):
+    values = sample.dropna().astype(str).head(DATE_FORMAT_SAMPLE_SIZE)
+    if values.empty:
+        return None
+    for date_format in DATE_FORMATS:
+        if pd.to_datetime(values, format=date_format, errors='coerce').notna().all():
+            return date_format
+    return None
+
+
+def _to_json(value, date_format):
+    if value is None:
+        return None
+    if isinstance(value, pd.Timestamp):
+        return value.strftime(date_format)
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
@@ -0,0 +1,431 @@
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import traceback
+import uuid
+from datetime import timedelta
+
+import django
+import numpy as np
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, connection, connections, transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from .article_writer import ArticleWriter
+from .models import GenerationJob, Organization
+from .quotas import get_daily_usage_by_organization, get_max_concurrency, get_quota_error, has_quota
+from .utils import generate_articles
+
+# Article generation queued in the database and run by worker processes
+# (manage.py run_generation_worker), so web requests don't wait on the CSV
+# analysis and LLM calls. Throughput scales with the number of workers, on
+# one machine or many.
+#
+# A worker claims a job by taking a lease on it: lease_owner is set to the
+# worker's id and lease_expires_at to GENERATION_LEASE_SECONDS from now. While
+# the job runs a heartbeat keeps extending the lease. If the worker dies the
+# lease runs out and another worker reclaims the job, up to
+# GENERATION_MAX_ATTEMPTS times.
+#
+# Workers share out jobs fairly between organizations and within each
+# organization's limits (core.quotas); see get_claim_order.
+
+CLAIM_BATCH_SIZE = 10
+
+
+def make_worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}'
+
+
+def enqueue_generation_job(agent_instance):
+    """
+    Queue article generation for an agent instance. An agent instance that already
+    has a queued or running job gets that job back instead of a second one.
+    """
+    active_jobs = GenerationJob.objects.filter(agent_instance=agent_instance, status__in=['queued', 'running'])
+    job = active_jobs.first()
+    if job is not None:
+        return job
+    try:
+        # A savepoint, so a caller's transaction survives losing the race below
+        with transaction.atomic():
+            return GenerationJob.objects.create(agent_instance=agent_instance)
+    except IntegrityError:
+        # Another request queued a job for the agent instance since the check above
+        job = active_jobs.first()
+        if job is None:
+            raise
+        return job
+
+
+def claim_next_job(worker_id):
+    """
+    Lease the next claimable job to worker_id: a queued job, or a running one
+    whose lease has expired. Jobs that have used up their attempts are failed
+    instead. Returns None if there is nothing to claim.
+    """
+    while True:
+        job = _claim_fairly(worker_id)
+        if job is None or job.attempts <= settings.GENERATION_MAX_ATTEMPTS:
+            return job
+        _finish_job(job, worker_id, 'failed', error=f"Gave up after {settings.GENERATION_MAX_ATTEMPTS} attempts whose leases expired")
+
+
+def get_claim_order(now=None):
+    """
+    Organizations with claimable jobs in the order they should be served: fewest
+    jobs running first, then the one whose job was claimed longest ago, so
+    workers round-robin between organizations however many agents each has.
+    Organizations at their concurrency limit or out of quota are left out;
+    their jobs stay queued until they are not.
+    """
+    now = now or timezone.now()
+    organization_ids = set(
+        GenerationJob.objects.filter(_claimable(now)).values_list('agent_instance__organization', flat=True).distinct()
+    )
+    running = _count_running(organization_ids, now)
+    organizations = [
+        organization for organization in Organization.objects.filter(id__in=organization_ids)
+        if running.get(organization.id, 0) < get_max_concurrency(organization)
+    ]
+    usage = get_daily_usage_by_organization([organization.id for organization in organizations if has_quota(organization)], now)
+    organizations = [
+        organization for organization in organizations
+        if not get_quota_error(organization, now, usage=usage.get(organization.id, (0, 0)))
+    ]
+    organizations.sort(key=lambda organization: (
+        running.get(organization.id, 0),
+        organization.last_generation_claimed_at is not None,
+        organization.last_generation_claimed_at or now,
+        organization.id
+    ))
+    return organizations
+
+
+def _count_running(organization_ids, now):
+    return dict(
+        GenerationJob.objects.filter(
+            status='running', lease_expires_at__gte=now, agent_instance__organization__in=organization_ids
+        ).values('agent_instance__organization').annotate(running=Count('id'))
+        .values_list('agent_instance__organization', 'running')
+    )
+
+
+def _claimable(now):
+    return Q(status='queued') | Q(status='running', lease_expires_at__lt=now)
+
+
+def _claim_fairly(worker_id):
+    now = timezone.now()
+    for organization in get_claim_order(now):
+        job = _claim_for_organization(worker_id, organization, now)
+        if job is not None:
+            return job
+    return None
+
+
+def _claim_for_organization(worker_id, organization, now):
+    with transaction.atomic():
+        # Claims for one organization take turns on its row (on SQLite the transaction holds
+        # the write lock), so no two workers can both see a free slot and fill it
+        organization = Organization.objects.select_for_update().get(id=organization.id)
+        if _count_running([organization.id], now).get(organization.id, 0) >= get_max_concurrency(organization):
+            return None
+        jobs = GenerationJob.objects.filter(_claimable(now), agent_instance__organization=organization)
+        if connection.features.has_select_for_update_skip_locked:
+            job = _claim_with_skip_locked(worker_id, jobs)
+        else:
+            job = _claim_with_conditional_update(worker_id, jobs)
+        if job is not None:
+            Organization.objects.filter(id=organization.id).update(last_generation_claimed_at=now)
+        return job
+
+
+def _lease_values(worker_id, now):
+    return {
+        'status': 'running',
+        'stage': '',
+        'lease_owner': worker_id,
+        'lease_expires_at': now + timedelta(seconds=settings.GENERATION_LEASE_SECONDS),
+        'heartbeat_at': now,
+        'started_at': now,
+        'attempts': F('attempts') + 1,
+    }
+
+
+def _claim_with_skip_locked(worker_id, jobs):
+    # PostgreSQL: rows locked by other workers' claims are skipped rather than waited for
+    now = timezone.now()
+    with transaction.atomic():
+        # of=('self',): jobs is filtered through joins, whose agent instance and organization
+        # rows need no further locks
+        job = jobs.select_for_update(skip_locked=True, of=('self',)).order_by('created_at').first()
+        if job is None:
+            return None
+        GenerationJob.objects.filter(id=job.id).update(**_lease_values(worker_id, now))
+    return GenerationJob.objects.select_related('agent_instance__datasource').get(id=job.id)
+
+
+def _claim_with_conditional_update(worker_id, jobs):
+    # SQLite has no row locks: the job row's lease columns act as the lock, and an update
+    # only succeeds if they are unchanged since the row was read
+    while True:
+        now = timezone.now()
+        candidates = list(
+            jobs.order_by('created_at').values_list('id', 'status', 'lease_owner', 'lease_expires_at')[:CLAIM_BATCH_SIZE]
+        )
+        if not candidates:
+            return None
+        for job_id, status, lease_owner, lease_expires_at in candidates:
+            claimed = GenerationJob.objects.filter(
+                id=job_id, status=status, lease_owner=lease_owner, lease_expires_at=lease_expires_at
+            ).update(**_lease_values(worker_id, now))
+            if claimed:
+                return GenerationJob.objects.select_related('agent_instance__datasource').get(id=job_id)
+        # Every candidate was taken by other workers; look again
+
+
+def get_queue_metrics(now=None):
+    """
+    Queue depth and wait times per organization: jobs queued and running now,
+    how long the oldest queued job has waited, and percentiles of the time jobs
+    started in the last GENERATION_METRICS_WINDOW_SECONDS spent queued, along
+    with each organization's limits and usage today.
+    """
+    now = now or timezone.now()
+    window_start = now - timedelta(seconds=settings.GENERATION_METRICS_WINDOW_SECONDS)
+    active = GenerationJob.objects.filter(Q(status__in=['queued', 'running']) | Q(started_at__gte=window_start))
+    metrics = {}
+    for organization_id, job_status, created_at, started_at, lease_expires_at in active.values_list(
+        'agent_instance__organization', 'status', 'created_at', 'started_at', 'lease_expires_at'
+    ):
+        entry = metrics.setdefault(organization_id, {'queued': 0, 'running': 0, 'oldest_queued_at': None, 'waits': []})
+        # A running job whose lease expired is waiting to be reclaimed
+        if job_status == 'queued' or (job_status == 'running' and lease_expires_at and lease_expires_at < now):
+            entry['queued'] += 1
+            if entry['oldest_queued_at'] is None or created_at < entry['oldest_queued_at']:
+                entry['oldest_queued_at'] = created_at
+        elif job_status == 'running':
+            entry['running'] += 1
+        if started_at and started_at >= window_start:
+            entry['waits'].append((started_at - created_at).total_seconds())
+
+    usage = get_daily_usage_by_organization(list(metrics), now)
+    results = []
+    for organization in Organization.objects.filter(id__in=metrics).order_by('id'):
+        entry = metrics[organization.id]
+        waits = entry['waits']
+        oldest_queued_at = entry['oldest_queued_at']
+        articles_today, tokens_today = usage.get(organization.id, (0, 0))
+        results.append({
+            'organization_id': organization.id,
+            'organization_name': organization.name,
+            'queued': entry['queued'],
+            'running': entry['running'],
+            'max_concurrency': get_max_concurrency(organization),
+            'oldest_queued_seconds': round((now - oldest_queued_at).total_seconds(), 3) if oldest_queued_at else None,
+            'jobs_started': len(waits),
+            'wait_p50_seconds': round(float(np.percentile(waits, 50)), 3) if waits else None,
+            'wait_p95_seconds': round(float(np.percentile(waits, 95)), 3) if waits else None,
+            'articles_today': articles_today,
+            'tokens_today': tokens_today,
+            'daily_article_quota': organization.daily_article_quota,
+            'daily_token_quota': organization.daily_token_quota,
+            'quota_error': get_quota_error(organization, now, usage=(articles_today, tokens_today)),
+        })
+    return results
+
+
+class LeaseHeartbeat(threading.Thread):
+    """
+    Extends the leases on a worker's jobs every GENERATION_HEARTBEAT_SECONDS
+    from when it starts running them until they are finished.
+    """
+
+    def __init__(self, worker_id):
+        super().__init__(daemon=True)
+        self.worker_id = worker_id
+        self.job_ids = set()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def hold(self, job_id):
+        with self.lock:
+            self.job_ids.add(job_id)
+
+    def release(self, job_id):
+        with self.lock:
+            self.job_ids.discard(job_id)
+
+    def run(self):
+        try:
+            while not self.stopped.wait(settings.GENERATION_HEARTBEAT_SECONDS):
+                with self.lock:
+                    job_ids = set(self.job_ids)
+                if job_ids:
+                    self.extend(job_ids)
+        finally:
+            # This thread has its own database connection
+            connection.close()
+
+    def extend(self, job_ids):
+        now = timezone.now()
+        try:
+            extended = GenerationJob.objects.filter(id__in=job_ids, lease_owner=self.worker_id).update(
+                lease_expires_at=now + timedelta(seconds=settings.GENERATION_LEASE_SECONDS),
+                heartbeat_at=now
+            )
+        except Exception as e:
+            print(f"Heartbeat for worker {self.worker_id} failed: {str(e)}")
+            return
+        if extended < len(job_ids):
+            print(f"Worker {self.worker_id} lost its lease on {len(job_ids) - extended} jobs")
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def generate_job_articles(job, worker_id, writer, heartbeat):
+    """
+    Generate a leased job's articles into writer, unsaved, recording the job's
+    progress. The heartbeat holds the job's lease until write_generated_jobs
+    finishes it. Returns (status, articles_created, error).
+    """
+    def progress(stage):
+        GenerationJob.objects.filter(id=job.id, lease_owner=worker_id).update(stage=stage)
+
+    heartbeat.hold(job.id)
+    try:
+        articles = generate_articles(job.agent_instance, progress=progress, writer=writer)
+        if articles:
+            return 'succeeded', len(articles), ''
+        return 'failed', 0, "Failed to generate articles. Ensure DataSource and mapping_config are valid."
+    except Exception as e:
+        traceback.print_exc()
+        return 'failed', 0, str(e) or type(e).__name__
+
+
+def write_generated_jobs(generated, writer, worker_id, heartbeat, log=print):
+    """
+    Write the articles of the (job, result) pairs in generated and finish the
+    jobs, all in one transaction. Jobs whose lease this worker no longer holds
+    (it expired and another worker reclaimed them) are left to that worker and
+    their articles dropped. If the write fails every job fails.
+    """
+    if not generated:
+        return
+    try:
+        with transaction.atomic():
+            # Locks the job rows (on SQLite the transaction holds the write lock) so
+            # no lease can change hands between this check and the commit
+            held = set(
+                GenerationJob.objects.select_for_update()
+                .filter(id__in=[job.id for job, _ in generated], lease_owner=worker_id)
+                .values_list('id', flat=True)
+            )
+            lost = [job for job, _ in generated if job.id not in held]
+            writer.discard({job.agent_instance_id for job in lost})
+            writer.flush()
+            for job, (status, articles_created, error) in generated:
+                if job.id in held:
+                    _finish_job(job, worker_id, status, articles_created, error)
+    except Exception as e:
+        traceback.print_exc()
+        writer.discard({job.agent_instance_id for job, _ in generated})
+        lost = []
+        for job, _ in generated:
+            if not _finish_job(job, worker_id, 'failed', 0, f"Saving articles failed: {str(e)}"):
+                lost.append(job)
+
+    for job, _ in generated:
+        heartbeat.release(job.id)
+        if job in lost:
+            log(f"Job {job.id} was reclaimed by another worker before {worker_id} finished it; its articles were dropped")
+            continue
+        log(
+            f"Job {job.id} {job.status}: {job.articles_created} articles in "
+            f"{(job.finished_at - job.started_at).total_seconds():.2f}s"
+        )
+
+
+def _finish_job(job, worker_id, status, articles_created=0, error=''):
+    """
+    Record a job's outcome if worker_id still holds its lease. Returns whether it did.
+    """
+    job.status = status
+    job.stage = 'done'
+    job.articles_created = articles_created
+    job.error = error
+    job.finished_at = timezone.now()
+    # Only the lease holder may finish the job
+    finished = GenerationJob.objects.filter(id=job.id, lease_owner=worker_id).update(
+        status=status, stage='done', articles_created=articles_created, error=error,
+        finished_at=job.finished_at, lease_expires_at=None
+    )
+    if not finished:
+        print(f"Job {job.id} was reclaimed by another worker before {worker_id} finished it")
+    return bool(finished)
+
+
+def run_worker(worker_id=None, poll_interval=2.0, once=False, max_jobs=None, write_batch=1, log=print):
+    """
+    Claim and run jobs until stopped. With once=True, return when no job is
+    claimable. The articles of up to write_batch jobs are written together, and
+    those jobs finished once they are. Returns the number of jobs run.
+    """
+    worker_id = worker_id or make_worker_id()
+    writer = ArticleWriter()
+    heartbeat = LeaseHeartbeat(worker_id)
+    heartbeat.start()
+    generated = []
+    jobs_run = 0
+    try:
+        while max_jobs is None or jobs_run < max_jobs:
+            # Long-running workers must not hold on to connections the database has dropped
+            # (not when called within a transaction, whose connection this would close)
+            if not connection.in_atomic_block:
+                close_old_connections()
+            job = claim_next_job(worker_id)
+            if job is None and generated:
+                # Finish the jobs in hand rather than wait on an idle queue; that also frees
+                # their organizations' concurrency for the jobs still queued
+                write_generated_jobs(generated, writer, worker_id, heartbeat, log)
+                generated = []
+                continue
+            if job is None:
+                if once:
+                    break
+                time.sleep(poll_interval)
+                continue
+
+            log(f"Worker {worker_id} running job {job.id} for agent {job.agent_instance_id}")
+            generated.append((job, generate_job_articles(job, worker_id, writer, heartbeat)))
+            jobs_run += 1
+            if len(generated) >= write_batch:
+                write_generated_jobs(generated, writer, worker_id, heartbeat, log)
+                generated = []
+    finally:
+        write_generated_jobs(generated, writer, worker_id, heartbeat, log)
+        heartbeat.stop()
+    return jobs_run
+
+
+def run_worker_pool(processes, **options):
+    """
+    Run `processes` workers in separate processes and wait for them to exit.
+    Returns the total number of jobs they ran.
+    """
+    # Child processes open their own connections
+    connections.close_all()
+    context = multiprocessing.get_context('spawn')
+    # Django must be set up in each child before the worker function (and with it this module) is unpickled
+    with context.Pool(processes, initializer=django.setup) as pool:
+        return sum(pool.map(_pool_worker, [options] * processes, chunksize=1))
+
+
+def _pool_worker(options):
+    return run_worker(**options)
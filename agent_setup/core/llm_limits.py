@@ -0,0 +1,258 @@
+import contextlib
+import threading
+import time
+
+import httpx
+import openai
+from django.conf import settings
+from tenacity import Retrying, retry_if_exception, stop_after_attempt, wait_random_exponential
+
+# Process-wide protection for calls to the LLM API, shared by every generation
+# run (cron, views, workers) in the process:
+#
+# - a token bucket caps the request rate
+# - adaptive concurrency (AIMD) grows the number of calls in flight while the
+#   API keeps up and halves it on 429s or slow responses
+# - failed calls are retried with jittered exponential backoff
+# - a circuit breaker stops calling the API after repeated failures, so runs go
+#   straight to default content until a probe call succeeds again
+
+RETRYABLE_ERRORS = (
+    openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError,
+    openai.InternalServerError, httpx.TimeoutException, TimeoutError,
+)
+TIMEOUT_ERRORS = (openai.APITimeoutError, httpx.TimeoutException, TimeoutError)
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+def time_left(deadline):
+    """
+    Seconds left until a call's deadline (a time.monotonic() value), or
+    LLM_CALL_TIMEOUT for calls without one. Raises TimeoutError once it has passed.
+    """
+    if deadline is None:
+        return settings.LLM_CALL_TIMEOUT
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise TimeoutError("LLM call timed out")
+    return left
+
+
+class TokenBucket:
+    """
+    Allows `rate` acquisitions per second on average and bursts of up to `capacity`.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            if deadline is not None and now + wait > deadline:
+                raise TimeoutError("Timed out waiting for the LLM rate limit")
+            time.sleep(wait)
+
+
+class AdaptiveConcurrencyLimit:
+    """
+    A semaphore whose size follows AIMD: +1 per `limit` successful calls that finish
+    within `latency_target` seconds, halved on a rate-limit response or a slow call.
+    """
+
+    def __init__(self, initial, minimum, maximum, latency_target):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_target = latency_target
+        self.in_flight = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, timeout=None):
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.in_flight < int(self.limit), timeout):
+                raise TimeoutError("Timed out waiting for an LLM concurrency slot")
+            self.in_flight += 1
+
+    def release(self, latency=None, throttled=False):
+        with self.condition:
+            self.in_flight -= 1
+            if throttled or (latency is not None and latency > self.latency_target):
+                self.limit = max(self.minimum, self.limit / 2)
+            elif latency is not None:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures. After `reset_timeout`
+    seconds one probe call is let through: success closes the circuit, failure
+    opens it again.
+    """
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def allow_request(self):
+        with self.lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = 'half_open'
+            if self.state == 'half_open' and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def is_open(self):
+        with self.lock:
+            return self.state == 'open' and time.monotonic() - self.opened_at < self.reset_timeout
+
+    def record_success(self):
+        with self.lock:
+            self.state = 'closed'
+            self.failures = 0
+            self.probing = False
+
+    def release_probe(self):
+        with self.lock:
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                if self.state != 'open':
+                    print(f"LLM circuit breaker opened after {self.failures} consecutive failures")
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+            self.probing = False
+
+
+class LLMCallLimiter:
+    def __init__(self):
+        self.bucket = TokenBucket(settings.LLM_RATE_LIMIT_PER_SECOND, settings.LLM_RATE_LIMIT_BURST)
+        self.concurrency = AdaptiveConcurrencyLimit(
+            settings.LLM_MAX_CONCURRENCY,
+            settings.LLM_ADAPTIVE_MIN_CONCURRENCY,
+            settings.LLM_ADAPTIVE_MAX_CONCURRENCY,
+            settings.LLM_LATENCY_TARGET
+        )
+        self.breaker = CircuitBreaker(settings.LLM_CIRCUIT_FAILURE_THRESHOLD, settings.LLM_CIRCUIT_RESET_SECONDS)
+        self.retries = 0
+        self.throttled = 0
+
+    @contextlib.contextmanager
+    def slot(self, deadline=None):
+        """
+        Hold a rate-limited concurrency slot for one API call and feed its outcome
+        to the concurrency limit and the circuit breaker. Waiting for the slot
+        counts toward the call's deadline.
+        """
+        if not self.breaker.allow_request():
+            raise CircuitOpenError("LLM circuit breaker is open")
+        try:
+            self.bucket.acquire(timeout=time_left(deadline))
+            self.concurrency.acquire(timeout=time_left(deadline))
+        except TimeoutError:
+            # Waiting on our own limits says nothing about the API's health
+            self.breaker.release_probe()
+            raise
+        started = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            throttled = isinstance(e, openai.RateLimitError)
+            if throttled:
+                self.throttled += 1
+            if isinstance(e, TIMEOUT_ERRORS):
+                self.concurrency.release(latency=time.monotonic() - started)
+            else:
+                # How long a rejected request (bad input, auth) took says nothing about the API's load
+                self.concurrency.release(throttled=throttled)
+            # Rate limiting is handled by backing off; only outages and timeouts open the circuit
+            if isinstance(e, RETRYABLE_ERRORS) and not throttled:
+                self.breaker.record_failure()
+            else:
+                self.breaker.release_probe()
+            raise
+        else:
+            self.concurrency.release(latency=time.monotonic() - started)
+            self.breaker.record_success()
+
+    def call(self, function, *args, deadline=None, **kwargs):
+        """
+        Call function (an LLM request) within a slot, retrying retryable API errors
+        with jittered exponential backoff until the deadline, if one is given.
+        Raises CircuitOpenError without calling it while the circuit breaker is open.
+        """
+        def run():
+            with self.slot(deadline):
+                return function(*args, **kwargs)
+
+        return self.retrying(deadline=deadline)(run)
+
+    def retrying(self, can_retry=None, deadline=None):
+        """
+        The tenacity retry policy for LLM calls; can_retry() returning False stops
+        further attempts (e.g. once part of a streamed response was delivered), as
+        does reaching the deadline.
+        """
+        def should_retry(e):
+            if not isinstance(e, RETRYABLE_ERRORS) or (can_retry is not None and not can_retry()):
+                return False
+            return deadline is None or time.monotonic() < deadline
+
+        backoff = wait_random_exponential(multiplier=settings.LLM_RETRY_BASE_WAIT, max=settings.LLM_RETRY_MAX_WAIT)
+
+        def wait(retry_state):
+            # Don't sleep past the deadline
+            if deadline is None:
+                return backoff(retry_state)
+            return min(backoff(retry_state), max(0, deadline - time.monotonic()))
+
+        return Retrying(
+            retry=retry_if_exception(should_retry),
+            stop=stop_after_attempt(settings.LLM_RETRY_ATTEMPTS),
+            wait=wait,
+            before_sleep=self._count_retry,
+            reraise=True
+        )
+
+    def _count_retry(self, retry_state):
+        self.retries += 1
+        print(f"Retrying LLM call after {type(retry_state.outcome.exception()).__name__} (attempt {retry_state.attempt_number})")
+
+    def stats(self):
+        return {
+            'concurrency_limit': int(self.concurrency.limit),
+            'in_flight': self.concurrency.in_flight,
+            'circuit': self.breaker.state,
+            'retries': self.retries,
+            'throttled': self.throttled,
+        }
+
+
+llm_limiter = LLMCallLimiter()
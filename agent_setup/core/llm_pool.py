@@ -0,0 +1,82 @@
+import threading
+
+import httpx
+from django.conf import settings
+from langchain_openai import ChatOpenAI
+
+# Process-wide LLM clients. Building a ChatOpenAI per generation run means a new
+# HTTP client, and a new TCP/TLS handshake, for every run; instead one httpx
+# client with keep-alive is shared per API base URL and one ChatOpenAI per
+# model/base URL/key/temperature.
+
+_lock = threading.Lock()
+_http_clients = {}
+_llms = {}
+_stats = {'requests': 0, 'new_connections': 0}
+
+
+def get_llm(model_name, api_base, api_key, temperature):
+    """
+    Return the pooled ChatOpenAI client for these settings, creating it on first use.
+    """
+    key = (model_name, api_base, api_key, temperature)
+    with _lock:
+        llm = _llms.get(key)
+        if llm is None:
+            llm = ChatOpenAI(
+                model_name=model_name,
+                openai_api_key=api_key,
+                openai_api_base=api_base,
+                temperature=temperature,
+                request_timeout=settings.LLM_CALL_TIMEOUT,
+                # Retries go through llm_limits so they back off and count toward the limits
+                max_retries=0,
+                http_client=_get_http_client(api_base)
+            )
+            _llms[key] = llm
+        return llm
+
+
+def connection_stats():
+    """
+    HTTP requests made through pooled clients and how many of them reused a connection.
+    """
+    with _lock:
+        requests = _stats['requests']
+        new_connections = _stats['new_connections']
+    return {
+        'requests': requests,
+        'new_connections': new_connections,
+        'reused_connections': max(0, requests - new_connections),
+        'reuse_ratio': round((requests - new_connections) / requests, 3) if requests else None,
+    }
+
+
+def _get_http_client(api_base):
+    # Callers hold _lock
+    client = _http_clients.get(api_base)
+    if client is None:
+        client = httpx.Client(
+            limits=httpx.Limits(
+                max_connections=settings.LLM_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.LLM_HTTP_MAX_CONNECTIONS,
+                keepalive_expiry=settings.LLM_HTTP_KEEPALIVE_EXPIRY
+            ),
+            timeout=settings.LLM_CALL_TIMEOUT,
+            event_hooks={'request': [_track_request]}
+        )
+        _http_clients[api_base] = client
+    return client
+
+
+def _track_request(request):
+    with _lock:
+        _stats['requests'] += 1
+    # httpcore reports connection set-up through the trace extension
+    request.extensions['trace'] = _trace
+
+
+def _trace(event_name, info):
+    if event_name == 'connection.connect_tcp.complete':
+        with _lock:
+            _stats['new_connections'] += 1
@@ -0,0 +1,175 @@
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# A stand-in for the OpenAI-compatible chat completions API, for measuring the
+# article pipeline without calling OpenRouter. Point OPENROUTER_API_BASE at
+# http://<host>:<port>/v1 (and set any OPENROUTER_API_KEY) to use it.
+
+WORDS = [
+    'revenue', 'growth', 'customers', 'orders', 'trend', 'quarter', 'region', 'margin',
+    'performance', 'strategy', 'increase', 'decline', 'opportunity', 'market', 'data',
+]
+BATCH_PATTERN = re.compile(r'JSON array of (\d+) strings')
+
+
+class StubLLMServer(ThreadingHTTPServer):
+    """
+    HTTP server answering /chat/completions with generated text.
+
+    latency is the delay before the first token in seconds, tokens_per_second the
+    generation speed after that. error_rate and rate_limit_rate are the fractions
+    of requests answered with a 500 or a 429 instead.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.5, tokens_per_second=50, completion_tokens=200,
+                 error_rate=0.0, rate_limit_rate=0.0, seed=None):
+        super().__init__(address, _StubHandler)
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.completion_tokens = completion_tokens
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'completions': 0, 'errors': 0, 'rate_limited': 0}
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}/v1'
+
+    def count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+    def pick_failure(self):
+        with self.lock:
+            roll = self.random.random()
+        if roll < self.rate_limit_rate:
+            return 429
+        if roll < self.rate_limit_rate + self.error_rate:
+            return 500
+        return None
+
+    def make_tokens(self, prompt):
+        """
+        The completion as a list of tokens. Prompts asking for a JSON array of N
+        articles (generation_mode 'batch') get one.
+        """
+        with self.lock:
+            words = [self.random.choice(WORDS) for _ in range(self.completion_tokens)]
+        match = BATCH_PATTERN.search(prompt)
+        if not match:
+            return [words[0].title()] + [f' {word}' for word in words[1:]]
+
+        count = int(match.group(1))
+        per_article = max(1, len(words) // count)
+        articles = [' '.join(words[i * per_article:(i + 1) * per_article]).capitalize() for i in range(count)]
+        text = json.dumps(articles)
+        # Keep roughly completion_tokens tokens so batch and per-article runs compare fairly
+        step = max(1, len(text) // self.completion_tokens)
+        return [text[i:i + step] for i in range(0, len(text), step)]
+
+
+def start_stub_server(host='127.0.0.1', port=0, **options):
+    """
+    Start a StubLLMServer in a background thread; port 0 picks a free port.
+    """
+    server = StubLLMServer((host, port), **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if not self.path.rstrip('/').endswith('/models'):
+            return self._send_json(404, {'error': {'message': 'Not found'}})
+        self._send_json(200, {'object': 'list', 'data': [{'id': 'stub', 'object': 'model', 'owned_by': 'stub'}]})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            payload = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            return self._send_json(400, {'error': {'message': 'Invalid JSON'}})
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            return self._send_json(404, {'error': {'message': 'Not found'}})
+
+        server = self.server
+        server.count('requests')
+        failure = server.pick_failure()
+        if failure == 429:
+            server.count('rate_limited')
+            return self._send_json(429, {'error': {'message': 'Rate limit exceeded', 'type': 'rate_limit_error'}}, {'Retry-After': '1'})
+        if failure == 500:
+            server.count('errors')
+            return self._send_json(500, {'error': {'message': 'Injected server error', 'type': 'server_error'}})
+
+        prompt = '\n'.join(str(message.get('content', '')) for message in payload.get('messages', []))
+        tokens = server.make_tokens(prompt)
+        model = payload.get('model', 'stub')
+        completion_id = f'chatcmpl-{uuid.uuid4().hex}'
+        time.sleep(server.latency)
+
+        if payload.get('stream'):
+            self._stream(completion_id, model, tokens)
+        else:
+            time.sleep(len(tokens) / server.tokens_per_second)
+            self._send_json(200, {
+                'id': completion_id,
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': ''.join(tokens)}, 'finish_reason': 'stop'}],
+                'usage': {'prompt_tokens': len(prompt) // 4, 'completion_tokens': len(tokens), 'total_tokens': len(prompt) // 4 + len(tokens)},
+            })
+        server.count('completions')
+
+    def _stream(self, completion_id, model, tokens):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for index, token in enumerate(tokens + [None]):
+            if index:
+                time.sleep(1 / self.server.tokens_per_second)
+            chunk = {
+                'id': completion_id,
+                'object': 'chat.completion.chunk',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{
+                    'index': 0,
+                    'delta': {'content': token} if token is not None else {},
+                    'finish_reason': None if token is not None else 'stop',
+                }],
+            }
+            self._write_chunk(f'data: {json.dumps(chunk)}\n\n')
+        self._write_chunk('data: [DONE]\n\n')
+        self.wfile.write(b'0\r\n\r\n')
+
+    def _write_chunk(self, text):
+        data = text.encode()
+        self.wfile.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+        self.wfile.flush()
+
+    def _send_json(self, status_code, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
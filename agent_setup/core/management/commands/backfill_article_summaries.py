@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from core.models import Article
+
+
+class Command(BaseCommand):
+    help = "Set excerpt and content_length on articles written before they were stored, e.g. after migrating."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Articles read and updated at a time.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        articles = Article.objects.filter(content_length=0).exclude(content='').only('id', 'content').order_by('id')
+        updated = 0
+        last_id = None
+        while True:
+            batch = list((articles.filter(id__gt=last_id) if last_id else articles)[:batch_size])
+            if not batch:
+                break
+            for article in batch:
+                article.set_summary()
+            Article.objects.bulk_update(batch, ['excerpt', 'content_length'])
+            updated += len(batch)
+            last_id = batch[-1].id
+        self.stdout.write(f"Set summaries of {updated} articles")
@@ -0,0 +1,200 @@
+import contextlib
+import io
+import time
+
+import numpy as np
+import pandas as pd
+from django.core.management.base import BaseCommand
+
+from core.utils import perform_comprehensive_analysis
+
+
+class Command(BaseCommand):
+    help = 'Benchmark perform_comprehensive_analysis against the previous implementation on synthetic data.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000)
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--agents', nargs='+', default=['Sales Agent', 'Finance Agent', 'Marketing Agent', 'Operations Agent'])
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        df = make_sales_frame(options['rows'], options['seed'])
+        mapping_config = {
+            'date_column': 'date',
+            'metric_columns': ['revenue', 'orders', 'customers', 'avg_order_value', 'customer_satisfaction'],
+            'category_columns': ['product_category', 'region'],
+        }
+        self.stdout.write(f"{options['rows']:,} rows, best of {options['repeat']} runs")
+
+        for agent_name in options['agents']:
+            legacy_time = best_time(legacy_comprehensive_analysis, df, mapping_config, agent_name, options['repeat'])
+            current_time = best_time(perform_comprehensive_analysis, df, mapping_config, agent_name, options['repeat'])
+            self.stdout.write(
+                f"{agent_name:<20} legacy {legacy_time:8.3f}s  current {current_time:8.3f}s  "
+                f"speedup {legacy_time / current_time:6.1f}x"
+            )
+
+
+def make_sales_frame(rows, seed):
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2015-01-01', periods=3650).strftime('%Y-%m-%d')
+    orders = rng.integers(1, 500, rows)
+    revenue = orders * rng.uniform(20, 400, rows)
+    return pd.DataFrame({
+        'date': rng.choice(dates, rows),
+        'revenue': revenue.round(2),
+        'orders': orders,
+        'customers': rng.integers(1, 300, rows),
+        'product_category': rng.choice(['Electronics', 'Clothing', 'Home', 'Sports', 'Books', 'Toys', 'Beauty'], rows),
+        'region': rng.choice(['North', 'South', 'East', 'West', 'Central'], rows),
+        'avg_order_value': (revenue / orders).round(2),
+        'customer_satisfaction': rng.uniform(1, 5, rows).round(1),
+    })
+
+
+def best_time(function, df, mapping_config, agent_name, repeat):
+    timings = []
+    for _ in range(repeat):
+        # The legacy implementation mutates its input, so each run gets a fresh copy
+        frame = df.copy()
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            function(frame, mapping_config, agent_name)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def legacy_comprehensive_analysis(df, mapping_config, agent_name):
+    """
+    The previous perform_comprehensive_analysis implementation, kept as the
+    baseline for this benchmark. It sorts per metric, filters per category in a
+    Python loop and runs a separate groupby per insight.
+    """
+    analysis = {}
+    
+    # Get key columns
+    metric_columns = mapping_config.get('metric_columns', [])
+    date_column = mapping_config.get('date_column', df.columns[0])
+    category_columns = mapping_config.get('category_columns', [])
+    
+    
+    # Basic statistical analysis
+    for metric in metric_columns:
+        if metric in df.columns:
+            mean_val = df[metric].mean()
+            max_val = df[metric].max()
+            min_val = df[metric].min()
+            std_val = df[metric].std()
+            
+            # Trend analysis
+            recent_data = df.sort_values(by=date_column).tail(5)
+            if len(recent_data) >= 2:
+                recent_trend = recent_data[metric].iloc[-1] - recent_data[metric].iloc[0]
+                trend_direction = 'increasing' if recent_trend > 0 else 'decreasing'
+                trend_strength = abs(recent_trend) / mean_val if mean_val > 0 else 0
+            else:
+                trend_direction = 'stable'
+                trend_strength = 0
+            
+            # Growth rate calculation
+            if len(df) >= 2:
+                first_value = df.sort_values(by=date_column)[metric].iloc[0]
+                last_value = df.sort_values(by=date_column)[metric].iloc[-1]
+                growth_rate = ((last_value - first_value) / first_value * 100) if first_value > 0 else 0
+            else:
+                growth_rate = 0
+            
+            analysis[metric] = {
+                'mean': mean_val,
+                'max': max_val,
+                'min': min_val,
+                'std': std_val,
+                'trend_direction': trend_direction,
+                'trend_strength': trend_strength,
+                'growth_rate': growth_rate,
+                'recent_values': recent_data[metric].tolist() if len(recent_data) > 0 else []
+            }
+    
+    # Category analysis for sales insights
+    if agent_name.lower() in ['sales', 'sales agent', 'sales team']:
+        for category in category_columns:
+            if category in df.columns:
+                category_counts = df[category].value_counts()
+                category_performance = {}
+                
+                for cat_name in category_counts.index[:5]:  # Top 5 categories
+                    cat_data = df[df[category] == cat_name]
+                    if 'revenue' in df.columns:
+                        cat_revenue = cat_data['revenue'].sum()
+                        category_performance[cat_name] = {
+                            'count': len(cat_data),
+                            'total_revenue': cat_revenue,
+                            'avg_revenue': cat_revenue / len(cat_data) if len(cat_data) > 0 else 0
+                        }
+                
+                analysis[f'{category}_insights'] = category_performance
+    
+    # Financial analysis for finance agents
+    if agent_name.lower() in ['finance', 'finance agent', 'financial']:
+        if 'revenue' in df.columns and 'orders' in df.columns:
+            # Profitability analysis
+            df['profit_margin'] = (df['revenue'] / df['orders']).fillna(0)
+            analysis['profitability'] = {
+                'avg_profit_margin': df['profit_margin'].mean(),
+                'profit_trend': 'increasing' if df['profit_margin'].iloc[-1] > df['profit_margin'].iloc[0] else 'decreasing'
+            }
+            
+            # Cash flow analysis
+            if len(df) >= 2:
+                revenue_trend = df.sort_values(by=date_column)['revenue'].diff().mean()
+                analysis['cash_flow'] = {
+                    'avg_daily_revenue_change': revenue_trend,
+                    'cash_flow_stability': 'stable' if abs(revenue_trend) < df['revenue'].mean() * 0.1 else 'volatile'
+                }
+    
+    # Marketing analysis for marketing agents
+    if agent_name.lower() in ['marketing', 'marketing agent', 'marketing team', 'digital marketing']:
+        # Customer acquisition analysis
+        if 'customers' in df.columns and 'revenue' in df.columns:
+            df['customer_acquisition_cost'] = (df['revenue'] / df['customers']).fillna(0)
+            analysis['marketing_metrics'] = {
+                'avg_customer_acquisition_cost': df['customer_acquisition_cost'].mean(),
+                'customer_lifetime_value': df['revenue'].sum() / df['customers'].sum() if df['customers'].sum() > 0 else 0,
+                'conversion_rate': (df['orders'].sum() / df['customers'].sum() * 100) if 'orders' in df.columns and df['customers'].sum() > 0 else 0
+            }
+        
+        # Campaign performance analysis
+        if 'product_category' in df.columns:
+            category_performance = df.groupby('product_category').agg({
+                'revenue': ['sum', 'mean', 'count'],
+                'customers': 'sum' if 'customers' in df.columns else 'count'
+            }).round(2)
+            analysis['campaign_performance'] = category_performance.to_dict()
+        
+        # Market penetration analysis
+        if 'region' in df.columns:
+            region_penetration = df.groupby('region').agg({
+                'customers': 'sum' if 'customers' in df.columns else 'count',
+                'revenue': 'sum'
+            }).round(2)
+            analysis['market_penetration'] = region_penetration.to_dict()
+    
+    # Regional analysis if region data exists
+    if 'region' in df.columns:
+        region_performance = df.groupby('region').agg({
+            'revenue': ['sum', 'mean', 'count']
+        }).round(2)
+        analysis['regional_insights'] = region_performance.to_dict()
+    
+    # Seasonal patterns
+    if date_column in df.columns:
+        try:
+            df[date_column] = pd.to_datetime(df[date_column])
+            df['month'] = df[date_column].dt.month
+            monthly_trends = df.groupby('month')['revenue'].mean() if 'revenue' in df.columns else df.groupby('month')[metric_columns[0]].mean()
+            analysis['seasonal_patterns'] = monthly_trends.to_dict()
+        except:
+            pass
+    
+    return analysis
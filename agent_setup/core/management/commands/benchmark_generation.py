@@ -0,0 +1,166 @@
+import contextlib
+import io
+import time
+import uuid
+from unittest import mock
+
+import numpy as np
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import override_settings
+from rest_framework.test import APIRequestFactory
+
+from core import cron, jobs, utils
+from core.datasource_cache import invalidate_datasource_cache
+from core.llm_pool import connection_stats
+from core.llm_stub import start_stub_server
+from core.management.commands.benchmark_analysis import make_sales_frame
+from core.models import AgentInstance, Article, DataSource, Organization
+from core.views import ArticleCreateView
+
+AGENT_NAMES = ['Sales Agent', 'Finance Agent', 'Marketing Agent', 'Operations Agent']
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark article generation end to end through ArticleCreateView and the daily cron job. '
+        'Everything written to the database is rolled back afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--agents', type=int, default=20)
+        parser.add_argument('--articles', type=int, default=3, help='article_count of each agent.')
+        parser.add_argument('--rows', type=int, default=10000, help='Rows in the shared synthetic data source.')
+        parser.add_argument('--phases', nargs='+', choices=['view', 'cron'], default=['view', 'cron'])
+        parser.add_argument('--generation-mode', default=None, help="configuration.generation_mode, e.g. 'batch'.")
+        parser.add_argument('--no-stub', action='store_true',
+                            help='Use the configured OPENROUTER_API_BASE instead of an in-process stub server.')
+        parser.add_argument('--latency', type=float, default=0.5, help='Stub: seconds before the first token.')
+        parser.add_argument('--tokens-per-second', type=float, default=200, help='Stub: generation speed.')
+        parser.add_argument('--completion-tokens', type=int, default=200, help='Stub: tokens per completion.')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Stub: fraction of 500 responses.')
+        parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='Stub: fraction of 429 responses.')
+        parser.add_argument('--use-llm-cache', action='store_true', help='Keep the completion cache enabled.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        with contextlib.ExitStack() as stack:
+            if not options['no_stub']:
+                server = start_stub_server(
+                    latency=options['latency'],
+                    tokens_per_second=options['tokens_per_second'],
+                    completion_tokens=options['completion_tokens'],
+                    error_rate=options['error_rate'],
+                    rate_limit_rate=options['rate_limit_rate'],
+                    seed=options['seed']
+                )
+                stack.callback(server.shutdown)
+                stack.enter_context(mock.patch.object(utils, 'OPENROUTER_API_BASE', server.base_url))
+                stack.enter_context(mock.patch.object(utils, 'OPENROUTER_API_KEY', 'stub'))
+                self.stdout.write(f"Stub LLM API on {server.base_url}")
+            elif utils.OPENROUTER_API_KEY == "your-openrouter-api-key":
+                self.stdout.write("OPENROUTER_API_KEY is not set: only default content will be measured")
+            # Otherwise repeated runs would only measure cache hits
+            stack.enter_context(override_settings(LLM_CACHE_ENABLED=options['use_llm_cache']))
+
+            datasource = None
+            try:
+                with transaction.atomic():
+                    datasource, agents = self.create_fixtures(options)
+                    for phase in options['phases']:
+                        articles_before = Article.objects.filter(agent_instance__in=agents).count()
+                        timings, writes, elapsed = self.run_phase(phase, agents)
+                        articles = Article.objects.filter(agent_instance__in=agents).count() - articles_before
+                        self.report(phase, len(agents), articles, timings, writes, elapsed)
+                    # Nothing the benchmark created or generated is kept
+                    transaction.set_rollback(True)
+            finally:
+                if datasource is not None:
+                    invalidate_datasource_cache(datasource)
+                    datasource.file.delete(save=False)
+
+            if not options['no_stub']:
+                self.stdout.write(f"Stub: {server.stats}")
+            self.stdout.write(f"LLM connections: {connection_stats()}")
+
+    def create_fixtures(self, options):
+        df = make_sales_frame(options['rows'], options['seed'])
+        organization = Organization.objects.create(name=f'Benchmark {uuid.uuid4().hex[:8]}')
+        datasource = DataSource(name='Benchmark data', source_type='csv', connection_params={}, date_column='date')
+        datasource.file.save(f'benchmark_{uuid.uuid4().hex}.csv', ContentFile(df.to_csv(index=False).encode()), save=False)
+        datasource.save()
+
+        mapping_config = {
+            'date_column': 'date',
+            'metric_columns': ['revenue', 'orders', 'customers', 'avg_order_value', 'customer_satisfaction'],
+            'category_columns': ['product_category', 'region'],
+        }
+        configuration = {'article_count': options['articles'], 'schedule': 'daily'}
+        if options['generation_mode']:
+            configuration['generation_mode'] = options['generation_mode']
+        agents = [
+            AgentInstance.objects.create(
+                agent_id=1,
+                organization=organization,
+                agent_instance_name=AGENT_NAMES[i % len(AGENT_NAMES)],
+                configuration=configuration,
+                datasource=datasource,
+                mapping_config=mapping_config
+            )
+            for i in range(options['agents'])
+        ]
+        # Only the benchmark's agents are due in the cron phase; this is rolled back with the rest
+        AgentInstance.objects.exclude(id__in=[agent.id for agent in agents]).update(next_run_at=None)
+        return datasource, agents
+
+    def run_phase(self, phase, agents):
+        timings = []
+        writes = []
+
+        def time_writes(execute, sql, params, many, context):
+            if not sql.lstrip().upper().startswith(('INSERT', 'UPDATE', 'DELETE')):
+                return execute(sql, params, many, context)
+            started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                writes.append(time.perf_counter() - started)
+
+        def timed(function):
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    timings.append(time.perf_counter() - started)
+            return wrapper
+
+        started = time.perf_counter()
+        with connection.execute_wrapper(time_writes), contextlib.redirect_stdout(io.StringIO()):
+            if phase == 'view':
+                view = timed(ArticleCreateView.as_view())
+                factory = APIRequestFactory()
+                for agent in agents:
+                    request = factory.post(f'/agent-instances/{agent.id}/articles/', {'agent_instance_id': agent.id, 'articles': []}, format='json')
+                    response = view(request, instance_id=agent.id)
+                    if response.status_code != 201:
+                        self.stderr.write(f"Agent {agent.id}: HTTP {response.status_code} {response.data}")
+            else:
+                # Time each agent's run within the cron job. Its jobs run in this process, since worker
+                # processes couldn't see the benchmark's uncommitted data.
+                with mock.patch.object(jobs, 'generate_articles', timed(jobs.generate_articles)), \
+                        override_settings(GENERATION_CRON_WORKERS=1):
+                    cron.generate_daily_articles()
+        return timings, writes, time.perf_counter() - started
+
+    def report(self, phase, agent_count, articles, timings, writes, elapsed):
+        latencies = np.array(timings or [0.0])
+        self.stdout.write(
+            f"{phase:<5} {agent_count} agents  {articles} articles in {elapsed:.2f}s  "
+            f"{articles / elapsed:.2f} articles/s"
+        )
+        self.stdout.write(
+            f"      per agent p50 {np.percentile(latencies, 50):.3f}s  p95 {np.percentile(latencies, 95):.3f}s  "
+            f"DB writes {sum(writes):.3f}s over {len(writes)} statements"
+        )
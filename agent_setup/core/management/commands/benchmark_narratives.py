@@ -0,0 +1,121 @@
+import time
+import uuid
+from datetime import timedelta
+from unittest import mock
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from core.models import AgentInstance, Article, Organization
+from core.narratives import ARTICLE_SUMMARY_FIELDS, get_agent_articles, get_daily_articles, get_timezone, project_articles
+from core.pagination import get_keyset_filter
+from core.serializers import ArticleSerializer
+
+INSERT_CHUNK = 50000
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the narrative lookups (articles of a day, articles of an agent instance) over a large '
+        'synthetic article table. Everything written to the database is rolled back afterwards, but run it '
+        'against a scratch database: the table is large.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--articles', type=int, default=10_000_000)
+        parser.add_argument('--agents', type=int, default=1000)
+        parser.add_argument('--days', type=int, default=365, help='Days, up to today, the articles are spread over.')
+        parser.add_argument('--page-size', type=int, default=100, help='Articles fetched per lookup.')
+        parser.add_argument('--repeat', type=int, default=50, help='Lookups timed per query.')
+        parser.add_argument('--tz', default=None, help='Timezone days are counted in (default TIME_ZONE).')
+        parser.add_argument('--date-lookup', action='store_true',
+                            help='Also time the created_at__date lookup the daily view used to make (a full scan).')
+        parser.add_argument('--content-size', type=int, default=20,
+                            help='Characters of content per article (generated articles run to several thousand).')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        tz = get_timezone(options['tz'])
+        with transaction.atomic():
+            agent_ids = self.create_fixtures(options, rng)
+            today = timezone.localdate(timezone=tz)
+            days = [today - timedelta(days=int(offset)) for offset in rng.integers(0, options['days'], options['repeat'])]
+            agents = [int(agent_id) for agent_id in rng.choice(agent_ids, options['repeat'])]
+            page = options['page_size']
+
+            daily = [get_daily_articles(day, tz) for day in days]
+            by_agent = [get_agent_articles(agent_id) for agent_id in agents]
+            self.time_query('daily page', [queryset[:page] for queryset in daily], list)
+            self.time_query('daily page via cursor', self.deep_pages(daily, page, rng), list)
+            self.time_query('daily count', daily, lambda queryset: queryset.count())
+            self.time_query('agent page', [queryset[:page] for queryset in by_agent], list)
+            self.time_query('agent page via cursor', self.deep_pages(by_agent, page, rng), list)
+            self.time_query('agent count', by_agent, lambda queryset: queryset.count())
+            # What the endpoints return: the page serialized, in full and as ?view=summary
+            self.time_query('daily page serialized', [queryset[:page] for queryset in daily],
+                            lambda queryset: ArticleSerializer(queryset, many=True).data)
+            self.time_query('daily page serialized (summary)', [
+                project_articles(queryset, ARTICLE_SUMMARY_FIELDS)[:page] for queryset in daily
+            ], lambda queryset: ArticleSerializer(queryset, many=True, fields=ARTICLE_SUMMARY_FIELDS).data)
+            if options['date_lookup']:
+                # Slow over a large table; a few runs are enough
+                self.time_query('daily page (created_at__date)', [
+                    Article.objects.filter(created_at__date=day).order_by('created_at', 'id')[:page] for day in days[:3]
+                ], list)
+            # Nothing the benchmark created is kept
+            transaction.set_rollback(True)
+
+    def create_fixtures(self, options, rng):
+        organization = Organization.objects.create(name=f'Benchmark {uuid.uuid4().hex[:8]}')
+        agents = AgentInstance.objects.bulk_create([
+            AgentInstance(agent_id=1, organization=organization, agent_instance_name='Sales Agent',
+                          configuration={}, mapping_config={})
+            for i in range(options['agents'])
+        ])
+        agent_ids = np.array([agent.id for agent in agents])
+
+        end = timezone.now()
+        span = options['days'] * 86400
+        content = ('Benchmark content. ' * (options['content_size'] // 19 + 1))[:options['content_size']]
+        summary = Article(content=content)
+        summary.set_summary()
+        started = time.perf_counter()
+        # created_at is normally set to the time of the insert
+        with mock.patch.object(Article._meta.get_field('created_at'), 'auto_now_add', False):
+            for offset in range(0, options['articles'], INSERT_CHUNK):
+                count = min(INSERT_CHUNK, options['articles'] - offset)
+                ages = rng.integers(0, span, count)
+                owners = rng.choice(agent_ids, count)
+                Article.objects.bulk_create([
+                    Article(title='Benchmark article', content=content, excerpt=summary.excerpt,
+                            content_length=summary.content_length, agent_instance_id=int(owner),
+                            created_at=end - timedelta(seconds=int(age)))
+                    for age, owner in zip(ages, owners)
+                ], batch_size=5000)
+        self.stdout.write(f"Inserted {options['articles']} articles for {options['agents']} agents in {time.perf_counter() - started:.1f}s")
+        return agent_ids
+
+    def deep_pages(self, querysets, page, rng):
+        """
+        For each queryset, the page that follows a cursor at a random depth in it.
+        """
+        pages = []
+        for queryset in querysets:
+            ordering = queryset.query.order_by
+            fields = [name.lstrip('-') for name in ordering]
+            count = queryset.count()
+            values = queryset.values_list(*fields)[int(rng.integers(0, count))] if count else None
+            pages.append((queryset.filter(get_keyset_filter(ordering, values)) if values else queryset)[:page])
+        return pages
+
+    def time_query(self, name, querysets, run):
+        self.stdout.write(f"{name}: {querysets[0].explain()}")
+        timings = []
+        for queryset in querysets:
+            started = time.perf_counter()
+            run(queryset)
+            timings.append((time.perf_counter() - started) * 1000)
+        self.stdout.write(f"  p50 {np.percentile(timings, 50):.2f}ms  p95 {np.percentile(timings, 95):.2f}ms  max {max(timings):.2f}ms")
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from core.llm_stub import StubLLMServer
+
+
+class Command(BaseCommand):
+    help = 'Run a local OpenAI-compatible stand-in for the LLM API, for benchmarking article generation offline.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8001)
+        parser.add_argument('--latency', type=float, default=0.5, help='Seconds before the first token.')
+        parser.add_argument('--tokens-per-second', type=float, default=50)
+        parser.add_argument('--completion-tokens', type=int, default=200)
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with a 500.')
+        parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='Fraction of requests answered with a 429.')
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        server = StubLLMServer(
+            (options['host'], options['port']),
+            latency=options['latency'],
+            tokens_per_second=options['tokens_per_second'],
+            completion_tokens=options['completion_tokens'],
+            error_rate=options['error_rate'],
+            rate_limit_rate=options['rate_limit_rate'],
+            seed=options['seed']
+        )
+        self.stdout.write(f"Stub LLM API listening on {server.base_url}")
+        self.stdout.write(f"Use it with OPENROUTER_API_BASE={server.base_url} and any OPENROUTER_API_KEY")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(f"Served: {server.stats}")
@@ -0,0 +1,33 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.jobs import run_worker, run_worker_pool
+
+
+class Command(BaseCommand):
+    help = 'Run queued article generation jobs. Start more workers, here or on other machines, to generate for more agents at once.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=settings.GENERATION_WORKER_PROCESSES, help='Worker processes to run.')
+        parser.add_argument('--poll-interval', type=float, default=2.0, help='Seconds to wait when the queue is empty.')
+        parser.add_argument('--once', action='store_true', help='Exit when the queue is empty instead of polling.')
+        parser.add_argument('--max-jobs', type=int, default=None, help='Exit after each worker has run this many jobs.')
+        parser.add_argument('--write-batch', type=int, default=1, help='Jobs whose articles each worker writes together.')
+
+    def handle(self, *args, **options):
+        worker_options = {
+            'poll_interval': options['poll_interval'],
+            'once': options['once'],
+            'max_jobs': options['max_jobs'],
+            'write_batch': options['write_batch'],
+        }
+        jobs_run = 0
+        self.stdout.write(f"Generation worker started with {options['processes']} processes")
+        try:
+            if options['processes'] > 1:
+                jobs_run = run_worker_pool(options['processes'], **worker_options)
+            else:
+                jobs_run = run_worker(log=self.stdout.write, **worker_options)
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(f"Generation worker stopped after {jobs_run} jobs")
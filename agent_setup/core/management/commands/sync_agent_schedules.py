@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from core.models import AgentInstance
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy configuration['schedule'] into AgentInstance.schedule/next_run_at for agents saved "
+        "before those fields existed or changed with queryset.update()."
+    )
+
+    def handle(self, *args, **options):
+        updated = 0
+        for agent in AgentInstance.objects.iterator():
+            before = (agent.schedule, agent.next_run_at)
+            # save() derives schedule and next_run_at from configuration
+            agent.save(update_fields=['configuration'])
+            if (agent.schedule, agent.next_run_at) != before:
+                updated += 1
+        self.stdout.write(f"Updated the schedule of {updated} agent instances")
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core.agent_stats import sync_agent_stats
+
+
+class Command(BaseCommand):
+    help = "Recompute agent instances' article and token totals from their articles, e.g. after migrating or deleting articles."
+
+    def add_arguments(self, parser):
+        parser.add_argument('agent_instance_ids', nargs='*', type=int, help='Agent instances to recompute (default all).')
+
+    def handle(self, *args, **options):
+        synced = sync_agent_stats(options['agent_instance_ids'] or None)
+        self.stdout.write(f"Recomputed stats for {synced} agent instances")
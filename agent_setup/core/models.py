@@ -1,11 +1,27 @@
 from django.db import models
+from django.utils import timezone
+from django.utils.text import Truncator
+from datetime import timedelta
 import uuid
 
+# configuration['schedule'] values agents can be run on, and how often
+SCHEDULE_INTERVALS = {
+    'hourly': timedelta(hours=1),
+    'daily': timedelta(days=1),
+    'weekly': timedelta(weeks=1),
+}
+
 class Organization(models.Model):
     id = models.BigAutoField(primary_key=True)
     name = models.CharField(max_length=255, unique=True)  # Add unique=True
     is_demo = models.BooleanField(default=False)
     data_source_connected = models.BooleanField(default=False)
+    # Article generation limits (see core.quotas); blank means the default concurrency and no quota
+    max_concurrent_generations = models.PositiveIntegerField(null=True, blank=True)
+    daily_article_quota = models.PositiveIntegerField(null=True, blank=True)
+    daily_token_quota = models.PositiveIntegerField(null=True, blank=True)
+    # When a worker last claimed one of the organization's generation jobs, for round-robin between organizations
+    last_generation_claimed_at = models.DateTimeField(null=True, blank=True, editable=False)
 
     def __str__(self):
         return self.name
@@ -43,6 +59,24 @@ class AgentInstance(models.Model):
     configuration = models.JSONField(default=dict)
     datasource = models.ForeignKey('DataSource', on_delete=models.SET_NULL, null=True, blank=True)
     mapping_config = models.JSONField(default=dict)
+    # Copied from configuration['schedule'] on save so due agents can be found through an index
+    schedule = models.CharField(max_length=20, blank=True, editable=False)
+    next_run_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [models.Index(fields=['next_run_at'])]
+
+    def save(self, *args, **kwargs):
+        schedule = self.configuration.get('schedule', '') if isinstance(self.configuration, dict) else ''
+        if schedule not in SCHEDULE_INTERVALS:
+            schedule = ''
+        if schedule != self.schedule:
+            # A new schedule is due right away; unscheduled agents are never due
+            self.schedule = schedule
+            self.next_run_at = timezone.now() if schedule else None
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'schedule', 'next_run_at'}
+        super().save(*args, **kwargs)
 
 class DataSource(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -53,10 +87,118 @@ class DataSource(models.Model):
     table_name = models.CharField(max_length=255, blank=True)
     date_column = models.CharField(max_length=255, blank=True)
     description = models.TextField(blank=True)
+    schema_profile = models.JSONField(default=dict, blank=True)
+
+class DataSourceAnalysisState(models.Model):
+    # Persisted AnalysisAccumulator for one DataSource + mapping_config + agent type,
+    # covering the file up to byte_offset
+    datasource = models.ForeignKey(DataSource, on_delete=models.CASCADE)
+    state_key = models.CharField(max_length=64)
+    byte_offset = models.BigIntegerField(default=0)
+    row_count = models.BigIntegerField(default=0)
+    header_hash = models.CharField(max_length=64)
+    tail_hash = models.CharField(max_length=64)
+    state = models.JSONField(default=dict)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('datasource', 'state_key')
+
+EXCERPT_LENGTH = 300
 
 class Article(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     title = models.CharField(max_length=255)
     content = models.TextField()
     agent_instance = models.ForeignKey(AgentInstance, on_delete=models.CASCADE)
-    created_at = models.DateTimeField(auto_now_add=True)
\ No newline at end of file
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Tokens sent to and received from the LLM; empty for articles not written by the LLM
+    prompt_tokens = models.PositiveIntegerField(null=True, blank=True)
+    completion_tokens = models.PositiveIntegerField(null=True, blank=True)
+    # Derived from content when the article is written, so listings can leave content out
+    excerpt = models.CharField(max_length=EXCERPT_LENGTH, blank=True, default='', editable=False)
+    content_length = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        # Narrative lookups by day and by agent instance, in created_at order; id breaks ties
+        indexes = [
+            models.Index(fields=['created_at', 'id']),
+            models.Index(fields=['agent_instance', 'created_at', 'id']),
+        ]
+
+    def set_summary(self):
+        """
+        Set excerpt and content_length from content. save() does this; writers
+        that bypass it (bulk_create, update) have to call it themselves.
+        """
+        content = self.content or ''
+        self.excerpt = Truncator(' '.join(content.split())).chars(EXCERPT_LENGTH)
+        self.content_length = len(content)
+
+    def save(self, *args, **kwargs):
+        self.set_summary()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'content' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'excerpt', 'content_length'}
+        super().save(*args, **kwargs)
+
+class AgentInstanceStats(models.Model):
+    """
+    Running totals for an agent instance, kept up to date by the article write
+    path (core.agent_stats) so metrics don't have to aggregate its articles.
+    """
+    agent_instance = models.OneToOneField(AgentInstance, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    total_articles = models.PositiveIntegerField(default=0)
+    prompt_tokens = models.PositiveBigIntegerField(default=0)
+    completion_tokens = models.PositiveBigIntegerField(default=0)
+    # When the latest articles were written, and how long the run that generated them took
+    last_run_at = models.DateTimeField(null=True, blank=True)
+    last_run_seconds = models.FloatField(null=True, blank=True)
+    # Runs that produced no articles
+    failed_runs = models.PositiveIntegerField(default=0)
+    last_failed_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+class GenerationJob(models.Model):
+    """
+    A queued request to generate articles for an agent instance, run by the
+    run_generation_worker command instead of the web request. A worker running
+    the job holds a lease on it until lease_expires_at, which its heartbeat
+    keeps extending.
+    """
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    agent_instance = models.ForeignKey(AgentInstance, on_delete=models.CASCADE, related_name='generation_jobs')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    # Last step reached while running: analysis, generation or saving
+    stage = models.CharField(max_length=20, blank=True)
+    articles_created = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    lease_owner = models.CharField(max_length=255, blank=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    # Times the job has been claimed; more than one means an earlier worker's lease expired
+    attempts = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+            models.Index(fields=['status', 'lease_expires_at']),
+        ]
+        constraints = [
+            # At most one queued or running job per agent instance; see enqueue_generation_job
+            models.UniqueConstraint(
+                fields=['agent_instance'],
+                condition=models.Q(status__in=['queued', 'running']),
+                name='one_active_generation_job_per_agent_instance',
+            ),
+        ]
@@ -0,0 +1,84 @@
+from datetime import datetime, time, timedelta
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from django.utils import timezone
+
+from .models import Article
+from .serializers import ArticleSerializer
+
+# Article lookups behind the narrative endpoints. Days are matched as a
+# created_at range, [local midnight, next local midnight), rather than
+# created_at__date, which wraps the column in a date function for every row and
+# so can't use the created_at indexes.
+
+# Fields of ?view=summary: what a listing shows, without the content
+ARTICLE_SUMMARY_FIELDS = ['id', 'title', 'excerpt', 'content_length', 'agent_instance', 'created_at']
+
+
+def get_timezone(name=None):
+    """
+    The named IANA timezone, or the current one (TIME_ZONE) if no name is given.
+    Raises ValueError for an unknown name.
+    """
+    if not name:
+        return timezone.get_current_timezone()
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"Unknown timezone: {name}")
+
+
+def get_day_range(day, tz=None):
+    """
+    The aware datetimes at which a calendar day starts and the next one starts in
+    tz. Days are 23 or 25 hours long across DST changes.
+    """
+    tz = tz or timezone.get_current_timezone()
+    start = datetime.combine(day, time.min, tzinfo=tz)
+    end = datetime.combine(day + timedelta(days=1), time.min, tzinfo=tz)
+    return start, end
+
+
+def get_daily_articles(day, tz=None):
+    """
+    Articles created on a calendar day in tz, oldest first.
+    """
+    start, end = get_day_range(day, tz)
+    return Article.objects.filter(created_at__gte=start, created_at__lt=end).order_by('created_at', 'id')
+
+
+def get_agent_articles(instance_id):
+    """
+    An agent instance's articles, newest first.
+    """
+    return Article.objects.filter(agent_instance_id=instance_id).order_by('-created_at', '-id')
+
+
+def get_article_fields(params):
+    """
+    The article fields a request asks for: ?view=summary for ARTICLE_SUMMARY_FIELDS,
+    ?fields=a,b for a choice of ArticleSerializer's fields, or None (the default,
+    or ?view=full) for all of them. Raises ValueError for an unknown view or field.
+    """
+    view = params.get('view', 'full')
+    if view not in ('full', 'summary'):
+        raise ValueError(f"Unknown view: {view}. Use full or summary.")
+    if params.get('fields'):
+        fields = [name.strip() for name in params['fields'].split(',') if name.strip()]
+        unknown = [name for name in fields if name not in ArticleSerializer.Meta.fields]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+        return fields
+    return ARTICLE_SUMMARY_FIELDS if view == 'summary' else None
+
+
+def project_articles(queryset, fields):
+    """
+    Load only the given fields (and the ordering columns, which the cursor is
+    made of) so that content, by far the largest column, isn't read from the
+    database when it won't be returned.
+    """
+    if fields is None:
+        return queryset
+    ordering = [name.lstrip('-') for name in queryset.query.order_by]
+    return queryset.only(*dict.fromkeys(['id', *ordering, *fields]))
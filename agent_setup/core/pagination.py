@@ -0,0 +1,93 @@
+import base64
+import binascii
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+# Keyset (cursor) pagination for the list and narrative endpoints. A page is
+# the first page_size rows after the last row of the previous page in the
+# queryset's ordering, found through the index on the ordering columns, so a
+# page deep into a long history costs the same as the first. The ordering must
+# end in a unique column (the primary key). The cursor is the previous page's
+# last row's ordering values, base64-encoded; clients pass it back as-is.
+
+
+def get_page_size(request):
+    value = request.query_params.get('page_size')
+    if value is None:
+        return settings.API_PAGE_SIZE
+    try:
+        page_size = int(value)
+    except ValueError:
+        page_size = 0
+    if page_size < 1:
+        raise ValueError("page_size must be a positive integer")
+    return min(page_size, settings.API_MAX_PAGE_SIZE)
+
+
+def encode_cursor(values):
+    data = json.dumps([str(value) for value in values]).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+def decode_cursor(cursor, model, ordering):
+    fields = [model._meta.get_field(name.lstrip('-')) for name in ordering]
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(fields):
+            raise ValueError
+        return [field.to_python(value) for field, value in zip(fields, values)]
+    except (ValueError, TypeError, ValidationError, binascii.Error):
+        raise ValueError("Invalid cursor")
+
+
+def get_keyset_filter(ordering, values):
+    """
+    Rows after `values` in `ordering`: (a, b) > (x, y) written as a >= x AND
+    (a > x OR (a = x AND b > y)), the first condition letting the database
+    start the index scan at x.
+    """
+    after = Q()
+    for i, name in enumerate(ordering):
+        lookup = 'lt' if name.startswith('-') else 'gt'
+        equal = {previous.lstrip('-'): value for previous, value in zip(ordering[:i], values[:i])}
+        after |= Q(**equal, **{f"{name.lstrip('-')}__{lookup}": values[i]})
+    first = ordering[0]
+    lookup = 'lte' if first.startswith('-') else 'gte'
+    return Q(**{f"{first.lstrip('-')}__{lookup}": values[0]}) & after
+
+
+def paginate(queryset, request):
+    """
+    The page of an ordered queryset selected by the request's cursor and
+    page_size query parameters, and the cursor of the next page (None on the
+    last page). Raises ValueError for an invalid cursor or page_size.
+    """
+    ordering = queryset.query.order_by
+    page_size = get_page_size(request)
+    cursor = request.query_params.get('cursor')
+    if cursor:
+        queryset = queryset.filter(get_keyset_filter(ordering, decode_cursor(cursor, queryset.model, ordering)))
+
+    # One extra row tells whether there is a next page
+    items = list(queryset[:page_size + 1])
+    if len(items) <= page_size:
+        return items, None
+    items = items[:page_size]
+    fields = [queryset.model._meta.get_field(name.lstrip('-')) for name in ordering]
+    return items, encode_cursor([field.value_from_object(items[-1]) for field in fields])
+
+
+def get_pagination_headers(request, next_cursor):
+    """
+    Headers pointing list endpoints' clients, whose responses are bare arrays,
+    to the next page.
+    """
+    if next_cursor is None:
+        return {}
+    query = request.query_params.copy()
+    query['cursor'] = next_cursor
+    next_url = request.build_absolute_uri(f"{request.path}?{query.urlencode()}")
+    return {'X-Next-Cursor': next_cursor, 'Link': f'<{next_url}>; rel="next"'}
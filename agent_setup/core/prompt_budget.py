@@ -0,0 +1,78 @@
+import math
+from functools import lru_cache
+
+import tiktoken
+from django.conf import settings
+
+# Token accounting for article prompts. Analysis insights are ranked by
+# importance and only as many as fit the model's prompt budget are sent, so the
+# prompt stays the same size however many columns and categories a data source has.
+
+# Truncate a line that doesn't fit only if at least this many tokens are left for it
+MIN_TRUNCATED_TOKENS = 16
+# Rough characters per token, used when no tiktoken encoding can be loaded
+CHARS_PER_TOKEN = 4
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model_name):
+    """
+    The tiktoken encoding for a model, or None when it can't be loaded (tiktoken
+    downloads encodings on first use, which fails on machines without network access).
+    """
+    # OpenRouter names models "<provider>/<model>"
+    name = model_name.split('/')[-1]
+    try:
+        try:
+            return tiktoken.encoding_for_model(name)
+        except KeyError:
+            return tiktoken.get_encoding('cl100k_base')
+    except Exception as e:
+        print(f"Could not load tiktoken encoding for {model_name}, estimating token counts instead: {str(e)}")
+        return None
+
+
+def count_tokens(text, model_name):
+    encoding = get_encoding(model_name)
+    if encoding is None:
+        return math.ceil(len(text) / CHARS_PER_TOKEN)
+    return len(encoding.encode(text))
+
+
+def truncate_to_tokens(text, max_tokens, model_name):
+    encoding = get_encoding(model_name)
+    if encoding is None:
+        return text[:max_tokens * CHARS_PER_TOKEN]
+    return encoding.decode(encoding.encode(text)[:max_tokens])
+
+
+def get_prompt_token_budget(model_name):
+    """
+    Token budget for a whole article prompt: LLM_PROMPT_TOKEN_BUDGETS[model_name]
+    if set, otherwise LLM_PROMPT_TOKEN_BUDGET.
+    """
+    return settings.LLM_PROMPT_TOKEN_BUDGETS.get(model_name, settings.LLM_PROMPT_TOKEN_BUDGET)
+
+
+def fit_insights(insights, max_tokens, model_name):
+    """
+    Choose the insights to send from a list of (importance, text) pairs.
+
+    Insights are taken most important first while they fit in max_tokens (one per
+    line); the first one that doesn't fit is truncated if enough room is left.
+    Returns the chosen lines in their original order and the number dropped.
+    """
+    remaining = max_tokens
+    chosen = {}
+    truncated = False
+    for index in sorted(range(len(insights)), key=lambda i: -insights[i][0]):
+        text = insights[index][1]
+        tokens = count_tokens(text + '\n', model_name)
+        if tokens <= remaining:
+            chosen[index] = text
+            remaining -= tokens
+        elif not truncated and remaining >= MIN_TRUNCATED_TOKENS:
+            chosen[index] = truncate_to_tokens(text, remaining - 2, model_name) + '...'
+            remaining = 0
+            truncated = True
+    return [chosen[index] for index in sorted(chosen)], len(insights) - len(chosen)
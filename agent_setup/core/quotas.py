@@ -0,0 +1,65 @@
+from django.conf import settings
+from django.db.models import Count, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Article
+
+# Per-organization limits on article generation. An organization runs at most
+# max_concurrent_generations jobs at once (GENERATION_ORG_MAX_CONCURRENCY if
+# unset) and, if it has quotas, generates at most daily_article_quota articles
+# and daily_token_quota LLM tokens a day. Days start at midnight in TIME_ZONE.
+
+
+def start_of_day(now=None):
+    return timezone.localtime(now or timezone.now()).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def get_max_concurrency(organization):
+    if organization.max_concurrent_generations is not None:
+        return organization.max_concurrent_generations
+    return settings.GENERATION_ORG_MAX_CONCURRENCY
+
+
+def get_daily_usage(organization_id, now=None):
+    """
+    Articles generated and LLM tokens used today by an organization's agents.
+    """
+    return get_daily_usage_by_organization([organization_id], now).get(organization_id, (0, 0))
+
+
+def get_daily_usage_by_organization(organization_ids, now=None):
+    """
+    get_daily_usage for several organizations in one query, as {organization_id:
+    (articles, tokens)}. Organizations with no articles today are left out.
+    """
+    if not organization_ids:
+        return {}
+    usage = Article.objects.filter(
+        agent_instance__organization_id__in=organization_ids, created_at__gte=start_of_day(now)
+    ).values('agent_instance__organization').annotate(
+        articles=Count('id'),
+        tokens=Coalesce(Sum('prompt_tokens'), 0) + Coalesce(Sum('completion_tokens'), 0)
+    ).values_list('agent_instance__organization', 'articles', 'tokens')
+    return {organization_id: (articles, tokens) for organization_id, articles, tokens in usage}
+
+
+def has_quota(organization):
+    return organization.daily_article_quota is not None or organization.daily_token_quota is not None
+
+
+def get_quota_error(organization, now=None, usage=None):
+    """
+    Returns why the organization can't generate more articles today, or None if it can.
+    usage is its (articles, tokens) today if already known. A job that starts under
+    quota runs to completion, so an organization can end the day over its quota by up
+    to one job's articles.
+    """
+    if not has_quota(organization):
+        return None
+    articles, tokens = usage if usage is not None else get_daily_usage(organization.id, now)
+    if organization.daily_article_quota is not None and articles >= organization.daily_article_quota:
+        return f"Daily article quota of {organization.daily_article_quota} reached"
+    if organization.daily_token_quota is not None and tokens >= organization.daily_token_quota:
+        return f"Daily token quota of {organization.daily_token_quota} reached"
+    return None
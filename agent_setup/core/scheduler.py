@@ -0,0 +1,60 @@
+from django.utils import timezone
+
+from .jobs import enqueue_generation_job
+from .models import AgentInstance, SCHEDULE_INTERVALS
+
+# Scheduled article generation. Each scheduled AgentInstance carries the time
+# its next run is due (next_run_at, indexed), so a scheduler tick only reads
+# the agents that are due, and claiming a run moves next_run_at forward a whole
+# period so each period runs at most once however often the tick fires.
+# Claimed runs are queued as GenerationJobs for the workers in core.jobs.
+
+
+def get_due_agents(now=None):
+    """
+    Scheduled agents whose next run is due, longest overdue first.
+    """
+    now = now or timezone.now()
+    return AgentInstance.objects.filter(next_run_at__lte=now).order_by('next_run_at')
+
+
+def next_run_after(scheduled_at, schedule, now):
+    """
+    The first run time after `now` on the schedule's cadence from scheduled_at.
+    Periods missed while nothing ran are skipped rather than caught up.
+    """
+    interval = SCHEDULE_INTERVALS[schedule]
+    missed = (now - scheduled_at) // interval
+    return scheduled_at + (missed + 1) * interval
+
+
+def claim_agent_run(agent, now=None):
+    """
+    Claim the agent's due run by moving next_run_at to the next period. The update
+    only applies if next_run_at is unchanged since the agent was read, so two
+    ticks (or processes) can't both claim the same period. Returns whether this
+    caller claimed it.
+    """
+    now = now or timezone.now()
+    if not agent.next_run_at or agent.schedule not in SCHEDULE_INTERVALS:
+        return False
+    next_run_at = next_run_after(agent.next_run_at, agent.schedule, now)
+    claimed = AgentInstance.objects.filter(id=agent.id, next_run_at=agent.next_run_at).update(next_run_at=next_run_at)
+    if claimed:
+        agent.next_run_at = next_run_at
+    return bool(claimed)
+
+
+def enqueue_due_agents(now=None):
+    """
+    Queue a generation job for every due agent this caller manages to claim.
+    Returns the number of agents queued.
+    """
+    now = now or timezone.now()
+    agents_queued = 0
+    for agent in get_due_agents(now):
+        if not claim_agent_run(agent, now):
+            continue
+        enqueue_generation_job(agent)
+        agents_queued += 1
+    return agents_queued
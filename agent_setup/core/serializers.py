@@ -1,6 +1,7 @@
 from rest_framework import serializers
-from .models import Organization, User, AgentInstance, DataSource, Article
-import pandas as pd
+from .models import Organization, User, AgentInstance, DataSource, Article, GenerationJob
+from .datasource_profile import profile_csv, infer_date_column, get_column_names, get_schema_profile, default_mapping_config
+from django.conf import settings
 import os
 
 # Temporarily commented out until Agent model is migrated
@@ -12,7 +13,8 @@ import os
 class OrganizationSerializer(serializers.ModelSerializer):
     class Meta:
         model = Organization
-        fields = ['id', 'name', 'is_demo', 'data_source_connected']
+        fields = ['id', 'name', 'is_demo', 'data_source_connected',
+                  'max_concurrent_generations', 'daily_article_quota', 'daily_token_quota']
 
 class UserSerializer(serializers.ModelSerializer):
     organization_name = serializers.CharField(write_only=True, required=False)
@@ -60,10 +62,12 @@ class AgentInstanceSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = AgentInstance
-        fields = ['id', 'agent_id', 'organization', 'agent_instance_name', 'configuration', 'datasource', 'mapping_config']
+        fields = ['id', 'agent_id', 'organization', 'agent_instance_name', 'configuration', 'datasource', 'mapping_config',
+                  'schedule', 'next_run_at']
         extra_kwargs = {
             'id': {'read_only': True}
         }
+        read_only_fields = ['schedule', 'next_run_at']
     
     # Temporarily comment out create method until Agent model is migrated
     # def create(self, validated_data):
@@ -86,9 +90,10 @@ class DataSourceSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = DataSource
-        fields = ['id', 'name', 'source_type', 'file', 'connection_params', 'table_name', 'date_column', 'description']
+        fields = ['id', 'name', 'source_type', 'file', 'connection_params', 'table_name', 'date_column', 'description', 'schema_profile']
         extra_kwargs = {
-            'id': {'read_only': True}
+            'id': {'read_only': True},
+            'schema_profile': {'read_only': True}
         }
 
     def validate(self, data):
@@ -101,6 +106,10 @@ class DataSourceSerializer(serializers.ModelSerializer):
             if not data['file'].name.endswith('.csv'):
                 raise serializers.ValidationError("A valid CSV file is required")
 
+        delimiter = (data.get('connection_params') or {}).get('delimiter', ',')
+        if not isinstance(delimiter, str) or not delimiter:
+            raise serializers.ValidationError("connection_params delimiter must be a non-empty string")
+
         # Default values
         data['source_type'] = data.get('source_type', 'csv')
         if 'file' in data and data['file']:
@@ -109,21 +118,22 @@ class DataSourceSerializer(serializers.ModelSerializer):
             data['description'] = data.get('description', f"Data source for {data['name']}")
             data['connection_params'] = data.get('connection_params', {"delimiter": ",", "encoding": "utf-8"})
 
-            # Read CSV to determine columns
+            # Profile the CSV once; linking and column validation read this instead of the file
             try:
-                df = pd.read_csv(
-                    data['file'],
-                    delimiter=data['connection_params'].get('delimiter', ','),
-                    encoding=data['connection_params'].get('encoding', 'utf-8')
-                )
-                if df.empty:
+                profile = profile_csv(data['file'], data['connection_params'])
+                if profile['row_count'] == 0:
                     raise serializers.ValidationError("CSV file is empty")
 
-                csv_columns = df.columns.tolist()
+                data['schema_profile'] = profile
                 # Dynamically set date_column
                 if not data.get('date_column'):
-                    date_cols = [col for col in csv_columns if 'date' in col.lower()]
-                    data['date_column'] = date_cols[0] if date_cols else csv_columns[0] if csv_columns else ''
+                    data['date_column'] = infer_date_column(profile)
+            except Exception as e:
+                raise serializers.ValidationError(f"Error reading CSV: {str(e)}")
+        elif self.instance is not None and self.instance.file and 'connection_params' in data:
+            # The stored profile was read with the old delimiter/encoding
+            try:
+                data['schema_profile'] = profile_csv(self.instance.file.path, data['connection_params'])
             except Exception as e:
                 raise serializers.ValidationError(f"Error reading CSV: {str(e)}")
 
@@ -144,15 +154,11 @@ class DataSourceLinkSerializer(serializers.Serializer):
             raise serializers.ValidationError("DataSource must be a CSV with a valid file")
 
         try:
-            df = pd.read_csv(
-                datasource.file.path,
-                delimiter=datasource.connection_params.get('delimiter', ','),
-                encoding=datasource.connection_params.get('encoding', 'utf-8')
-            )
-            if df.empty:
+            profile = get_schema_profile(datasource)
+            if profile['row_count'] == 0:
                 raise serializers.ValidationError("CSV file is empty")
 
-            csv_columns = df.columns.tolist()
+            csv_columns = get_column_names(profile)
             mapping_config = data.get('mapping_config')
 
             if mapping_config:
@@ -165,11 +171,7 @@ class DataSourceLinkSerializer(serializers.Serializer):
                     if col not in csv_columns:
                         raise serializers.ValidationError(f"Column '{col}' not found in CSV")
             else:
-                data['mapping_config'] = {
-                    'date_column': datasource.date_column,
-                    'metric_columns': [col for col in csv_columns if df[col].dtype in ['int64', 'float64']],
-                    'category_columns': [col for col in csv_columns if df[col].dtype == 'object' and col != datasource.date_column]
-                }
+                data['mapping_config'] = default_mapping_config(datasource)
         except Exception as e:
             raise serializers.ValidationError(f"Error reading CSV: {str(e)}")
         return data
@@ -177,7 +179,16 @@ class DataSourceLinkSerializer(serializers.Serializer):
 class ArticleSerializer(serializers.ModelSerializer):
     class Meta:
         model = Article
-        fields = ['id', 'title', 'content', 'agent_instance', 'created_at']
+        fields = ['id', 'title', 'content', 'excerpt', 'content_length', 'agent_instance', 'created_at',
+                  'prompt_tokens', 'completion_tokens']
+        read_only_fields = ['excerpt', 'content_length', 'prompt_tokens', 'completion_tokens']
+
+    def __init__(self, *args, fields=None, **kwargs):
+        # Serialize only these fields (a projection from core.narratives.get_article_fields)
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
 
 class ArticleCreateSerializer(serializers.Serializer):
     agent_instance_id = serializers.IntegerField()
@@ -185,6 +196,8 @@ class ArticleCreateSerializer(serializers.Serializer):
         child=serializers.DictField(),
         allow_empty=True
     )
+    # Queue generation for a worker instead of generating within the request
+    background = serializers.BooleanField(required=False, default=settings.ARTICLE_GENERATION_BACKGROUND)
 
     def validate(self, data):
         agent_instance_id = data.get('agent_instance_id')
@@ -197,4 +210,23 @@ class ArticleCreateSerializer(serializers.Serializer):
         for article in articles:
             if 'title' not in article or 'content' not in article:
                 raise serializers.ValidationError("Each article must have 'title' and 'content' fields")
-        return data
\ No newline at end of file
+        return data
+
+class GenerationJobSerializer(serializers.ModelSerializer):
+    queued_seconds = serializers.SerializerMethodField()
+    run_seconds = serializers.SerializerMethodField()
+
+    class Meta:
+        model = GenerationJob
+        fields = ['id', 'agent_instance', 'status', 'stage', 'articles_created', 'error',
+                  'attempts', 'created_at', 'started_at', 'finished_at', 'queued_seconds', 'run_seconds']
+
+    def get_queued_seconds(self, obj):
+        if not obj.started_at:
+            return None
+        return round((obj.started_at - obj.created_at).total_seconds(), 3)
+
+    def get_run_seconds(self, obj):
+        if not obj.started_at or not obj.finished_at:
+            return None
+        return round((obj.finished_at - obj.started_at).total_seconds(), 3)
@@ -0,0 +1,569 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+from datetime import datetime, time, timedelta
+from types import SimpleNamespace
+from unittest import mock
+
+import httpx
+import numpy as np
+import openai
+import pandas as pd
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from django.db.models import QuerySet
+from django.http import QueryDict
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import csv_stream, jobs
+from .agent_stats import record_failed_run, sync_agent_stats
+from .article_writer import ArticleWriter, write_articles
+from .csv_stream import CHECKPOINT_INTERVAL, convert_value, load_checkpoints, read_preview_rows, scan_csv
+from .datasource_cache import read_datasource
+from .datasource_profile import get_column_names, get_schema_profile
+from .jobs import LeaseHeartbeat, claim_next_job, enqueue_generation_job, get_claim_order, write_generated_jobs
+from .llm_limits import AdaptiveConcurrencyLimit, CircuitBreaker, LLMCallLimiter
+from .models import AgentInstance, AgentInstanceStats, Article, DataSource, GenerationJob, Organization
+from .narratives import get_agent_articles, get_daily_articles
+from .pagination import decode_cursor, encode_cursor, paginate
+from .serializers import DataSourceSerializer
+from .utils import create_marketing_article_content, generate_articles
+
+
+def csv_datasource(directory, text, connection_params=None):
+    """
+    Just enough of a CSV DataSource for the csv_stream readers.
+    """
+    connection_params = connection_params or {}
+    path = os.path.join(directory, 'data.csv')
+    with open(path, 'w', encoding=connection_params.get('encoding', 'utf-8')) as handle:
+        handle.write(text)
+    return SimpleNamespace(file=SimpleNamespace(path=path), connection_params=connection_params)
+
+
+class ConvertValueTests(SimpleTestCase):
+    def test_numbers(self):
+        self.assertEqual(convert_value('42'), 42)
+        self.assertEqual(convert_value('-1.5'), -1.5)
+        self.assertEqual(convert_value('1e3'), 1000.0)
+        self.assertIsNone(convert_value(''))
+        self.assertEqual(convert_value('North'), 'North')
+
+    def test_values_python_parses_but_are_kept_as_text(self):
+        for value in ['nan', 'NaN', 'inf', '-inf', 'Infinity', '1_000', '1_000.5', ' 42', '42 ', '\t3.5']:
+            with self.subTest(value=value):
+                self.assertEqual(convert_value(value), value)
+
+
+class PreviewTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        settings_override = override_settings(DATASOURCE_CACHE_DIR=os.path.join(self.directory, 'cache'))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        csv_stream._checkpoint_memo.clear()
+
+    def test_non_finite_values_serialize_as_json(self):
+        datasource = csv_datasource(self.directory, 'name,value\na,nan\nb,inf\nc,1_000\nd, 7\ne,2.5\n')
+        rows = read_preview_rows(datasource, limit=10)
+        self.assertEqual([row['value'] for row in rows], ['nan', 'inf', '1_000', ' 7', 2.5])
+        json.dumps(rows, allow_nan=False)
+
+    def test_non_finite_values_serialize_as_json_with_pandas_fallback(self):
+        datasource = csv_datasource(self.directory, 'name,value\na,inf\nb,nan\nc,2.5\n', {'encoding': 'utf-16'})
+        rows = read_preview_rows(datasource, limit=10)
+        self.assertEqual([row['value'] for row in rows], [None, None, 2.5])
+        json.dumps(rows, allow_nan=False)
+
+    def test_concurrent_previews_record_each_checkpoint_once(self):
+        rows = CHECKPOINT_INTERVAL * 5
+        datasource = csv_datasource(self.directory, 'id\n' + ''.join(f'{i}\n' for i in range(rows)))
+        barrier = threading.Barrier(8)
+        errors = []
+
+        def preview(offset):
+            try:
+                barrier.wait()
+                page = read_preview_rows(datasource, offset=offset, limit=3)
+                if [row['id'] for row in page] != [offset, offset + 1, offset + 2]:
+                    errors.append(offset)
+            except Exception as e:
+                errors.append(e)
+
+        offsets = [rows - 10, rows // 2, 5, rows - 10, CHECKPOINT_INTERVAL * 3 + 1, rows // 2, 5, rows - 4]
+        threads = [threading.Thread(target=preview, args=(offset,)) for offset in offsets]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+        checkpoints = load_checkpoints(datasource.file.path)
+        line_length = [len(f'{i}\n') for i in range(rows)]
+        expected = [len('id\n') + sum(line_length[:n * CHECKPOINT_INTERVAL]) for n in range(len(checkpoints))]
+        self.assertEqual(len(checkpoints), 5)
+        self.assertEqual(checkpoints, expected)
+        # Pages read from the recorded checkpoints land on the right rows
+        for offset in [0, CHECKPOINT_INTERVAL, rows - 1]:
+            self.assertEqual(read_preview_rows(datasource, offset=offset, limit=1), [{'id': offset}])
+
+
+class DatasourceCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        settings_override = override_settings(DATASOURCE_CACHE_DIR=os.path.join(self.directory, 'cache'))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_cached_frame_matches_csv_and_loads_without_pickle(self):
+        datasource = csv_datasource(self.directory, 'region,revenue,units\nNorth,1.5,2\n,2.5,3\nSouth,,4\nNorth,4.0,5\n')
+        datasource.id = 1
+        parsed = read_datasource(datasource)
+        cached = read_datasource(datasource)
+        # Copied because the memory-mapped columns are np.memmap rather than ndarray
+        pd.testing.assert_frame_equal(cached.copy(), parsed)
+        self.assertEqual(cached['region'].tolist()[2:], ['South', 'North'])
+        self.assertTrue(pd.isna(cached['region'][1]))
+
+        cache_dir = os.path.join(self.directory, 'cache')
+        for root, _, files in os.walk(cache_dir):
+            for name in files:
+                if name.endswith('.npy'):
+                    np.load(os.path.join(root, name), allow_pickle=False)
+
+
+class ScanTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def test_multi_character_delimiter(self):
+        datasource = csv_datasource(self.directory, 'a::b\n1::2\n3::4\n', {'delimiter': '::'})
+        scan = scan_csv(datasource.file.path, delimiter='::')
+        self.assertEqual((scan['row_count'], scan['column_count'], scan['invalid_row_count']), (2, 2, 0))
+        with override_settings(DATASOURCE_CACHE_DIR=os.path.join(self.directory, 'cache')):
+            self.assertEqual(read_preview_rows(datasource, offset=1), [{'a': 3, 'b': 4}])
+
+    def test_multi_character_delimiter_rows_with_missing_fields(self):
+        datasource = csv_datasource(self.directory, 'a||b||c\n1||2||3\n4||5\n6||7||8\n', {'delimiter': '||'})
+        scan = scan_csv(datasource.file.path, delimiter='||')
+        self.assertEqual((scan['row_count'], scan['column_count']), (3, 3))
+        self.assertEqual((scan['invalid_row_count'], scan['invalid_rows']), (1, [2]))
+
+    def test_multi_byte_encoding_rows_with_missing_fields(self):
+        datasource = csv_datasource(self.directory, 'a,b\n1,"x\ny"\n\n3\n4,5\n', {'encoding': 'utf-16'})
+        scan = scan_csv(datasource.file.path, encoding='utf-16')
+        self.assertEqual((scan['row_count'], scan['column_count']), (3, 2))
+        self.assertEqual((scan['invalid_row_count'], scan['invalid_rows']), (1, [2]))
+
+    def test_empty_delimiter(self):
+        datasource = csv_datasource(self.directory, 'a,b\n1,2\n')
+        with self.assertRaises(ValueError):
+            scan_csv(datasource.file.path, delimiter='')
+
+
+class SchemaProfileTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=self.directory, DATASOURCE_CACHE_DIR=os.path.join(self.directory, 'cache'))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        serializer = DataSourceSerializer(data={'file': ContentFile(b'date;revenue\n2024-01-01;10\n', name='sales.csv')})
+        serializer.is_valid(raise_exception=True)
+        self.datasource = serializer.save()
+
+    def test_changing_connection_params_reprofiles(self):
+        self.assertEqual(get_column_names(self.datasource.schema_profile), ['date;revenue'])
+        serializer = DataSourceSerializer(self.datasource, data={'connection_params': {'delimiter': ';'}}, partial=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        self.datasource.refresh_from_db()
+        self.assertEqual(get_column_names(self.datasource.schema_profile), ['date', 'revenue'])
+
+    def test_profile_of_other_connection_params_is_rebuilt_on_read(self):
+        DataSource.objects.filter(id=self.datasource.id).update(connection_params={'delimiter': ';'})
+        self.datasource.refresh_from_db()
+        self.assertEqual(get_column_names(get_schema_profile(self.datasource)), ['date', 'revenue'])
+
+
+class MarketingContentTests(SimpleTestCase):
+    def test_partial_aggregates(self):
+        agent_instance = SimpleNamespace(agent_instance_name='Marketing Agent')
+        content = create_marketing_article_content(agent_instance, {
+            'campaign_performance': {('revenue', 'sum'): {'electronics': 100.0}},
+            'market_penetration': {'revenue': {'north': 50.0}},
+        }, 1)
+        self.assertIn("Campaign Performance: Campaign Performance for Electronics: Revenue $100.00 ", content)
+        self.assertIn("Market Penetration for North: Revenue $50.00", content)
+
+    def test_empty_sections_are_left_out(self):
+        agent_instance = SimpleNamespace(agent_instance_name='Marketing Agent')
+        content = create_marketing_article_content(agent_instance, {
+            'campaign_performance': {},
+            'market_penetration': {'customers': {}},
+        }, 1)
+        self.assertNotIn("Campaign Performance", content)
+        self.assertNotIn("Market Penetration:", content)
+
+
+class GenerationJobLeaseTests(TestCase):
+    def setUp(self):
+        self.organization = Organization.objects.create(name='Leases')
+        self.agent_instance = self.create_agent_instance('Sales Agent')
+        enqueue_generation_job(self.agent_instance)
+
+    def create_agent_instance(self, name):
+        return AgentInstance.objects.create(
+            agent_id=1, organization=self.organization, agent_instance_name=name, configuration={}, mapping_config={}
+        )
+
+    def generated(self, job, worker_id):
+        writer = ArticleWriter()
+        writer.add(Article(agent_instance=self.agent_instance, title=f'By {worker_id}', content='Content'))
+        return [(job, ('succeeded', 1, ''))], writer
+
+    def test_enqueueing_twice_returns_the_active_job(self):
+        job = GenerationJob.objects.get()
+        self.assertEqual(enqueue_generation_job(self.agent_instance), job)
+        self.assertEqual(GenerationJob.objects.count(), 1)
+
+    def test_enqueueing_after_losing_the_race_returns_the_winning_job(self):
+        job = GenerationJob.objects.get()
+        real_first = QuerySet.first
+        lookups = []
+
+        def first(queryset):
+            # The first lookup runs before the other request's job was created
+            lookups.append(queryset)
+            return None if len(lookups) == 1 else real_first(queryset)
+
+        with mock.patch.object(QuerySet, 'first', first), transaction.atomic():
+            self.assertEqual(enqueue_generation_job(self.agent_instance), job)
+            self.assertEqual(GenerationJob.objects.count(), 1)
+
+    def test_finished_jobs_do_not_block_a_new_one(self):
+        job = GenerationJob.objects.get()
+        GenerationJob.objects.filter(id=job.id).update(status='succeeded')
+        self.assertNotEqual(enqueue_generation_job(self.agent_instance), job)
+        self.assertEqual(GenerationJob.objects.count(), 2)
+
+    def test_reclaimed_job_is_not_written_by_the_worker_that_lost_it(self):
+        first = claim_next_job('first')
+        # The first worker stalls past its lease and a second worker reclaims the job
+        GenerationJob.objects.filter(id=first.id).update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+        second = claim_next_job('second')
+        self.assertEqual((second.id, second.attempts), (first.id, 2))
+
+        generated, writer = self.generated(first, 'first')
+        write_generated_jobs(generated, writer, 'first', LeaseHeartbeat('first'), log=lambda message: None)
+        self.assertFalse(Article.objects.exists())
+        job = GenerationJob.objects.get(id=first.id)
+        self.assertEqual((job.status, job.lease_owner), ('running', 'second'))
+
+        generated, writer = self.generated(second, 'second')
+        write_generated_jobs(generated, writer, 'second', LeaseHeartbeat('second'), log=lambda message: None)
+        self.assertEqual(list(Article.objects.values_list('title', flat=True)), ['By second'])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.articles_created), ('succeeded', 1))
+
+
+    def test_workers_claim_different_jobs(self):
+        enqueue_generation_job(self.create_agent_instance('Marketing Agent'))
+        first = claim_next_job('first')
+        second = claim_next_job('second')
+        self.assertNotEqual(first.id, second.id)
+        self.assertEqual(
+            set(GenerationJob.objects.values_list('lease_owner', 'status', 'attempts')),
+            {('first', 'running', 1), ('second', 'running', 1)}
+        )
+        self.assertIsNone(claim_next_job('third'))
+
+    def test_claims_stop_at_the_organization_concurrency_limit(self):
+        Organization.objects.filter(id=self.organization.id).update(max_concurrent_generations=1)
+        enqueue_generation_job(self.create_agent_instance('Marketing Agent'))
+        first = claim_next_job('first')
+        self.assertIsNone(claim_next_job('second'))
+        self.assertEqual(GenerationJob.objects.filter(status='queued').count(), 1)
+
+        GenerationJob.objects.filter(id=first.id).update(status='succeeded')
+        self.assertNotEqual(claim_next_job('second').id, first.id)
+
+    def test_claim_order_checks_quotas_in_one_query(self):
+        def queue_for_organizations(count):
+            for index in range(count):
+                organization = Organization.objects.create(name=f'Quota {count}.{index}', daily_article_quota=2)
+                agent_instance = AgentInstance.objects.create(
+                    agent_id=1, organization=organization, agent_instance_name='Sales Agent', configuration={}, mapping_config={}
+                )
+                enqueue_generation_job(agent_instance)
+                Article.objects.create(agent_instance=agent_instance, title='Today', content='Content')
+            return organization
+
+        queue_for_organizations(1)
+        with CaptureQueriesContext(connection) as one:
+            get_claim_order()
+        over_quota = queue_for_organizations(3)
+        Article.objects.create(agent_instance=over_quota.agentinstance_set.get(), title='Today', content='Content')
+        with CaptureQueriesContext(connection) as four:
+            claim_order = get_claim_order()
+        self.assertEqual(len(four), len(one))
+        self.assertEqual(len(claim_order), 4)
+        self.assertNotIn(over_quota, claim_order)
+
+    def test_claim_skips_a_job_taken_since_it_was_read(self):
+        taken = GenerationJob.objects.get()
+        enqueue_generation_job(self.create_agent_instance('Marketing Agent'))
+        real_lease_values = jobs._lease_values
+        raced = []
+
+        def lease_values(worker_id, now):
+            # Another worker claims the oldest job between this worker reading and updating it
+            if not raced:
+                raced.append(worker_id)
+                GenerationJob.objects.filter(id=taken.id).update(**real_lease_values('other', now))
+            return real_lease_values(worker_id, now)
+
+        with mock.patch.object(jobs, '_lease_values', lease_values):
+            job = jobs._claim_with_conditional_update('first', GenerationJob.objects.filter(jobs._claimable(timezone.now())))
+        self.assertNotEqual(job.id, taken.id)
+        self.assertEqual(GenerationJob.objects.get(id=taken.id).lease_owner, 'other')
+        self.assertEqual(job.lease_owner, 'first')
+
+    def test_skip_locked_claims_the_oldest_claimable_job(self):
+        oldest = GenerationJob.objects.get()
+        enqueue_generation_job(self.create_agent_instance('Marketing Agent'))
+        claimable = GenerationJob.objects.filter(jobs._claimable(timezone.now()))
+        job = jobs._claim_with_skip_locked('first', claimable)
+        self.assertEqual((job.id, job.lease_owner, job.attempts), (oldest.id, 'first', 1))
+        self.assertNotEqual(jobs._claim_with_skip_locked('second', claimable).id, oldest.id)
+
+    def test_live_lease_is_not_reclaimed(self):
+        claim_next_job('first')
+        self.assertIsNone(claim_next_job('second'))
+
+    def test_job_fails_once_its_attempts_are_used_up(self):
+        GenerationJob.objects.update(
+            status='running', lease_owner='dead', attempts=settings.GENERATION_MAX_ATTEMPTS,
+            lease_expires_at=timezone.now() - timedelta(seconds=1)
+        )
+        self.assertIsNone(claim_next_job('first'))
+        job = GenerationJob.objects.get()
+        self.assertEqual((job.status, job.attempts), ('failed', settings.GENERATION_MAX_ATTEMPTS + 1))
+        self.assertIn("Gave up", job.error)
+
+    def test_heartbeat_extends_only_its_own_leases(self):
+        job = claim_next_job('first')
+        soon = timezone.now() + timedelta(seconds=5)
+        GenerationJob.objects.filter(id=job.id).update(lease_expires_at=soon)
+
+        LeaseHeartbeat('second').extend({job.id})
+        self.assertEqual(GenerationJob.objects.get(id=job.id).lease_expires_at, soon)
+
+        LeaseHeartbeat('first').extend({job.id})
+        job.refresh_from_db()
+        self.assertGreater(job.lease_expires_at, soon + timedelta(seconds=settings.GENERATION_LEASE_SECONDS - 10))
+
+def api_error(error_class, status_code):
+    response = httpx.Response(status_code, request=httpx.Request('POST', 'http://llm.test/chat/completions'))
+    return error_class(f"HTTP {status_code}", response=response, body=None)
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def test_opens_after_consecutive_failures_and_closes_after_a_probe(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, 'closed')
+        breaker.record_failure()
+        self.assertEqual(breaker.state, 'open')
+        self.assertFalse(breaker.allow_request())
+
+        # Once the reset timeout has passed, exactly one probe is let through
+        breaker.opened_at -= 31
+        self.assertTrue(breaker.allow_request())
+        self.assertEqual(breaker.state, 'half_open')
+        self.assertFalse(breaker.allow_request())
+        breaker.record_success()
+        self.assertEqual((breaker.state, breaker.failures), ('closed', 0))
+        self.assertTrue(breaker.allow_request())
+
+    def test_failed_probe_opens_it_again(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+        breaker.record_failure()
+        breaker.record_failure()
+        breaker.opened_at -= 31
+        self.assertTrue(breaker.allow_request())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, 'open')
+        self.assertFalse(breaker.allow_request())
+
+
+class LLMCallLimiterTests(SimpleTestCase):
+    def setUp(self):
+        self.limiter = LLMCallLimiter()
+        self.limiter.concurrency = AdaptiveConcurrencyLimit(initial=8, minimum=1, maximum=16, latency_target=0)
+
+    def fail_in_slot(self, error):
+        with self.assertRaises(type(error)):
+            with self.limiter.slot():
+                raise error
+
+    def test_rate_limit_halves_concurrency(self):
+        self.fail_in_slot(api_error(openai.RateLimitError, 429))
+        self.assertEqual((self.limiter.concurrency.limit, self.limiter.concurrency.in_flight), (4, 0))
+        self.assertEqual((self.limiter.breaker.state, self.limiter.throttled), ('closed', 1))
+
+    def test_rejected_requests_leave_concurrency_alone(self):
+        # Any latency is over the zero latency target, so passing one would halve the limit
+        self.fail_in_slot(api_error(openai.BadRequestError, 400))
+        self.fail_in_slot(api_error(openai.AuthenticationError, 401))
+        self.assertEqual((self.limiter.concurrency.limit, self.limiter.concurrency.in_flight), (8, 0))
+        self.assertEqual(self.limiter.breaker.state, 'closed')
+
+    def test_timeouts_count_as_slow_calls(self):
+        self.fail_in_slot(TimeoutError("LLM call timed out"))
+        self.assertEqual(self.limiter.concurrency.limit, 4)
+        self.assertEqual(self.limiter.breaker.failures, 1)
+
+
+class PaginationTests(TestCase):
+    def setUp(self):
+        organization = Organization.objects.create(name='Pages')
+        self.agent_instances = [
+            AgentInstance.objects.create(
+                agent_id=1, organization=organization, agent_instance_name=name, configuration={}, mapping_config={}
+            )
+            for name in ['Sales Agent', 'Marketing Agent']
+        ]
+        # Runs of articles share a timestamp, so pages end in the middle of a tie
+        self.day = timezone.localdate()
+        start = timezone.make_aware(datetime.combine(self.day, time(9)))
+        offsets = [0, 0, 0, 0, 1.5, 1.5, 2, 3, 3, 3, 4]
+        for index, offset in enumerate(offsets):
+            article = Article.objects.create(
+                agent_instance=self.agent_instances[index % 2], title=f'Article {index}', content='Content'
+            )
+            Article.objects.filter(id=article.id).update(created_at=start + timedelta(seconds=offset, microseconds=index % 3))
+        # And one on the day before
+        article = Article.objects.create(agent_instance=self.agent_instances[0], title='Yesterday', content='Content')
+        Article.objects.filter(id=article.id).update(created_at=start - timedelta(days=1))
+
+    def page_through(self, queryset, page_size):
+        ids = []
+        cursor = None
+        while True:
+            params = QueryDict(mutable=True)
+            params['page_size'] = str(page_size)
+            if cursor:
+                params['cursor'] = cursor
+            items, cursor = paginate(queryset, SimpleNamespace(query_params=params))
+            self.assertLessEqual(len(items), page_size)
+            ids.extend(item.id for item in items)
+            if cursor is None:
+                return ids
+
+    def assertPagesCoverQueryset(self, queryset):
+        expected = list(queryset.values_list('id', flat=True))
+        self.assertTrue(expected)
+        for page_size in [1, 2, 3, 5, len(expected), len(expected) + 1]:
+            with self.subTest(ordering=queryset.query.order_by, page_size=page_size):
+                self.assertEqual(self.page_through(queryset, page_size), expected)
+
+    def test_agent_articles(self):
+        for agent_instance in self.agent_instances:
+            self.assertPagesCoverQueryset(get_agent_articles(agent_instance.id))
+
+    def test_daily_articles(self):
+        self.assertEqual(get_daily_articles(self.day).count(), 11)
+        self.assertPagesCoverQueryset(get_daily_articles(self.day))
+
+    def test_mixed_orderings(self):
+        for ordering in [('created_at', 'id'), ('-created_at', '-id'), ('-created_at', 'id'), ('created_at', '-id')]:
+            self.assertPagesCoverQueryset(Article.objects.order_by(*ordering))
+
+    def test_datetime_round_trips_through_the_cursor(self):
+        ordering = ['-created_at', '-id']
+        article = Article.objects.order_by(*ordering).first()
+        cursor = encode_cursor([article.created_at, article.id])
+        self.assertEqual(decode_cursor(cursor, Article, ordering), [article.created_at, article.id])
+
+    def test_invalid_cursor(self):
+        ordering = ['created_at', 'id']
+        article = Article.objects.first()
+        for cursor in ['not base64!', encode_cursor([article.created_at]), encode_cursor(['yesterday', article.id]),
+                       encode_cursor([article.created_at, 'not a uuid'])]:
+            with self.subTest(cursor=cursor), self.assertRaises(ValueError):
+                decode_cursor(cursor, Article, ordering)
+        with self.assertRaises(ValueError):
+            paginate(get_daily_articles(self.day), SimpleNamespace(query_params=QueryDict('cursor=abc')))
+
+
+class AgentStatsTests(TestCase):
+    def setUp(self):
+        self.organization = Organization.objects.create(name='Stats')
+        self.agent_instance = self.create_agent_instance('Sales Agent')
+
+    def create_agent_instance(self, name):
+        return AgentInstance.objects.create(
+            agent_id=1, organization=self.organization, agent_instance_name=name, configuration={}, mapping_config={}
+        )
+
+    def article(self, agent_instance, prompt_tokens, completion_tokens):
+        return Article(
+            agent_instance=agent_instance, title='Report', content='Content',
+            prompt_tokens=prompt_tokens, completion_tokens=completion_tokens
+        )
+
+    def test_written_articles_are_added_to_the_totals(self):
+        write_articles([self.article(self.agent_instance, 10, 20), self.article(self.agent_instance, 5, None)])
+        write_articles([self.article(self.agent_instance, 1, 2)])
+        stats = AgentInstanceStats.objects.get(agent_instance=self.agent_instance)
+        self.assertEqual((stats.total_articles, stats.prompt_tokens, stats.completion_tokens), (3, 16, 22))
+        self.assertEqual(stats.last_run_at, Article.objects.latest('created_at').created_at)
+
+    def test_run_without_articles_counts_as_failed(self):
+        with mock.patch('core.utils.build_articles', return_value=[]):
+            self.assertEqual(generate_articles(self.agent_instance), [])
+            generate_articles(self.agent_instance)
+        stats = AgentInstanceStats.objects.get(agent_instance=self.agent_instance)
+        self.assertEqual((stats.failed_runs, stats.total_articles), (2, 0))
+        self.assertIsNotNone(stats.last_failed_at)
+
+    def test_sync_rebuilds_totals_and_keeps_run_history(self):
+        writer = ArticleWriter()
+        writer.add(self.article(self.agent_instance, 10, 20))
+        writer.add_run(self.agent_instance.id, 4.5)
+        writer.flush()
+        record_failed_run(self.agent_instance.id)
+        # Articles written around the stats, and totals that drifted
+        Article.objects.create(agent_instance=self.agent_instance, title='Direct', content='Content', prompt_tokens=3)
+        AgentInstanceStats.objects.filter(agent_instance=self.agent_instance).update(total_articles=100, prompt_tokens=0)
+        other = self.create_agent_instance('Marketing Agent')
+
+        self.assertEqual(sync_agent_stats(), 2)
+        stats = AgentInstanceStats.objects.get(agent_instance=self.agent_instance)
+        self.assertEqual((stats.total_articles, stats.prompt_tokens, stats.completion_tokens), (2, 13, 20))
+        self.assertEqual((stats.last_run_seconds, stats.failed_runs), (4.5, 1))
+        self.assertEqual(AgentInstanceStats.objects.get(agent_instance=other).total_articles, 0)
+
+    def test_organization_metrics_queries_do_not_grow_with_agents(self):
+        url = f'/organizations/{self.organization.id}/agent-metrics/'
+        write_articles([self.article(self.agent_instance, 1, 1)])
+        with CaptureQueriesContext(connection) as one_agent:
+            response = self.client.get(url)
+        self.assertEqual(len(response.json()['agents']), 1)
+
+        for name in ['Marketing Agent', 'Finance Agent']:
+            agent_instance = self.create_agent_instance(name)
+            write_articles([self.article(agent_instance, 1, 1)])
+        self.create_agent_instance('Agent Without Stats')
+        with self.assertNumQueries(len(one_agent)):
+            response = self.client.get(url)
+        self.assertEqual([agent['total_articles'] for agent in response.json()['agents']], [1, 1, 1, 0])
@@ -6,7 +6,8 @@ from .views import (
     AgentInstanceCreateView, AgentInstanceListView, AgentInstanceDetailView,
     DataSourceCreateView, DataSourceListView, DataSourceDetailView, DataSourceUploadView, DataSourceLinkView,
     DataSourceTestView, DataSourcePreviewView, DailyNarrativesView,
-    AgentNarrativesView, HealthCheckView, AgentMetricsView, ArticleCreateView
+    AgentNarrativesView, HealthCheckView, AgentMetricsView, ArticleCreateView,
+    ArticleStreamView, GenerationJobDetailView, GenerationQueueMetricsView, OrganizationAgentMetricsView
 )
 
 urlpatterns = [
@@ -43,8 +44,12 @@ urlpatterns = [
     path('narratives/daily/<str:date>/', DailyNarrativesView.as_view(), name='daily-narratives'),
     path('narratives/agent/<int:instance_id>/', AgentNarrativesView.as_view(), name='agent-narratives'),
     path('agent-instances/<int:instance_id>/articles/', ArticleCreateView.as_view(), name='article-create'),
+    path('agent-instances/<int:instance_id>/articles/stream/', ArticleStreamView.as_view(), name='article-stream'),
+    path('generation-jobs/<uuid:id>/', GenerationJobDetailView.as_view(), name='generation-job-detail'),
+    path('generation-jobs/metrics/', GenerationQueueMetricsView.as_view(), name='generation-queue-metrics'),
     
     # Utility endpoints
     path('health/', HealthCheckView.as_view(), name='health-check'),
     path('agent-instances/<int:id>/metrics/', AgentMetricsView.as_view(), name='agent-metrics'),
+    path('organizations/<int:id>/agent-metrics/', OrganizationAgentMetricsView.as_view(), name='organization-agent-metrics'),
 ]
\ No newline at end of file
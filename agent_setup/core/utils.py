@@ -1,25 +1,68 @@
 from langchain.prompts import PromptTemplate
 from langchain.chains import LLMChain
-from langchain_openai import ChatOpenAI
-import pandas as pd
 from .models import Article
+from .agent_stats import record_failed_run, record_run_seconds
+from .article_writer import ArticleWriter, write_articles
+from .datasource_cache import read_datasource
+from .llm_pool import connection_stats, get_llm
+from .llm_limits import llm_limiter, time_left
+from .prompt_budget import count_tokens, fit_insights, get_prompt_token_budget
+from .analysis import (
+    AnalysisAccumulator, analysis_result_cache, get_agent_type, get_analysis_cache_key,
+    should_analyze_in_chunks, perform_chunked_analysis, perform_incremental_analysis
+)
 import uuid
+import hashlib
+import json
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
 import os
 from dotenv import load_dotenv
+from django.conf import settings
 
 # Load environment variables
 load_dotenv()
 
 # Set OpenRouter API key and endpoint
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY", "your-openrouter-api-key")
-OPENROUTER_API_BASE = "https://openrouter.ai/api/v1"
+OPENROUTER_API_BASE = os.getenv("OPENROUTER_API_BASE", "https://openrouter.ai/api/v1")
+LLM_MODEL_NAME = "openai/gpt-3.5-turbo"
+LLM_TEMPERATURE = 0.7
 
-def generate_articles(agent_instance):
+_chains = {}
+_chains_lock = threading.Lock()
+
+def generate_articles(agent_instance, progress=None, writer=None):
+    """
+    Generate and save articles for the given AgentInstance. Returns the articles created.
+    With a writer, the articles are added to it unsaved for the caller to flush, e.g.
+    together with other agent instances' articles; otherwise they are written in one
+    transaction before returning.
+    """
+    started = time.perf_counter()
+    articles = build_articles(agent_instance, progress)
+    if not articles:
+        record_failed_run(agent_instance.id)
+        return []
+
+    own_writer = writer is None
+    if own_writer:
+        writer = ArticleWriter()
+    for article in articles:
+        writer.add(article)
+    writer.add_run(agent_instance.id, time.perf_counter() - started)
+    return writer.flush() if own_writer else articles
+
+def build_articles(agent_instance, progress=None):
     """
-    Generate articles for the given AgentInstance based on its linked data source using LangChain with OpenRouter for dynamic content creation.
+    Build articles for the given AgentInstance based on its linked data source using LangChain with OpenRouter for dynamic content creation.
     Uses dynamic columns from mapping_config.
-    Returns the number of articles created.
+    progress, if given, is called with the stage reached: analysis, generation or saving.
+    Returns the articles, unsaved.
     """
     print(f"=== Starting article generation for agent {agent_instance.id} ===")
     
@@ -32,237 +75,542 @@ def generate_articles(agent_instance):
     print(f"Mapping config: {mapping_config}")
     print(f"Has datasource: {bool(datasource)}")
 
-    if not datasource or datasource.source_type != 'csv' or not datasource.file:
-        print(f"No valid CSV data source for agent {agent_instance.id}")
-        return 0
-
-    if not mapping_config or not mapping_config.get('metric_columns'):
-        print(f"No valid mapping_config for agent {agent_instance.id}")
-        return 0
+    error = get_generation_error(agent_instance)
+    if error:
+        print(f"{error} for agent {agent_instance.id}")
+        return []
 
+    progress = progress or (lambda stage: None)
     try:
-        print(f"Reading CSV file: {datasource.file.path}")
-        
-        # Read CSV
-        df = pd.read_csv(
-            datasource.file.path,
-            delimiter=datasource.connection_params.get('delimiter', ','),
-            encoding=datasource.connection_params.get('encoding', 'utf-8')
-        )
-        
-        print(f"CSV loaded successfully. Rows: {len(df)}, Columns: {list(df.columns)}")
-        
-        if df.empty:
+        progress('analysis')
+        analysis_results, row_count = get_analysis_results(datasource, mapping_config, agent_instance.agent_instance_name)
+        if row_count == 0:
             print(f"CSV file is empty for agent {agent_instance.id}")
-            return 0
-
-        # Perform comprehensive data analysis based on agent type
-        analysis_results = perform_comprehensive_analysis(df, mapping_config, agent_instance.agent_instance_name)
+            return []
         print(f"Comprehensive analysis completed: {len(analysis_results)} insights found")
+        progress('generation')
 
         # Check if we have the OpenRouter API key
         if OPENROUTER_API_KEY == "your-openrouter-api-key":
             print("WARNING: OpenRouter API key not set. Using intelligent default content instead.")
-            articles_created = create_intelligent_default_articles(agent_instance, analysis_results, article_count)
-            print(f"=== Article generation completed with intelligent default content: {articles_created} articles ===")
-            return articles_created
+            articles = create_intelligent_default_articles(agent_instance, analysis_results, article_count)
+            print(f"=== Article generation completed with intelligent default content: {len(articles)} articles ===")
+            return articles
+
+        if llm_limiter.breaker.is_open():
+            print("WARNING: OpenRouter circuit breaker is open. Using intelligent default content instead.")
+            articles = create_intelligent_default_articles(agent_instance, analysis_results, article_count)
+            print(f"=== Article generation completed with intelligent default content: {len(articles)} articles ===")
+            return articles
 
         print("Setting up LangChain with OpenRouter for intelligent article generation...")
         
         try:
-            # LangChain setup for intelligent article generation
-            llm = ChatOpenAI(
-                model_name="openai/gpt-3.5-turbo",
-                openai_api_key=OPENROUTER_API_KEY,
-                openai_api_base=OPENROUTER_API_BASE,
-                temperature=0.7
+            # 'batch' asks for every article in a single completion instead of one call each
+            batch_mode = config.get('generation_mode') == 'batch' and article_count > 1
+
+            # Pooled client and prebuilt agent-specific chain, shared across runs
+            chain = get_article_chain(agent_instance.agent_instance_name, batch=batch_mode)
+
+            # The analysis context is the same for every article in the run
+            analysis_context = create_analysis_context(
+                analysis_results,
+                agent_instance.agent_instance_name,
+                get_analysis_token_budget(chain, agent_instance.agent_instance_name),
+                chain.llm.model_name
             )
-            
-            # Create agent-specific prompts
-            prompt_template = create_agent_specific_prompt(agent_instance.agent_instance_name)
-            chain = LLMChain(llm=llm, prompt=prompt_template)
 
-            print("Generating intelligent articles with LangChain...")
-            
-            # Generate intelligent articles
-            articles_created = 0
-            for i in range(article_count):
-                title = f"{agent_instance.agent_instance_name} Analysis Report {i+1} - {datetime.now().strftime('%Y-%m-%d')}"
-                
-                # Create rich analysis context for the AI
-                analysis_context = create_analysis_context(analysis_results, agent_instance.agent_instance_name)
-                
-                print(f"Generating intelligent article {i+1} for {agent_instance.agent_instance_name}...")
-                
-                # Run LangChain chain for intelligent content
-                langchain_response = chain.run(
-                    agent_name=agent_instance.agent_instance_name,
-                    analysis=analysis_context,
-                    report_number=i+1
-                )
-                content = langchain_response.strip()
-                
-                print(f"Intelligent content generated for article {i+1}")
-
-                Article.objects.create(
-                    id=uuid.uuid4(),
-                    title=title,
-                    content=content,
-                    agent_instance=agent_instance
-                )
-                articles_created += 1
+            contents = None
+            batch_prompt_tokens = None
+            if batch_mode:
+                print("Generating intelligent articles with LangChain in a single completion...")
+                contents, batch_prompt_tokens = generate_batch_contents(chain, agent_instance, analysis_context, article_count)
+                if contents is None:
+                    print("Falling back to one completion per article...")
+                    chain = get_article_chain(agent_instance.agent_instance_name)
+
+            if contents is None:
+                print("Generating intelligent articles with LangChain...")
+                contents = generate_article_contents(chain, agent_instance, analysis_context, article_count)
+            if not any(contents):
+                raise RuntimeError("All article completions failed")
+
+            progress('saving')
+            articles = []
+            model_name = chain.llm.model_name
+            for i, content in enumerate(contents):
+                if content is None:
+                    # Keep the run's other articles; fill this one from the data instead
+                    content = create_intelligent_default_content(agent_instance, analysis_results, i+1)
+                    print(f"Using intelligent default content for article {i+1}")
+                    articles.append(build_generated_article(agent_instance, i+1, content))
+                else:
+                    if batch_prompt_tokens is not None:
+                        # The articles shared one prompt; split its tokens between them
+                        prompt_tokens = round(batch_prompt_tokens / article_count)
+                    else:
+                        prompt = chain.prompt.format(agent_name=agent_instance.agent_instance_name, analysis=analysis_context, report_number=i+1)
+                        prompt_tokens = count_tokens(prompt, model_name)
+                    completion_tokens = count_tokens(content, model_name)
+                    articles.append(build_generated_article(agent_instance, i+1, content, prompt_tokens, completion_tokens))
+                    print(f"Article {i+1} tokens: {prompt_tokens} in, {completion_tokens} out")
                 print(f"Created intelligent article {i+1} successfully")
 
-            print(f"=== Intelligent article generation completed with LangChain: {articles_created} articles ===")
-            return articles_created
+            print(f"=== Intelligent article generation completed with LangChain: {len(articles)} articles ===")
+            print(f"LLM connection reuse: {connection_stats()}")
+            return articles
             
         except Exception as api_error:
             print(f"OpenRouter API failed: {str(api_error)}")
             print("Falling back to intelligent default content generation...")
             
-            articles_created = create_intelligent_default_articles(agent_instance, analysis_results, article_count)
-            print(f"=== Article generation completed with intelligent default content: {articles_created} articles ===")
-            return articles_created
+            articles = create_intelligent_default_articles(agent_instance, analysis_results, article_count)
+            print(f"=== Article generation completed with intelligent default content: {len(articles)} articles ===")
+            return articles
 
     except Exception as e:
         print(f"ERROR generating articles for agent {agent_instance.id}: {str(e)}")
         import traceback
         traceback.print_exc()
-        return 0
+        return []
+
+def get_generation_error(agent_instance):
+    """
+    Why articles can't be generated for the agent instance, or None if they can.
+    """
+    datasource = agent_instance.datasource
+    if not datasource or datasource.source_type != 'csv' or not datasource.file:
+        return "No valid CSV data source"
+    mapping_config = agent_instance.mapping_config
+    if not mapping_config or not mapping_config.get('metric_columns'):
+        return "No valid mapping_config"
+    return None
+
+def stream_articles(agent_instance):
+    """
+    Generate articles like generate_articles, yielding (event, data) pairs as work
+    progresses instead of returning at the end:
+
+    - ('status', {'stage': ...}) before analysis and before generation starts
+    - ('token', {'report_number', 'text'}) for each LLM token as it arrives
+    - ('article', Article) as soon as each article is saved
+    - ('keep-alive', None) while waiting on the LLM, so idle connections stay open
+    - ('done', {'articles_created'}) or ('error', {'error'}) at the end
+
+    Completions run concurrently like generate_article_contents, so tokens of
+    different reports may interleave; articles are saved in completion order.
+    """
+    error = get_generation_error(agent_instance)
+    if error:
+        record_failed_run(agent_instance.id)
+        yield 'error', {'error': error}
+        return
+
+    started = time.perf_counter()
+    agent_name = agent_instance.agent_instance_name
+    article_count = agent_instance.configuration.get('article_count', 5)
+
+    yield 'status', {'stage': 'analysis'}
+    analysis_results, row_count = get_analysis_results(agent_instance.datasource, agent_instance.mapping_config, agent_name)
+    if row_count == 0:
+        record_failed_run(agent_instance.id)
+        yield 'error', {'error': "CSV file is empty"}
+        return
+
+    yield 'status', {'stage': 'generation', 'article_count': article_count}
+    pending = {}
+    contents = {}
+    prompt_tokens = {}
+    if OPENROUTER_API_KEY == "your-openrouter-api-key":
+        print("WARNING: OpenRouter API key not set. Using intelligent default content instead.")
+    elif llm_limiter.breaker.is_open():
+        print("WARNING: OpenRouter circuit breaker is open. Using intelligent default content instead.")
+    else:
+        chain = get_article_chain(agent_name)
+        model_name = chain.llm.model_name
+        analysis_context = create_analysis_context(analysis_results, agent_name, get_analysis_token_budget(chain, agent_name), model_name)
+        for i in range(article_count):
+            prompt = chain.prompt.format(agent_name=agent_name, analysis=analysis_context, report_number=i+1)
+            prompt_tokens[i] = count_tokens(prompt, model_name)
+            cache_key = completion_cache_key(model_name, chain.llm.temperature, prompt, i+1)
+            cached = completion_cache.get(cache_key)
+            if cached is not None:
+                contents[i] = cached
+            else:
+                pending[i] = (prompt, cache_key)
+
+    articles_created = 0
+    # Cached completions and default content are available right away
+    for i in range(article_count):
+        if i in contents:
+            yield 'article', save_generated_article(agent_instance, i+1, contents[i], prompt_tokens[i], count_tokens(contents[i], model_name))
+            articles_created += 1
+        elif i not in pending:
+            content = create_intelligent_default_content(agent_instance, analysis_results, i+1)
+            yield 'article', save_generated_article(agent_instance, i+1, content)
+            articles_created += 1
+
+    if pending:
+        events = queue.Queue()
+        max_workers = max(1, min(settings.LLM_MAX_CONCURRENCY, len(pending)))
+        # When each report's call started, reported by the worker running it
+        deadlines = {}
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        for i, (prompt, _) in pending.items():
+            executor.submit(_stream_completion, chain.llm, prompt, i, events)
+        last_sent = time.monotonic()
+        try:
+            while pending:
+                # Wake up for the next keep-alive or the first call to run out of time
+                wake_at = last_sent + settings.LLM_STREAM_KEEPALIVE_INTERVAL
+                wake_at = min([wake_at] + [deadlines[i] for i in pending if i in deadlines])
+                try:
+                    kind, i, value = events.get(timeout=max(0, wake_at - time.monotonic()))
+                except queue.Empty:
+                    kind = None
+                if kind is None and time.monotonic() - last_sent >= settings.LLM_STREAM_KEEPALIVE_INTERVAL:
+                    yield 'keep-alive', None
+                    last_sent = time.monotonic()
+                elif kind == 'started':
+                    deadlines[i] = value
+                elif kind == 'token' and i in pending:
+                    yield 'token', {'report_number': i+1, 'text': value}
+                    last_sent = time.monotonic()
+                elif kind in ('completed', 'failed') and i in pending:
+                    _, cache_key = pending.pop(i)
+                    if kind == 'completed':
+                        content = value.strip()
+                        completion_cache.set(cache_key, content)
+                        article = save_generated_article(agent_instance, i+1, content, prompt_tokens[i], count_tokens(content, model_name))
+                    else:
+                        print(f"Generating article {i+1} failed: {value}")
+                        content = create_intelligent_default_content(agent_instance, analysis_results, i+1)
+                        article = save_generated_article(agent_instance, i+1, content)
+                    yield 'article', article
+                    articles_created += 1
+                    last_sent = time.monotonic()
+
+                # Reports whose call ran past its own timeout get default content
+                now = time.monotonic()
+                for i in sorted(i for i in pending if i in deadlines and deadlines[i] <= now):
+                    pending.pop(i)
+                    print(f"Generating article {i+1} timed out")
+                    content = create_intelligent_default_content(agent_instance, analysis_results, i+1)
+                    yield 'article', save_generated_article(agent_instance, i+1, content)
+                    articles_created += 1
+                    last_sent = time.monotonic()
+        finally:
+            # Also runs when the client disconnects and the generator is closed
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    if articles_created:
+        record_run_seconds(agent_instance.id, time.perf_counter() - started)
+    yield 'done', {'articles_created': articles_created}
+
+def _stream_completion(llm, prompt, index, events):
+    # The call's timeout runs from when a worker starts it, not from when it was queued
+    deadline = time.monotonic() + settings.LLM_CALL_TIMEOUT
+    events.put(('started', index, deadline))
+    parts = []
+    try:
+        # A call is only retried while none of its tokens have been sent on
+        for attempt in llm_limiter.retrying(can_retry=lambda: not parts, deadline=deadline):
+            with attempt, llm_limiter.slot(deadline):
+                for chunk in llm.stream(prompt, timeout=time_left(deadline)):
+                    # A slow trickle of tokens never trips the HTTP read timeout;
+                    # leaving the loop closes the response
+                    time_left(deadline)
+                    if chunk.content:
+                        parts.append(chunk.content)
+                        events.put(('token', index, chunk.content))
+        events.put(('completed', index, ''.join(parts)))
+    except Exception as e:
+        events.put(('failed', index, str(e) or type(e).__name__))
+
+def build_generated_article(agent_instance, report_num, content, prompt_tokens=None, completion_tokens=None):
+    """
+    One generated article, unsaved. Token counts are only set for LLM-written content.
+    """
+    return Article(
+        id=uuid.uuid4(),
+        title=f"{agent_instance.agent_instance_name} Analysis Report {report_num} - {datetime.now().strftime('%Y-%m-%d')}",
+        content=content,
+        agent_instance=agent_instance,
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens
+    )
+
+def save_generated_article(agent_instance, report_num, content, prompt_tokens=None, completion_tokens=None):
+    """
+    Save one generated article straight away, for streaming where each article
+    is sent as soon as it is saved.
+    """
+    return write_articles([build_generated_article(agent_instance, report_num, content, prompt_tokens, completion_tokens)])[0]
+
+def get_article_chain(agent_name, batch=False):
+    """
+    Return the prebuilt LLMChain for the agent's type, bound to the pooled LLM client.
+    With batch=True the chain asks for all of a run's articles in one completion.
+    """
+    llm = get_llm(LLM_MODEL_NAME, OPENROUTER_API_BASE, OPENROUTER_API_KEY, LLM_TEMPERATURE)
+    # Prompts only differ by agent type, so one chain per type and client is enough
+    key = (id(llm), get_agent_type(agent_name), batch)
+    with _chains_lock:
+        chain = _chains.get(key)
+        if chain is None:
+            prompt = create_agent_specific_prompt(agent_name)
+            if batch:
+                prompt = create_batch_prompt(prompt)
+            chain = LLMChain(llm=llm, prompt=prompt)
+            _chains[key] = chain
+        return chain
+
+def generate_batch_contents(chain, agent_instance, analysis_context, article_count):
+    """
+    Ask for all articles in a single JSON completion.
+    Returns (contents, prompt_tokens), or (None, None) if the call fails or the
+    response is not a JSON array of article_count non-empty strings.
+    """
+    prompt = chain.prompt.format(
+        agent_name=agent_instance.agent_instance_name,
+        analysis=analysis_context,
+        article_count=article_count
+    )
+    cache_key = completion_cache_key(chain.llm.model_name, chain.llm.temperature, prompt, None)
+    response = completion_cache.get(cache_key)
+    try:
+        if response is None:
+            deadline = time.monotonic() + settings.LLM_CALL_TIMEOUT
+            response = llm_limiter.call(_complete, chain.llm, prompt, deadline, deadline=deadline)
+        contents = parse_batch_completion(response, article_count)
+    except Exception as e:
+        print(f"Single-completion generation failed: {str(e) or type(e).__name__}")
+        return None, None
+
+    completion_cache.set(cache_key, response)
+    print(f"Intelligent content generated for {article_count} articles in one completion")
+    return contents, count_tokens(prompt, chain.llm.model_name)
+
+def parse_batch_completion(response, article_count):
+    """
+    Parse a batch completion into a list of article contents, raising ValueError
+    unless it holds exactly article_count non-empty articles.
+    """
+    # Models sometimes wrap the JSON in a Markdown code block or add a preamble
+    start, end = response.find('['), response.rfind(']')
+    if start == -1 or end < start:
+        raise ValueError("No JSON array in response")
+    articles = json.loads(response[start:end + 1])
+
+    if not isinstance(articles, list) or len(articles) != article_count:
+        raise ValueError(f"Expected {article_count} articles, got {len(articles) if isinstance(articles, list) else 'no list'}")
+    contents = []
+    for article in articles:
+        if isinstance(article, dict):
+            article = article.get('content')
+        if not isinstance(article, str) or not article.strip():
+            raise ValueError("Article without content in response")
+        contents.append(article.strip())
+    return contents
+
+def generate_article_contents(chain, agent_instance, analysis_context, article_count):
+    """
+    Run the article completions concurrently, at most LLM_MAX_CONCURRENCY at a time.
+    Returns the contents in report order, with None for completions that failed or
+    did not finish within LLM_CALL_TIMEOUT of starting.
+    """
+    contents = [None] * article_count
+    prompts = {}
+    cache_keys = {}
+    for i in range(article_count):
+        # Identical prompts over unchanged data are answered from the completion cache
+        prompt = chain.prompt.format(
+            agent_name=agent_instance.agent_instance_name,
+            analysis=analysis_context,
+            report_number=i+1
+        )
+        prompts[i] = prompt
+        cache_keys[i] = completion_cache_key(chain.llm.model_name, chain.llm.temperature, prompt, i+1)
+        cached = completion_cache.get(cache_keys[i])
+        if cached is not None:
+            contents[i] = cached
+            print(f"Intelligent content for article {i+1} served from completion cache")
+
+    pending = [i for i in range(article_count) if contents[i] is None]
+    if not pending:
+        return contents
+
+    max_workers = max(1, min(settings.LLM_MAX_CONCURRENCY, len(pending)))
+    # Each call's timeout runs from when a worker starts it, so calls queued behind
+    # a slow one still get their full LLM_CALL_TIMEOUT
+    deadlines = {}
+
+    def complete(i):
+        deadlines[i] = time.monotonic() + settings.LLM_CALL_TIMEOUT
+        return llm_limiter.call(_complete, chain.llm, prompts[i], deadlines[i], deadline=deadlines[i])
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    waiting = {executor.submit(complete, i): i for i in pending}
+    try:
+        while waiting:
+            started_deadlines = [deadlines[i] for i in waiting.values() if i in deadlines]
+            timeout = max(0, min(started_deadlines) - time.monotonic()) if started_deadlines else settings.LLM_CALL_TIMEOUT
+            done, _ = wait(waiting, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                i = waiting.pop(future)
+                try:
+                    contents[i] = future.result().strip()
+                    completion_cache.set(cache_keys[i], contents[i])
+                    print(f"Intelligent content generated for article {i+1}")
+                except Exception as e:
+                    print(f"Generating article {i+1} failed: {str(e) or type(e).__name__}")
+            now = time.monotonic()
+            for future, i in list(waiting.items()):
+                if i in deadlines and deadlines[i] <= now:
+                    del waiting[future]
+                    print(f"Generating article {i+1} timed out")
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    return contents
+
+def _complete(llm, prompt, deadline):
+    """
+    One completion, its HTTP request bounded by the time left until the deadline.
+    """
+    return llm.invoke(prompt, timeout=time_left(deadline)).content
+
+def completion_cache_key(model_name, temperature, prompt, report_number):
+    identity = json.dumps([model_name, temperature, prompt, report_number])
+    return hashlib.sha256(identity.encode()).hexdigest()
+
+class CompletionCache:
+    """
+    On-disk SQLite cache of LLM completions with a time-to-live, an entry cap with
+    least-recently-used eviction, and hit/miss counters for this process.
+    """
+
+    def __init__(self, path, ttl_seconds, max_entries):
+        self.path = str(path)
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        # sqlite3 connections can't be shared between the generation threads
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS completions "
+                "(key TEXT PRIMARY KEY, response TEXT NOT NULL, created_at REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS completions_last_used ON completions (last_used)")
+            self._local.connection = connection
+        return connection
+
+    def get(self, key):
+        if not settings.LLM_CACHE_ENABLED:
+            return None
+        now = time.time()
+        try:
+            with self._connection() as connection:
+                row = connection.execute("SELECT response, created_at FROM completions WHERE key = ?", (key,)).fetchone()
+                if row and now - row[1] <= self.ttl_seconds:
+                    connection.execute("UPDATE completions SET last_used = ? WHERE key = ?", (now, key))
+                    response = row[0]
+                else:
+                    if row:
+                        connection.execute("DELETE FROM completions WHERE key = ?", (key,))
+                    response = None
+        except sqlite3.Error as e:
+            print(f"Completion cache read failed: {str(e)}")
+            response = None
+        with self._lock:
+            if response is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return response
+
+    def set(self, key, response):
+        if not settings.LLM_CACHE_ENABLED:
+            return
+        now = time.time()
+        try:
+            with self._connection() as connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO completions (key, response, created_at, last_used) VALUES (?, ?, ?, ?)",
+                    (key, response, now, now)
+                )
+                connection.execute("DELETE FROM completions WHERE created_at < ?", (now - self.ttl_seconds,))
+                connection.execute(
+                    "DELETE FROM completions WHERE key IN "
+                    "(SELECT key FROM completions ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)
+                )
+        except sqlite3.Error as e:
+            print(f"Completion cache write failed: {str(e)}")
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+completion_cache = CompletionCache(
+    path=settings.LLM_CACHE_PATH,
+    ttl_seconds=settings.LLM_CACHE_TTL,
+    max_entries=settings.LLM_CACHE_MAX_ENTRIES
+)
+
+def get_analysis_results(datasource, mapping_config, agent_name):
+    """
+    Analyze a data source for an agent, reusing results across agent instances that
+    share the same data, mapping_config and agent type (e.g. within one cron run).
+    Returns (analysis_results, row_count).
+    """
+    cache_key = get_analysis_cache_key(datasource, mapping_config, agent_name)
+    cached = analysis_result_cache.get(cache_key)
+    if cached is not None:
+        print(f"Using cached analysis results for {agent_name}")
+        return cached
+
+    if settings.ANALYSIS_INCREMENTAL:
+        # Resume persisted aggregates and only read rows appended since the last run
+        analysis_results, row_count = perform_incremental_analysis(datasource, mapping_config, agent_name)
+    elif should_analyze_in_chunks(datasource):
+        # Too large to hold in memory: stream the file through mergeable aggregates
+        print(f"Analyzing CSV file in chunks: {datasource.file.path}")
+        analysis_results, row_count = perform_chunked_analysis(datasource, mapping_config, agent_name)
+    else:
+        print(f"Reading CSV file: {datasource.file.path}")
+        
+        # Read CSV through the parsed cache
+        df = read_datasource(datasource)
+        row_count = len(df)
+        print(f"CSV loaded successfully. Rows: {row_count}, Columns: {list(df.columns)}")
+        
+        # Perform comprehensive data analysis based on agent type
+        analysis_results = perform_comprehensive_analysis(df, mapping_config, agent_name) if row_count else {}
+
+    analysis_result_cache.set(cache_key, (analysis_results, row_count))
+    return analysis_results, row_count
 
 def perform_comprehensive_analysis(df, mapping_config, agent_name):
     """
     Perform comprehensive data analysis based on agent type and data source.
     Returns insights, trends, and patterns relevant to the agent's expertise.
+    The DataFrame is sorted once, metric statistics come from a single vectorized
+    pass and all group aggregates from one multi-key groupby (see AnalysisAccumulator).
     """
-    analysis = {}
-    
-    # Get key columns
-    metric_columns = mapping_config.get('metric_columns', [])
-    date_column = mapping_config.get('date_column', df.columns[0])
-    category_columns = mapping_config.get('category_columns', [])
-    
     print(f"Performing comprehensive analysis for {agent_name}")
-    print(f"Metric columns: {metric_columns}")
-    print(f"Category columns: {category_columns}")
-    
-    # Basic statistical analysis
-    for metric in metric_columns:
-        if metric in df.columns:
-            mean_val = df[metric].mean()
-            max_val = df[metric].max()
-            min_val = df[metric].min()
-            std_val = df[metric].std()
-            
-            # Trend analysis
-        recent_data = df.sort_values(by=date_column).tail(5)
-        if len(recent_data) >= 2:
-            recent_trend = recent_data[metric].iloc[-1] - recent_data[metric].iloc[0]
-            trend_direction = 'increasing' if recent_trend > 0 else 'decreasing'
-            trend_strength = abs(recent_trend) / mean_val if mean_val > 0 else 0
-        else:
-            trend_direction = 'stable'
-            trend_strength = 0
-            
-            # Growth rate calculation
-            if len(df) >= 2:
-                first_value = df.sort_values(by=date_column)[metric].iloc[0]
-                last_value = df.sort_values(by=date_column)[metric].iloc[-1]
-                growth_rate = ((last_value - first_value) / first_value * 100) if first_value > 0 else 0
-            else:
-                growth_rate = 0
-            
-                analysis[metric] = {
-                    'mean': mean_val,
-                    'max': max_val,
-                    'min': min_val,
-                'std': std_val,
-                'trend_direction': trend_direction,
-                'trend_strength': trend_strength,
-                'growth_rate': growth_rate,
-                'recent_values': recent_data[metric].tolist() if len(recent_data) > 0 else []
-            }
-    
-    # Category analysis for sales insights
-    if agent_name.lower() in ['sales', 'sales agent', 'sales team']:
-        for category in category_columns:
-            if category in df.columns:
-                category_counts = df[category].value_counts()
-                category_performance = {}
-                
-                for cat_name in category_counts.index[:5]:  # Top 5 categories
-                    cat_data = df[df[category] == cat_name]
-                    if 'revenue' in df.columns:
-                        cat_revenue = cat_data['revenue'].sum()
-                        category_performance[cat_name] = {
-                            'count': len(cat_data),
-                            'total_revenue': cat_revenue,
-                            'avg_revenue': cat_revenue / len(cat_data) if len(cat_data) > 0 else 0
-                        }
-                
-                analysis[f'{category}_insights'] = category_performance
-    
-    # Financial analysis for finance agents
-    if agent_name.lower() in ['finance', 'finance agent', 'financial']:
-        if 'revenue' in df.columns and 'orders' in df.columns:
-            # Profitability analysis
-            df['profit_margin'] = (df['revenue'] / df['orders']).fillna(0)
-            analysis['profitability'] = {
-                'avg_profit_margin': df['profit_margin'].mean(),
-                'profit_trend': 'increasing' if df['profit_margin'].iloc[-1] > df['profit_margin'].iloc[0] else 'decreasing'
-            }
-            
-            # Cash flow analysis
-            if len(df) >= 2:
-                revenue_trend = df.sort_values(by=date_column)['revenue'].diff().mean()
-                analysis['cash_flow'] = {
-                    'avg_daily_revenue_change': revenue_trend,
-                    'cash_flow_stability': 'stable' if abs(revenue_trend) < df['revenue'].mean() * 0.1 else 'volatile'
-                }
-    
-    # Marketing analysis for marketing agents
-    if agent_name.lower() in ['marketing', 'marketing agent', 'marketing team', 'digital marketing']:
-        # Customer acquisition analysis
-        if 'customers' in df.columns and 'revenue' in df.columns:
-            df['customer_acquisition_cost'] = (df['revenue'] / df['customers']).fillna(0)
-            analysis['marketing_metrics'] = {
-                'avg_customer_acquisition_cost': df['customer_acquisition_cost'].mean(),
-                'customer_lifetime_value': df['revenue'].sum() / df['customers'].sum() if df['customers'].sum() > 0 else 0,
-                'conversion_rate': (df['orders'].sum() / df['customers'].sum() * 100) if 'orders' in df.columns and df['customers'].sum() > 0 else 0
-            }
-        
-        # Campaign performance analysis
-        if 'product_category' in df.columns:
-            category_performance = df.groupby('product_category').agg({
-                'revenue': ['sum', 'mean', 'count'],
-                'customers': 'sum' if 'customers' in df.columns else 'count'
-            }).round(2)
-            analysis['campaign_performance'] = category_performance.to_dict()
-        
-        # Market penetration analysis
-        if 'region' in df.columns:
-            region_penetration = df.groupby('region').agg({
-                'customers': 'sum' if 'customers' in df.columns else 'count',
-                'revenue': 'sum'
-            }).round(2)
-            analysis['market_penetration'] = region_penetration.to_dict()
-    
-    # Regional analysis if region data exists
-    if 'region' in df.columns:
-        region_performance = df.groupby('region').agg({
-            'revenue': ['sum', 'mean', 'count']
-        }).round(2)
-        analysis['regional_insights'] = region_performance.to_dict()
-    
-    # Seasonal patterns
-    if date_column in df.columns:
-        try:
-            df[date_column] = pd.to_datetime(df[date_column])
-            df['month'] = df[date_column].dt.month
-            monthly_trends = df.groupby('month')['revenue'].mean() if 'revenue' in df.columns else df.groupby('month')[metric_columns[0]].mean()
-            analysis['seasonal_patterns'] = monthly_trends.to_dict()
-        except:
-            pass
+    print(f"Metric columns: {mapping_config.get('metric_columns', [])}")
+    print(f"Category columns: {mapping_config.get('category_columns', [])}")
+    
+    accumulator = AnalysisAccumulator(mapping_config, agent_name)
+    accumulator.update(df)
+    analysis = accumulator.finalize()
     
     print(f"Comprehensive analysis completed with {len(analysis)} insights")
     return analysis
@@ -333,96 +681,157 @@ def create_agent_specific_prompt(agent_name):
         template=template
     )
 
-def create_analysis_context(analysis_results, agent_name):
+def create_batch_prompt(prompt_template):
+    """
+    Turn an agent-specific article prompt into one asking for article_count distinct
+    articles returned as a JSON array.
+    """
+    template = prompt_template.template + """
+
+        Write {article_count} distinct articles following these instructions, each with a different angle on the data.
+        Respond with only a JSON array of {article_count} strings, one complete article per string, and no other text.
+        """
+    return PromptTemplate(
+        input_variables=["agent_name", "analysis", "article_count"],
+        template=template
+    )
+
+def create_analysis_context(analysis_results, agent_name, max_tokens=None, model_name=LLM_MODEL_NAME):
     """
     Create rich analysis context for AI article generation.
+    With max_tokens, only the most important insights that fit in that many tokens are kept.
     """
-    context_parts = []
-    
+    insights = rank_analysis_insights(analysis_results, agent_name)
+    if max_tokens is None:
+        return "\n".join(text for _, text in insights)
+
+    context_parts, dropped = fit_insights(insights, max_tokens, model_name)
+    if dropped:
+        print(f"Analysis context: kept {len(context_parts)} of {len(insights)} insights to fit {max_tokens} tokens")
+    return "\n".join(context_parts)
+
+def get_analysis_token_budget(chain, agent_name):
+    """
+    Tokens left for the analysis context once the rest of the prompt is counted.
+    """
+    model_name = chain.llm.model_name
+    prompt_values = dict.fromkeys(chain.prompt.input_variables, '')
+    prompt_values['agent_name'] = agent_name
+    prompt_tokens = count_tokens(chain.prompt.format(**prompt_values), model_name)
+    return max(0, get_prompt_token_budget(model_name) - prompt_tokens)
+
+def rank_analysis_insights(analysis_results, agent_name):
+    """
+    One line per analysis insight as (importance, text), in the order they read best.
+    Headline metrics and the agent's own analyses rank highest; per-category detail
+    ranks lowest, by size, so it is the first to go when the prompt budget is tight.
+    """
+    insights = []
+    agent_type = get_agent_type(agent_name)
+
     # Add key metrics summary
     if 'revenue' in analysis_results:
         revenue_data = analysis_results['revenue']
-        context_parts.append(f"Revenue Analysis: Average ${revenue_data['mean']:,.2f}, Growth Rate: {revenue_data['growth_rate']:.1f}%, Trend: {revenue_data['trend_direction']}")
-    
+        insights.append((100, f"Revenue Analysis: Average ${revenue_data['mean']:,.2f}, Growth Rate: {revenue_data['growth_rate']:.1f}%, Trend: {revenue_data['trend_direction']}"))
+
     if 'orders' in analysis_results:
         orders_data = analysis_results['orders']
-        context_parts.append(f"Order Analysis: Average {orders_data['mean']:.0f} orders, Trend: {orders_data['trend_direction']}, Growth: {orders_data['growth_rate']:.1f}%")
-    
+        insights.append((90, f"Order Analysis: Average {orders_data['mean']:.0f} orders, Trend: {orders_data['trend_direction']}, Growth: {orders_data['growth_rate']:.1f}%"))
+
     if 'customers' in analysis_results:
         customers_data = analysis_results['customers']
-        context_parts.append(f"Customer Analysis: Average {customers_data['mean']:.0f} customers, Trend: {customers_data['trend_direction']}")
-    
+        insights.append((85, f"Customer Analysis: Average {customers_data['mean']:.0f} customers, Trend: {customers_data['trend_direction']}"))
+
+    # Other metric columns, the fastest-moving first
+    for metric, data in analysis_results.items():
+        if metric not in ['revenue', 'orders', 'customers'] and isinstance(data, dict) and 'mean' in data:
+            importance = 40 + min(abs(data['growth_rate']), 100) / 10
+            insights.append((importance, f"{metric.replace('_', ' ').title()} Analysis: Average {data['mean']:,.2f}, Growth: {data['growth_rate']:.1f}%, Trend: {data['trend_direction']}"))
+
     # Add category insights for sales agents
-    if agent_name.lower() in ['sales', 'sales agent']:
+    if agent_type == 'sales':
         for key, value in analysis_results.items():
-            if 'insights' in key and isinstance(value, dict):
-                context_parts.append(f"{key.replace('_insights', '').title()} Performance: {len(value)} categories analyzed")
-    
+            if key.endswith('_insights') and key != 'regional_insights' and isinstance(value, dict):
+                name = key.replace('_insights', '').replace('_', ' ').title()
+                insights.append((70, f"{name} Performance: {len(value)} categories analyzed"))
+                totals = {category: data.get('total_revenue', 0) for category, data in value.items()}
+                insights.extend(_top_category_insights(name, totals, "revenue", 30))
+
     # Add financial insights for finance agents
-    if agent_name.lower() in ['finance', 'finance agent']:
+    if agent_type == 'finance':
         if 'profitability' in analysis_results:
             prof_data = analysis_results['profitability']
-            context_parts.append(f"Profitability: Average margin {prof_data['avg_profit_margin']:.2f}, Trend: {prof_data['profit_trend']}")
-        
+            insights.append((80, f"Profitability: Average margin {prof_data['avg_profit_margin']:.2f}, Trend: {prof_data['profit_trend']}"))
+
         if 'cash_flow' in analysis_results:
             cash_data = analysis_results['cash_flow']
-            context_parts.append(f"Cash Flow: Daily change ${cash_data['avg_daily_revenue_change']:.2f}, Stability: {cash_data['cash_flow_stability']}")
-    
+            insights.append((75, f"Cash Flow: Daily change ${cash_data['avg_daily_revenue_change']:.2f}, Stability: {cash_data['cash_flow_stability']}"))
+
     # Add marketing insights for marketing agents
-    if agent_name.lower() in ['marketing', 'marketing agent', 'marketing team', 'digital marketing']:
+    if agent_type == 'marketing':
         if 'marketing_metrics' in analysis_results:
             marketing_data = analysis_results['marketing_metrics']
-            context_parts.append(f"Marketing Metrics: Average Customer Acquisition Cost ${marketing_data['avg_customer_acquisition_cost']:.2f}, Conversion Rate {marketing_data['conversion_rate']:.1f}%")
-        
-        if 'campaign_performance' in analysis_results:
-            context_parts.append(f"Campaign Performance: {len(analysis_results['campaign_performance'])} product categories analyzed")
-        
-        if 'market_penetration' in analysis_results:
-            context_parts.append(f"Market Penetration: {len(analysis_results['market_penetration'])} regions analyzed")
-    
+            insights.append((80, f"Marketing Metrics: Average Customer Acquisition Cost ${marketing_data['avg_customer_acquisition_cost']:.2f}, Conversion Rate {marketing_data['conversion_rate']:.1f}%"))
+
+        revenue_sums = analysis_results.get('campaign_performance', {}).get(('revenue', 'sum'), {})
+        if revenue_sums:
+            insights.append((70, f"Campaign Performance: {len(revenue_sums)} product categories analyzed"))
+            insights.extend(_top_category_insights("Product Category", revenue_sums, "revenue", 30))
+
+        customers = analysis_results.get('market_penetration', {}).get('customers', {})
+        if customers:
+            insights.append((65, f"Market Penetration: {len(customers)} regions analyzed"))
+            insights.extend(_top_category_insights("Region", customers, "customers", 25))
+
     # Add regional insights
     if 'regional_insights' in analysis_results:
-        context_parts.append(f"Regional Analysis: {len(analysis_results['regional_insights'])} regions with performance data")
-    
+        revenue_sums = analysis_results['regional_insights'].get(('revenue', 'sum'), {})
+        insights.append((50, f"Regional Analysis: {len(revenue_sums)} regions with performance data"))
+        insights.extend(_top_category_insights("Region", revenue_sums, "revenue", 20))
+
     # Add seasonal patterns
-    if 'seasonal_patterns' in analysis_results:
+    if analysis_results.get('seasonal_patterns'):
         seasonal_data = analysis_results['seasonal_patterns']
         best_month = max(seasonal_data, key=seasonal_data.get)
         worst_month = min(seasonal_data, key=seasonal_data.get)
-        context_parts.append(f"Seasonal Patterns: Best performance in month {best_month}, lowest in month {worst_month}")
-    
-    return "\n".join(context_parts)
+        insights.append((60, f"Seasonal Patterns: Best performance in month {best_month}, lowest in month {worst_month}"))
+
+    return insights
+
+def _top_category_insights(name, totals, metric, importance, limit=5):
+    ranked = sorted(totals.items(), key=lambda item: item[1], reverse=True)[:limit]
+    # Larger categories rank higher, but always below the summaries above
+    return [
+        (importance - rank, f"{name} #{rank + 1}: {category} with total {metric} {total:,.2f}")
+        for rank, (category, total) in enumerate(ranked)
+    ]
 
 def create_intelligent_default_articles(agent_instance, analysis_results, article_count):
     """
-    Create intelligent default articles when AI API is not available.
+    Create intelligent default articles (unsaved) when AI API is not available.
     These articles are still data-driven and agent-specific.
     """
-    articles_created = 0
+    articles = []
     
     for i in range(article_count):
-        title = f"{agent_instance.agent_instance_name} Analysis Report {i+1} - {datetime.now().strftime('%Y-%m-%d')}"
-        
-        # Create intelligent content based on agent type and analysis
-        if agent_instance.agent_instance_name.lower() in ['finance', 'finance agent', 'financial']:
-            content = create_finance_article_content(agent_instance, analysis_results, i+1)
-        elif agent_instance.agent_instance_name.lower() in ['sales', 'sales agent', 'sales team']:
-            content = create_sales_article_content(agent_instance, analysis_results, i+1)
-        elif agent_instance.agent_instance_name.lower() in ['marketing', 'marketing agent', 'marketing team', 'digital marketing']:
-            content = create_marketing_article_content(agent_instance, analysis_results, i+1)
-        else:
-            content = create_general_article_content(agent_instance, analysis_results, i+1)
-
-            Article.objects.create(
-                id=uuid.uuid4(),
-                title=title,
-                content=content,
-                agent_instance=agent_instance
-            )
-            articles_created += 1
+        content = create_intelligent_default_content(agent_instance, analysis_results, i+1)
+        articles.append(build_generated_article(agent_instance, i+1, content))
         print(f"Created intelligent default article {i+1} for {agent_instance.agent_instance_name}")
 
-        return articles_created
+    return articles
+
+def create_intelligent_default_content(agent_instance, analysis_results, report_num):
+    """
+    Create intelligent content based on agent type and analysis for one report.
+    """
+    if agent_instance.agent_instance_name.lower() in ['finance', 'finance agent', 'financial']:
+        return create_finance_article_content(agent_instance, analysis_results, report_num)
+    elif agent_instance.agent_instance_name.lower() in ['sales', 'sales agent', 'sales team']:
+        return create_sales_article_content(agent_instance, analysis_results, report_num)
+    elif agent_instance.agent_instance_name.lower() in ['marketing', 'marketing agent', 'marketing team', 'digital marketing']:
+        return create_marketing_article_content(agent_instance, analysis_results, report_num)
+    else:
+        return create_general_article_content(agent_instance, analysis_results, report_num)
 
 def create_finance_article_content(agent_instance, analysis_results, report_num):
     """Create finance-specific article content."""
@@ -509,17 +918,36 @@ def create_marketing_article_content(agent_instance, analysis_results, report_nu
     
     # Campaign Performance
     if 'campaign_performance' in analysis_results:
+        # Aggregates are keyed by (metric, statistic), each mapping category -> value
+        campaigns = analysis_results['campaign_performance']
+        revenue_means = campaigns.get(('revenue', 'mean'), {})
+        revenue_counts = campaigns.get(('revenue', 'count'), {})
         context_parts = []
-        for category, data in analysis_results['campaign_performance'].items():
-            context_parts.append(f"Campaign Performance for {category.title()}: Revenue ${data['sum']:.2f}, Avg Revenue ${data['mean']:.2f}, Count {data['count']}")
-        content_parts.append(f"Campaign Performance: {'; '.join(context_parts)}")
+        for category, revenue_sum in campaigns.get(('revenue', 'sum'), {}).items():
+            details = [f"Revenue ${revenue_sum:.2f}"]
+            if category in revenue_means:
+                details.append(f"Avg Revenue ${revenue_means[category]:.2f}")
+            if category in revenue_counts:
+                details.append(f"Count {revenue_counts[category]}")
+            context_parts.append(f"Campaign Performance for {str(category).title()}: {', '.join(details)}")
+        if context_parts:
+            content_parts.append(f"Campaign Performance: {'; '.join(context_parts)}")
     
     # Market Penetration
     if 'market_penetration' in analysis_results:
+        penetration = analysis_results['market_penetration']
+        customers_by_region = penetration.get('customers', {})
+        revenue_by_region = penetration.get('revenue', {})
         context_parts = []
-        for region, data in analysis_results['market_penetration'].items():
-            context_parts.append(f"Market Penetration for {region.title()}: Customers {data['sum']:.0f}, Revenue ${data['sum']:.2f}")
-        content_parts.append(f"Market Penetration: {'; '.join(context_parts)}")
+        for region in dict.fromkeys([*customers_by_region, *revenue_by_region]):
+            details = []
+            if region in customers_by_region:
+                details.append(f"Customers {customers_by_region[region]:.0f}")
+            if region in revenue_by_region:
+                details.append(f"Revenue ${revenue_by_region[region]:.2f}")
+            context_parts.append(f"Market Penetration for {str(region).title()}: {', '.join(details)}")
+        if context_parts:
+            content_parts.append(f"Market Penetration: {'; '.join(context_parts)}")
     
     # Recommendations
     content_parts.append("Recommendations: 1) Optimize customer acquisition channels for lower costs, 2) Focus on high-ROI campaigns, 3) Expand market penetration in regions with potential.")
@@ -1,19 +1,32 @@
 from django.shortcuts import render, get_object_or_404
+from django.http import StreamingHttpResponse
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from .models import Organization, User, AgentInstance, DataSource, Article
+from .models import Organization, User, AgentInstance, DataSource, DataSourceAnalysisState, Article, GenerationJob
 # from .models import Agent  # Temporarily commented out until migrated
 from .serializers import (
     OrganizationSerializer, UserSerializer, 
     # AgentSerializer,  # Temporarily commented out until migrated
     AgentInstanceSerializer,
-    DataSourceSerializer, DataSourceLinkSerializer, ArticleSerializer, ArticleCreateSerializer
+    DataSourceSerializer, DataSourceLinkSerializer, ArticleSerializer, ArticleCreateSerializer,
+    GenerationJobSerializer
 )
-from .utils import generate_articles
-import pandas as pd
+from .utils import generate_articles, get_generation_error, stream_articles
+from .jobs import enqueue_generation_job, get_queue_metrics
+from .article_writer import write_articles
+from .narratives import get_agent_articles, get_article_fields, get_daily_articles, get_timezone, project_articles
+from .pagination import get_pagination_headers, paginate
+from .agent_stats import get_agent_metrics
+from .quotas import get_quota_error
+from .datasource_cache import get_delimiter, get_read_csv_kwargs, invalidate_datasource_cache
+from .csv_stream import read_preview_rows, scan_csv
+from .llm_pool import connection_stats
+from .llm_limits import llm_limiter
+from django.conf import settings
 from django.utils import timezone
 from datetime import datetime
+import json
 
 # Test the import
 print(f"=== VIEWS: generate_articles function imported: {generate_articles} ===")
@@ -36,9 +49,12 @@ class OrganizationCreateView(APIView):
 
 class OrganizationListView(APIView):
     def get(self, request):
-        organizations = Organization.objects.all()
+        try:
+            organizations, next_cursor = paginate(Organization.objects.order_by('id'), request)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
         serializer = OrganizationSerializer(organizations, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return Response(serializer.data, status=status.HTTP_200_OK, headers=get_pagination_headers(request, next_cursor))
 
 class OrganizationDetailView(APIView):
     def get(self, request, id):
@@ -69,9 +85,12 @@ class UserRegisterView(APIView):
 
 class UserListView(APIView):
     def get(self, request):
-        users = User.objects.all()
+        try:
+            users, next_cursor = paginate(User.objects.order_by('id'), request)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
         serializer = UserSerializer(users, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return Response(serializer.data, status=status.HTTP_200_OK, headers=get_pagination_headers(request, next_cursor))
 
 class UserDetailView(APIView):
     def get(self, request, id):
@@ -109,9 +128,12 @@ class AgentInstanceCreateView(APIView):
 
 class AgentInstanceListView(APIView):
     def get(self, request):
-        agent_instances = AgentInstance.objects.all()
+        try:
+            agent_instances, next_cursor = paginate(AgentInstance.objects.order_by('id'), request)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
         serializer = AgentInstanceSerializer(agent_instances, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return Response(serializer.data, status=status.HTTP_200_OK, headers=get_pagination_headers(request, next_cursor))
 
 class AgentInstanceDetailView(APIView):
     def get(self, request, id):
@@ -142,9 +164,12 @@ class DataSourceCreateView(APIView):
 
 class DataSourceListView(APIView):
     def get(self, request):
-        data_sources = DataSource.objects.all()
+        try:
+            data_sources, next_cursor = paginate(DataSource.objects.order_by('id'), request)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
         serializer = DataSourceSerializer(data_sources, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return Response(serializer.data, status=status.HTTP_200_OK, headers=get_pagination_headers(request, next_cursor))
 
 class DataSourceDetailView(APIView):
     def get(self, request, id):
@@ -156,12 +181,15 @@ class DataSourceDetailView(APIView):
         data_source = get_object_or_404(DataSource, id=id)
         serializer = DataSourceSerializer(data_source, data=request.data, partial=True)
         if serializer.is_valid():
+            invalidate_datasource_cache(data_source)
+            DataSourceAnalysisState.objects.filter(datasource=data_source).delete()
             serializer.save()
             return Response(serializer.data, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     def delete(self, request, id):
         data_source = get_object_or_404(DataSource, id=id)
+        invalidate_datasource_cache(data_source)
         data_source.delete()
         return Response({"message": "Data source deleted successfully"}, status=status.HTTP_204_NO_CONTENT)
 
@@ -196,12 +224,15 @@ class DataSourceTestView(APIView):
         if datasource.source_type != 'csv' or not datasource.file:
             return Response({"error": "DataSource must be a CSV with a valid file"}, status=status.HTTP_400_BAD_REQUEST)
         try:
-            df = pd.read_csv(
-                datasource.file.path,
-                delimiter=datasource.connection_params.get('delimiter', ','),
-                encoding=datasource.connection_params.get('encoding', 'utf-8')
-            )
-            return Response({"status": "success", "row_count": len(df)}, status=status.HTTP_200_OK)
+            kwargs = get_read_csv_kwargs(datasource.connection_params)
+            delimiter = get_delimiter(datasource.connection_params)
+            scan = scan_csv(datasource.file.path, encoding=kwargs['encoding'], delimiter=delimiter)
+            if scan['invalid_row_count']:
+                return Response({
+                    "error": f"{scan['invalid_row_count']} rows do not have {scan['column_count']} columns",
+                    **scan
+                }, status=status.HTTP_400_BAD_REQUEST)
+            return Response({"status": "success", **scan}, status=status.HTTP_200_OK)
         except Exception as e:
             return Response({"error": f"Failed to read data source: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
 
@@ -211,12 +242,15 @@ class DataSourcePreviewView(APIView):
         if datasource.source_type != 'csv' or not datasource.file:
             return Response({"error": "DataSource must be a CSV with a valid file"}, status=status.HTTP_400_BAD_REQUEST)
         try:
-            df = pd.read_csv(
-                datasource.file.path,
-                delimiter=datasource.connection_params.get('delimiter', ','),
-                encoding=datasource.connection_params.get('encoding', 'utf-8')
-            )
-            preview_data = df.head(5).to_dict(orient='records')
+            offset = int(request.query_params.get('offset', 0))
+            limit = int(request.query_params.get('limit', 5))
+        except ValueError:
+            return Response({"error": "offset and limit must be integers"}, status=status.HTTP_400_BAD_REQUEST)
+        if offset < 0 or limit < 1:
+            return Response({"error": "offset must be >= 0 and limit must be >= 1"}, status=status.HTTP_400_BAD_REQUEST)
+        limit = min(limit, settings.DATASOURCE_PREVIEW_MAX_LIMIT)
+        try:
+            preview_data = read_preview_rows(datasource, offset=offset, limit=limit)
             return Response(preview_data, status=status.HTTP_200_OK)
         except Exception as e:
             return Response({"error": f"Failed to preview data source: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
@@ -227,34 +261,53 @@ class DailyNarrativesView(APIView):
             date_obj = datetime.strptime(date, '%Y-%m-%d').date()
         except ValueError:
             return Response({"error": "Invalid date format. Use YYYY-MM-DD."}, status=status.HTTP_400_BAD_REQUEST)
-        articles = Article.objects.filter(created_at__date=date_obj)
-        serializer = ArticleSerializer(articles, many=True)
-        return Response({"date": date, "articles": serializer.data}, status=status.HTTP_200_OK)
+        try:
+            tz = get_timezone(request.query_params.get('tz'))
+            fields = get_article_fields(request.query_params)
+            articles, next_cursor = paginate(project_articles(get_daily_articles(date_obj, tz), fields), request)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = ArticleSerializer(articles, many=True, fields=fields)
+        return Response({"date": date, "articles": serializer.data, "next_cursor": next_cursor}, status=status.HTTP_200_OK)
 
 class AgentNarrativesView(APIView):
     def get(self, request, instance_id):
-        articles = Article.objects.filter(agent_instance_id=instance_id)
-        serializer = ArticleSerializer(articles, many=True)
-        return Response({"agent_instance_id": instance_id, "articles": serializer.data}, status=status.HTTP_200_OK)
+        try:
+            fields = get_article_fields(request.query_params)
+            articles, next_cursor = paginate(project_articles(get_agent_articles(instance_id), fields), request)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = ArticleSerializer(articles, many=True, fields=fields)
+        return Response({"agent_instance_id": instance_id, "articles": serializer.data, "next_cursor": next_cursor}, status=status.HTTP_200_OK)
 
 class HealthCheckView(APIView):
     def get(self, request):
         try:
             Article.objects.count()
-            return Response({"status": "healthy", "database": "connected"}, status=status.HTTP_200_OK)
+            return Response({"status": "healthy", "database": "connected", "llm_connections": connection_stats(), "llm_limits": llm_limiter.stats()}, status=status.HTTP_200_OK)
         except Exception:
             return Response({"status": "unhealthy", "database": "disconnected"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
 
 class AgentMetricsView(APIView):
     def get(self, request, id):
-        agent_instance = get_object_or_404(AgentInstance, id=id)
-        articles = Article.objects.filter(agent_instance=agent_instance)
-        total_articles = articles.count()
-        last_run = articles.order_by('-created_at').first().created_at if articles.exists() else None
+        agent_instance = get_object_or_404(AgentInstance.objects.select_related('stats'), id=id)
+        return Response(get_agent_metrics(agent_instance), status=status.HTTP_200_OK)
+
+class OrganizationAgentMetricsView(APIView):
+    """
+    Metrics of all of an organization's agent instances, a page at a time.
+    """
+    def get(self, request, id):
+        organization = get_object_or_404(Organization, id=id)
+        agent_instances = AgentInstance.objects.filter(organization=organization).select_related('stats').order_by('id')
+        try:
+            agent_instances, next_cursor = paginate(agent_instances, request)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
         return Response({
-            "agent_instance_id": id,
-            "total_articles": total_articles,
-            "last_run": last_run
+            "organization_id": organization.id,
+            "agents": [get_agent_metrics(agent_instance) for agent_instance in agent_instances],
+            "next_cursor": next_cursor
         }, status=status.HTTP_200_OK)
 
 class ArticleCreateView(APIView):
@@ -267,29 +320,84 @@ class ArticleCreateView(APIView):
                                 status=status.HTTP_400_BAD_REQUEST)
             agent_instance = get_object_or_404(AgentInstance, id=instance_id)
             articles_data = serializer.validated_data['articles']
-            created_articles = []
+
+            quota_error = None if articles_data else get_quota_error(agent_instance.organization)
+            if quota_error:
+                return Response({"error": quota_error}, status=status.HTTP_429_TOO_MANY_REQUESTS)
 
             if articles_data:
-                for article_data in articles_data:
-                    article = Article.objects.create(
-                        agent_instance=agent_instance,
-                        title=article_data['title'],
-                        content=article_data['content']
-                    )
-                    created_articles.append(article)
+                created_articles = write_articles(
+                    Article(agent_instance=agent_instance, title=article_data['title'], content=article_data['content'])
+                    for article_data in articles_data
+                )
+            elif serializer.validated_data['background']:
+                job = enqueue_generation_job(agent_instance)
+                return Response({
+                    "agent_instance_id": instance_id,
+                    "job": GenerationJobSerializer(job).data
+                }, status=status.HTTP_202_ACCEPTED)
             else:
                 print(f"=== VIEW: About to call generate_articles for agent {instance_id} ===")
-                articles_created = generate_articles(agent_instance)
-                print(f"=== VIEW: generate_articles returned: {articles_created} ===")
+                created_articles = generate_articles(agent_instance)
+                print(f"=== VIEW: generate_articles returned: {len(created_articles)} articles ===")
                 
-                if articles_created == 0:
+                if not created_articles:
                     return Response({"error": "Failed to generate articles. Ensure DataSource and mapping_config are valid."},
                                     status=status.HTTP_400_BAD_REQUEST)
-                created_articles = Article.objects.filter(agent_instance=agent_instance).order_by('-created_at')[:articles_created]
 
             serializer = ArticleSerializer(created_articles, many=True)
             return Response({
                 "agent_instance_id": instance_id,
                 "articles": serializer.data
             }, status=status.HTTP_201_CREATED)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+class ArticleStreamView(APIView):
+    """
+    Generate articles for an agent instance, streaming progress as server-sent events:
+    LLM tokens as they arrive and each article as soon as it is saved.
+    """
+    def post(self, request, instance_id):
+        agent_instance = get_object_or_404(AgentInstance, id=instance_id)
+        error = get_generation_error(agent_instance)
+        if error:
+            return Response({"error": f"{error}. Ensure DataSource and mapping_config are valid."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        quota_error = get_quota_error(agent_instance.organization)
+        if quota_error:
+            return Response({"error": quota_error}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+
+        response = StreamingHttpResponse(self.events(agent_instance), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # Stop nginx from buffering the stream
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    def events(self, agent_instance):
+        try:
+            for event, data in stream_articles(agent_instance):
+                if event == 'keep-alive':
+                    yield ': keep-alive\n\n'
+                    continue
+                if event == 'article':
+                    data = ArticleSerializer(data).data
+                yield f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+        except Exception as e:
+            print(f"ERROR streaming articles for agent {agent_instance.id}: {str(e)}")
+            yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+
+class GenerationJobDetailView(APIView):
+    def get(self, request, id):
+        job = get_object_or_404(GenerationJob, id=id)
+        return Response(GenerationJobSerializer(job).data, status=status.HTTP_200_OK)
+
+class GenerationQueueMetricsView(APIView):
+    """
+    Generation queue depth and wait times per organization.
+    """
+    def get(self, request):
+        return Response({
+            "timestamp": timezone.now().isoformat(),
+            "window_seconds": settings.GENERATION_METRICS_WINDOW_SECONDS,
+            "organizations": get_queue_metrics()
+        }, status=status.HTTP_200_OK)